@@ -4,16 +4,42 @@ import datetime
 import os
 import sys
 import configparser
+import csv
+import argparse
 import webbrowser
 import re
+import socket
 import serial
 import serial.tools.list_ports
 import threading
 import time
+import queue
+import collections
+import copy
+import array
+import struct
+import bisect
+import contextlib
+import math
+import json
+import mmap
+import sqlite3
+import uuid
+import hashlib
+import decimal
+import concurrent.futures
+import asyncio
+import http.client
+import urllib.parse
+import multiprocessing
+from multiprocessing import shared_memory
+import subprocess
+import io
 
 try:
     import pymysql
     import pymysql.cursors
+    from pymysql.constants import SERVER_STATUS
 except ImportError:
     messagebox.showerror(
         "Dependência Faltando",
@@ -28,6 +54,7 @@ try:
     from reportlab.lib.units import cm
     from reportlab.lib.utils import ImageReader
     from reportlab.lib import colors
+    from PIL import Image
 except ImportError:
     messagebox.showerror(
         "Dependência Faltando",
@@ -36,62 +63,2754 @@ except ImportError:
     )
     sys.exit(1)
 
+try:
+    import openpyxl
+except ImportError:
+    # Opcional: sem ela a exportação de dados fica disponível só em CSV
+    openpyxl = None
+
+
+Leitura = collections.namedtuple("Leitura", "valor unidade estavel timestamp")
+
+
+class Metricas:
+    # Contadores e histogramas leves, seguros entre threads; exportáveis em formato Prometheus ou JSON lines
+    LIMITES = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    AMOSTRAS_RECENTES = 1024
+
+    def __init__(self, prefixo="balanca"):
+        self.prefixo = prefixo
+        self.lock = threading.Lock()
+        self.contadores = {}
+        self.histogramas = {}
+
+    def contar(self, nome, quantidade=1, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            self.contadores[chave] = self.contadores.get(chave, 0) + quantidade
+
+    def observar(self, nome, valor, **rotulos):
+        chave = (nome, tuple(sorted(rotulos.items())))
+        with self.lock:
+            histograma = self.histogramas.get(chave)
+            if histograma is None:
+                histograma = self.histogramas[chave] = {
+                    'contagem': 0, 'soma': 0.0, 'baldes': [0] * (len(self.LIMITES) + 1),
+                    'recentes': collections.deque(maxlen=self.AMOSTRAS_RECENTES),
+                }
+            histograma['contagem'] += 1
+            histograma['soma'] += valor
+            histograma['baldes'][bisect.bisect_left(self.LIMITES, valor)] += 1
+            histograma['recentes'].append(valor)
+
+    @contextlib.contextmanager
+    def cronometrar(self, nome, **rotulos):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(nome, time.perf_counter() - inicio, **rotulos)
+
+    def total(self, nome):
+        # Soma de um contador em todos os rótulos
+        with self.lock:
+            return sum(valor for (chave, _), valor in self.contadores.items() if chave == nome)
+
+    def percentis(self, nome, *ps):
+        # Percentis das amostras recentes de um histograma, juntando todos os rótulos
+        with self.lock:
+            amostras = sorted(valor for (chave, _), histograma in self.histogramas.items() if chave == nome
+                              for valor in histograma['recentes'])
+        return tuple(percentil(amostras, p) for p in ps)
+
+    def instantaneo(self):
+        with self.lock:
+            metricas = [{'nome': nome, 'rotulos': dict(rotulos), 'tipo': 'contador', 'valor': valor}
+                        for (nome, rotulos), valor in self.contadores.items()]
+            histogramas = [(nome, dict(rotulos), histograma['contagem'], histograma['soma'],
+                            sorted(histograma['recentes']))
+                           for (nome, rotulos), histograma in self.histogramas.items()]
+        for nome, rotulos, contagem, soma, amostras in histogramas:
+            metricas.append({'nome': nome, 'rotulos': rotulos, 'tipo': 'histograma', 'contagem': contagem,
+                             'soma': soma, 'p50': percentil(amostras, 50), 'p95': percentil(amostras, 95),
+                             'p99': percentil(amostras, 99)})
+        return metricas
+
+    def formato_prometheus(self):
+        def rotulos_texto(rotulos):
+            if not rotulos:
+                return ""
+            pares = ",".join('{}="{}"'.format(chave, str(valor).replace('\\', '\\\\').replace('"', '\\"')
+                                              .replace('\n', '\\n')) for chave, valor in rotulos)
+            return "{" + pares + "}"
+
+        with self.lock:
+            contadores = sorted(self.contadores.items())
+            histogramas = sorted((chave, (h['contagem'], h['soma'], list(h['baldes'])))
+                                 for chave, h in self.histogramas.items())
+        linhas = []
+        tipos_declarados = set()
+        for (nome, rotulos), valor in contadores:
+            nome = f"{self.prefixo}_{nome}"
+            if nome not in tipos_declarados:
+                tipos_declarados.add(nome)
+                linhas.append(f"# TYPE {nome} counter")
+            linhas.append(f"{nome}{rotulos_texto(rotulos)} {valor}")
+        for (nome, rotulos), (contagem, soma, baldes) in histogramas:
+            nome = f"{self.prefixo}_{nome}"
+            if nome not in tipos_declarados:
+                tipos_declarados.add(nome)
+                linhas.append(f"# TYPE {nome} histogram")
+            acumulado = 0
+            for limite, quantidade in zip(self.LIMITES + (float("inf"),), baldes):
+                acumulado += quantidade
+                le = "+Inf" if limite == float("inf") else repr(limite)
+                linhas.append(f"{nome}_bucket{rotulos_texto(rotulos + (('le', le),))} {acumulado}")
+            linhas.append(f"{nome}_sum{rotulos_texto(rotulos)} {soma}")
+            linhas.append(f"{nome}_count{rotulos_texto(rotulos)} {contagem}")
+        return "\n".join(linhas) + "\n"
+
+    def exportar(self, caminho):
+        # .prom: ficheiro de texto para o textfile collector do node_exporter; outro: acrescenta uma linha JSON
+        if caminho.endswith(".prom"):
+            temporario = f"{caminho}.tmp"
+            with open(temporario, "w", encoding="utf-8") as ficheiro:
+                ficheiro.write(self.formato_prometheus())
+            os.replace(temporario, caminho)
+        else:
+            with open(caminho, "a", encoding="utf-8") as ficheiro:
+                ficheiro.write(json.dumps({'timestamp': time.time(), 'metricas': self.instantaneo()}) + "\n")
+
+
+METRICAS = Metricas()
+
+
+class FrameInvalido(ValueError):
+    pass
+
+
+class ParserIndicador:
+    # Cada indicador define como os frames são delimitados e como são interpretados
+    TERMINADOR = b'\r\n'
+    TAMANHO_MAXIMO_BUFFER = 4096
+
+    def extrair_frames(self, buffer):
+        *frames, resto = buffer.split(self.TERMINADOR)
+        if len(resto) > self.TAMANHO_MAXIMO_BUFFER:
+            resto = b""
+        return frames, resto
+
+    def interpretar(self, frame, timestamp):
+        raise NotImplementedError
+
+
+class ParserToledo(ParserIndicador):
+    # Protocolo P03 contínuo: STX, 3 palavras de status, 6 dígitos de peso, 6 de tara, CR e checksum
+    STX = 0x02
+    CR = 0x0D
+    TAMANHO_FRAME = 18
+
+    def __init__(self, usa_checksum=True):
+        self.usa_checksum = usa_checksum
+        self.tamanho = self.TAMANHO_FRAME if usa_checksum else self.TAMANHO_FRAME - 1
+
+    def extrair_frames(self, buffer):
+        frames = []
+        inicio = buffer.find(self.STX)
+        while inicio != -1 and len(buffer) - inicio >= self.tamanho:
+            frame = buffer[inicio:inicio + self.tamanho]
+            if frame[16] == self.CR:
+                frames.append(frame)
+                inicio = buffer.find(self.STX, inicio + self.tamanho)
+            else:
+                # Fora de sincronia: procura o próximo STX
+                inicio = buffer.find(self.STX, inicio + 1)
+        resto = buffer[inicio:] if inicio != -1 else b""
+        return frames, resto
+
+    @staticmethod
+    def _digitos(campo):
+        valor = 0
+        for byte in campo:
+            if byte == 0x20:
+                byte = 0x30
+            elif not 0x30 <= byte <= 0x39:
+                raise FrameInvalido("Dígito inválido no frame Toledo")
+            valor = valor * 10 + byte - 0x30
+        return valor
+
+    def interpretar(self, frame, timestamp):
+        if self.usa_checksum and (sum(frame[:17]) + frame[17]) & 0x7F:
+            raise FrameInvalido("Checksum Toledo inválido")
+        swa, swb = frame[1], frame[2]
+        if swb & 0x04:
+            raise FrameInvalido("Indicador Toledo fora da faixa")
+        # Bits 0-2 da palavra A: posição do ponto decimal (2 = sem casas decimais)
+        valor = self._digitos(frame[4:10]) * 10.0 ** (2 - (swa & 0x07))
+        if swb & 0x02:
+            valor = -valor
+        unidade = "kg" if swb & 0x10 else "lb"
+        return Leitura(valor, unidade, not swb & 0x08, timestamp)
+
+
+class ParserFilizola(ParserIndicador):
+    # Saída contínua: STX, peso em ASCII e ETX; IIIII = instável, NNNNN = negativo, SSSSS = sobrecarga
+    STX = b'\x02'
+    TERMINADOR = b'\x03'
+
+    def interpretar(self, frame, timestamp):
+        inicio = frame.rfind(self.STX)
+        campo = frame[inicio + 1:].strip()
+        if not campo:
+            raise FrameInvalido("Frame Filizola vazio")
+        indicador = campo[:1]
+        if campo == indicador * len(campo) and indicador in b'INS':
+            if indicador == b'S':
+                raise FrameInvalido("Indicador Filizola em sobrecarga")
+            # Em movimento ou negativo: o indicador não envia valor, mas o peso anterior deixa de valer
+            return Leitura(None, "kg", False, timestamp)
+        try:
+            return Leitura(float(campo), "kg", True, timestamp)
+        except ValueError:
+            raise FrameInvalido("Peso Filizola inválido")
+
+
+FATORES_KG = {'kg': 1.0, 'g': 0.001, 't': 1000.0, 'lb': 0.45359237}
+
+
+def leitura_em_kg(leitura):
+    # Os campos de peso da aplicação são sempre em kg, seja qual for a unidade configurada no indicador
+    fator = FATORES_KG.get(leitura.unidade)
+    if fator is None:
+        raise FrameInvalido(f"Unidade de peso desconhecida: {leitura.unidade}")
+    if leitura.unidade == "kg" or leitura.valor is None:
+        return leitura._replace(unidade="kg")
+    return leitura._replace(valor=leitura.valor * fator, unidade="kg")
+
+
+class ParserGenerico(ParserIndicador):
+    # Formatos de linha como "ST,GS,+  1234.5 kg": o peso é sempre o último número antes da unidade
+    RE_PESO = re.compile(rb'([+-]?)\s*(\d+(?:[.,]\d+)?)\s*(kg|t|g|lb)?\s*$', re.IGNORECASE)
+    MARCAS_INSTAVEL = (b'US', b'MO')
+    MARCAS_ESTAVEL = (b'ST',)
+
+    RE_FIM_LINHA = re.compile(rb'\r\n|\r|\n')
+
+    def extrair_frames(self, buffer):
+        # Aceita CR, LF ou CRLF; um CRLF partido entre duas leituras gera apenas uma linha vazia, ignorada
+        *frames, resto = self.RE_FIM_LINHA.split(buffer)
+        if len(resto) > self.TAMANHO_MAXIMO_BUFFER:
+            resto = b""
+        return [frame for frame in frames if frame], resto
+
+    def interpretar(self, frame, timestamp):
+        frame = frame.strip(b' \x00\x02\x03')
+        match = self.RE_PESO.search(frame)
+        if not match:
+            raise FrameInvalido("Frame sem peso reconhecível")
+        sinal, numero, unidade = match.groups()
+        valor = float(numero.replace(b',', b'.'))
+        if sinal == b'-':
+            valor = -valor
+        prefixo = frame[:2].upper()
+        if prefixo in self.MARCAS_INSTAVEL:
+            estavel = False
+        elif prefixo in self.MARCAS_ESTAVEL:
+            estavel = True
+        else:
+            estavel = None
+        return Leitura(valor, (unidade or b'kg').decode('ascii').lower(), estavel, timestamp)
+
+
+PARSERS_INDICADOR = {
+    "toledo": ParserToledo,
+    "filizola": ParserFilizola,
+    "generico": ParserGenerico,
+}
+
+
+def obter_parser(modelo_balanca):
+    modelo = (modelo_balanca or "").lower()
+    for chave, classe_parser in PARSERS_INDICADOR.items():
+        if chave in modelo:
+            return classe_parser()
+    return ParserGenerico()
+
+
+class HistoricoPeso:
+    # Buffer circular de amostras (peso, instante) em arrays de tamanho fixo
+    def __init__(self, capacidade=256):
+        self.capacidade = capacidade
+        self.valores = array.array('d', [0.0]) * capacidade
+        self.instantes = array.array('d', [0.0]) * capacidade
+        self.proximo = 0
+        self.total = 0
+        self.lock = threading.Lock()
+
+    def adicionar(self, valor, instante):
+        with self.lock:
+            self.valores[self.proximo] = valor
+            self.instantes[self.proximo] = instante
+            self.proximo = (self.proximo + 1) % self.capacidade
+            self.total = min(self.total + 1, self.capacidade)
+
+    def janela(self, segundos, agora=None):
+        # Devolve as amostras dos últimos `segundos` (mais recente primeiro) e se a janela está completa
+        agora = time.time() if agora is None else agora
+        limite = agora - segundos
+        amostras = []
+        with self.lock:
+            indice = self.proximo
+            for _ in range(self.total):
+                indice = (indice - 1) % self.capacidade
+                if self.instantes[indice] < limite:
+                    return amostras, True
+                amostras.append(self.valores[indice])
+            # Buffer cheio dentro da janela: há amostras de sobra para avaliar
+            return amostras, self.total == self.capacidade
+
+    def limpar(self):
+        with self.lock:
+            self.proximo = 0
+            self.total = 0
+
+
+class DetectorEstabilidade:
+    def __init__(self, janela=1.5, tolerancia=10.0, minimo_amostras=3):
+        self.janela = janela
+        self.tolerancia = tolerancia
+        self.minimo_amostras = minimo_amostras
+
+    def avaliar(self, historico, leitura=None, agora=None):
+        # Uma única passagem pela janela a cada atualização da interface, e não por amostra recebida
+        amostras, completa = historico.janela(self.janela, agora)
+        if not completa or len(amostras) < self.minimo_amostras:
+            return False, None
+        if leitura is not None and leitura.estavel is False:
+            return False, None
+        if max(amostras) - min(amostras) > self.tolerancia:
+            return False, None
+        return True, amostras[0]
+
+
+class MonitorPortas:
+    # Observa a lista de portas série e acorda quem espera por uma balança quando algo é ligado ou desligado
+    INTERVALO = 0.5
+
+    def __init__(self):
+        self.condicao = threading.Condition()
+        self.versao = 0
+        self.portas = None
+        self._thread = None
+
+    def iniciar(self):
+        with self.condicao:
+            if self._thread is None:
+                self.portas = self._listar()
+                self._thread = threading.Thread(target=self._observar, name="monitor-portas", daemon=True)
+                self._thread.start()
+
+    @staticmethod
+    def _listar():
+        return {porta.device: porta for porta in serial.tools.list_ports.comports()}
+
+    def _observar(self):
+        while True:
+            time.sleep(self.INTERVALO)
+            try:
+                portas = self._listar()
+            except OSError:
+                continue
+            if portas.keys() != self.portas.keys():
+                METRICAS.contar("portas_alteracoes_total")
+                with self.condicao:
+                    self.portas = portas
+                    self.versao += 1
+                    self.condicao.notify_all()
+
+    def listar(self, atual=False):
+        # atual=True consulta o sistema em vez da última lista observada (até INTERVALO segundos atrasada)
+        self.iniciar()
+        return list((self._listar() if atual else self.portas).values())
+
+    def aguardar(self, versao, segundos, parar=lambda: False):
+        # Espera até `segundos`, mas volta logo que a lista de portas mude ou `parar()` seja verdadeiro
+        with self.condicao:
+            self.condicao.wait_for(lambda: self.versao != versao or parar(), segundos)
+
+    def acordar(self):
+        with self.condicao:
+            self.condicao.notify_all()
+
+
+MONITOR_PORTAS = MonitorPortas()
+
+
+def porta_candidata(info):
+    if info.vid is not None:
+        return True
+    descricao = (info.description or "").upper()
+    return "USB" in descricao or "SERIAL" in descricao
+
+
+class LocalizadorPorta:
+    # Resolve o dispositivo atual de uma balança a partir da configuração:
+    #   "COM3" ou "/dev/ttyUSB0"          porta fixa
+    #   "usb:0403:6001[:A50285BI]"        adaptador USB por VID:PID (e número de série)
+    #   "" ou "auto"                      sonda as portas USB/série à procura de frames válidos
+    # Depois da primeira ligação a identificação USB fica memorizada (só se o adaptador tiver número de série)
+    # e a balança é seguida se voltar a aparecer com outro nome (ex.: COM3 -> COM5 ao trocar o cabo de porta)
+
+    def __init__(self, especificacao):
+        self.especificacao = (especificacao or "").strip()
+        self.identidade = None
+        self.fixa = None
+        self.automatica = self.especificacao.lower() in ("", "auto")
+        if self.especificacao.lower().startswith("usb:"):
+            self.identidade = self.interpretar_identidade(self.especificacao[4:])
+        elif not self.automatica:
+            self.fixa = self.especificacao
+
+    @staticmethod
+    def interpretar_identidade(texto):
+        vid, _, resto = texto.partition(':')
+        pid, _, serie = resto.partition(':')
+        try:
+            return int(vid, 16), int(pid, 16), serie or None
+        except ValueError:
+            raise ValueError(f"Identificação USB inválida: {texto!r} (use VID:PID ou VID:PID:SÉRIE)")
+
+    def _corresponde(self, info):
+        vid, pid, serie = self.identidade
+        return info.vid == vid and info.pid == pid and (serie is None or info.serial_number == serie)
+
+    def memorizar(self, porta):
+        if self.identidade:
+            return
+        # Só com número de série: muitos adaptadores FTDI/CH340 não o têm e VID:PID sozinho pode ser
+        # outra balança ou uma impressora com o mesmo adaptador
+        for info in MONITOR_PORTAS.listar(atual=True):
+            if info.device == porta and info.vid is not None and info.serial_number:
+                self.identidade = (info.vid, info.pid, info.serial_number)
+
+    def resolver(self, ignorar=(), sondar=None):
+        if self.identidade:
+            for info in MONITOR_PORTAS.listar():
+                if info.device not in ignorar and self._corresponde(info):
+                    return info.device
+        if self.fixa or not self.automatica:
+            return self.fixa
+        for info in MONITOR_PORTAS.listar():
+            if info.device in ignorar or not porta_candidata(info):
+                continue
+            if sondar is None or sondar(info.device):
+                return info.device
+        return None
+
+
+class GravadorSerial:
+    # Grava os bytes brutos recebidos do indicador, com o instante de chegada, para auditoria de pesagens.
+    # Ficheiros binários "<balança>-AAAAMMDD-HHMMSS.bin": cabeçalho (MAGIA + metadados JSON) seguido de
+    # registos (instante, tamanho, bytes). Roda por dia e por tamanho e apaga os mais antigos
+    MAGIA = b"BALCAP1\n"
+    TAMANHO_METADADOS = struct.Struct("=H")
+    REGISTO = struct.Struct("=dI")
+    INTERVALO_DESCARGA = 1.0
+
+    def __init__(self, pasta, nome, modelo="", tamanho_maximo=10 * 1024 * 1024, ficheiros_maximos=100):
+        self.pasta = pasta
+        self.prefixo = re.sub(r'[^\w-]', '_', nome)
+        self.metadados = {'balanca': nome, 'modelo': modelo}
+        self.tamanho_maximo = tamanho_maximo
+        self.ficheiros_maximos = ficheiros_maximos
+        self.ficheiro = None
+        self.dia = None
+        self.tamanho = 0
+        self._ultima_descarga = 0.0
+        self._por_descarregar = False
+
+    def gravar(self, instante, dados):
+        try:
+            dia = datetime.date.fromtimestamp(instante)
+            if self.ficheiro is None or self.tamanho >= self.tamanho_maximo or dia != self.dia:
+                self._rodar(instante, dia)
+            self.ficheiro.write(self.REGISTO.pack(instante, len(dados)))
+            self.ficheiro.write(dados)
+            self.tamanho += self.REGISTO.size + len(dados)
+            self._por_descarregar = True
+            self.descarregar(instante)
+            METRICAS.contar("captura_bytes_total", len(dados), balanca=self.metadados['balanca'])
+        except OSError:
+            # Disco cheio ou pasta inacessível: a leitura da balança não pode parar por causa da captura
+            METRICAS.contar("captura_erros_total", balanca=self.metadados['balanca'])
+            self.fechar()
+
+    def descarregar(self, instante=None):
+        # Com instante, só se a última descarga tiver mais de INTERVALO_DESCARGA (chamado também quando a
+        # balança fica calada); sem instante, descarrega já (porta perdida)
+        if not self.ficheiro or not self._por_descarregar:
+            return
+        if instante is not None and instante - self._ultima_descarga < self.INTERVALO_DESCARGA:
+            return
+        try:
+            self.ficheiro.flush()
+        except OSError:
+            METRICAS.contar("captura_erros_total", balanca=self.metadados['balanca'])
+            self.fechar()
+            return
+        self._por_descarregar = False
+        self._ultima_descarga = time.time() if instante is None else instante
+
+    def _rodar(self, instante, dia):
+        self.fechar()
+        os.makedirs(self.pasta, exist_ok=True)
+        carimbo = datetime.datetime.fromtimestamp(instante).strftime("%Y%m%d-%H%M%S-%f")[:-3]
+        caminho = os.path.join(self.pasta, f"{self.prefixo}-{carimbo}.bin")
+        metadados = json.dumps(self.metadados).encode('utf-8')
+        self.ficheiro = open(caminho, 'ab')
+        if self.ficheiro.tell() == 0:
+            self.ficheiro.write(self.MAGIA + self.TAMANHO_METADADOS.pack(len(metadados)) + metadados)
+        self.tamanho = self.ficheiro.tell()
+        self.dia = dia
+        self._remover_antigos()
+
+    def _remover_antigos(self):
+        ficheiros = sorted(nome for nome in os.listdir(self.pasta)
+                           if nome.startswith(self.prefixo + "-") and nome.endswith(".bin"))
+        for nome in ficheiros[:-self.ficheiros_maximos]:
+            try:
+                os.remove(os.path.join(self.pasta, nome))
+            except OSError:
+                pass
+
+    def fechar(self):
+        if self.ficheiro:
+            try:
+                self.ficheiro.close()
+            except OSError:
+                pass
+        self.ficheiro = None
+
+
+class LeitorCaptura:
+    # Lê uma captura do GravadorSerial por mmap; um registo incompleto no fim (ficheiro ainda a ser gravado) é ignorado
+    def __init__(self, caminho):
+        self.caminho = caminho
+        with open(caminho, 'rb') as ficheiro:
+            if os.fstat(ficheiro.fileno()).st_size < len(GravadorSerial.MAGIA) + GravadorSerial.TAMANHO_METADADOS.size:
+                raise ValueError(f"Captura vazia ou incompleta: {caminho}")
+            self.mapa = mmap.mmap(ficheiro.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mapa[:len(GravadorSerial.MAGIA)] != GravadorSerial.MAGIA:
+            self.mapa.close()
+            raise ValueError(f"Não é uma captura da balança: {caminho}")
+        posicao = len(GravadorSerial.MAGIA)
+        tamanho, = GravadorSerial.TAMANHO_METADADOS.unpack_from(self.mapa, posicao)
+        posicao += GravadorSerial.TAMANHO_METADADOS.size
+        self.metadados = json.loads(self.mapa[posicao:posicao + tamanho])
+        self.inicio_registos = posicao + tamanho
+
+    def __iter__(self):
+        registo = GravadorSerial.REGISTO
+        posicao = self.inicio_registos
+        fim = len(self.mapa)
+        while posicao + registo.size <= fim:
+            instante, tamanho = registo.unpack_from(self.mapa, posicao)
+            posicao += registo.size
+            if posicao + tamanho > fim:
+                return
+            yield instante, self.mapa[posicao:posicao + tamanho]
+            posicao += tamanho
+
+    def fechar(self):
+        self.mapa.close()
+
+
+class ReproducaoSerial:
+    # Faz-se passar pela porta série e devolve uma captura ao ritmo original ("replay:<ficheiro>" na configuração)
+    def __init__(self, caminho, timeout=0.05, velocidade=1.0):
+        self.captura = LeitorCaptura(caminho)
+        self.registos = iter(self.captura)
+        self.timeout = timeout
+        self.velocidade = velocidade
+        self.pendente = None
+        self.inicio_gravado = None
+        self.inicio_real = time.monotonic()
+        self.is_open = True
+        self.in_waiting = 0
+
+    def reset_input_buffer(self):
+        pass
+
+    def read(self, tamanho=1):
+        registo = self.pendente or next(self.registos, None)
+        if registo is None:
+            # Fim da captura: o leitor volta a "ligar" e a reprodução recomeça
+            raise serial.SerialException("Fim da captura")
+        instante, dados = registo
+        if self.inicio_gravado is None:
+            self.inicio_gravado = instante
+        atraso = 0.0
+        if self.velocidade:
+            atraso = (instante - self.inicio_gravado) / self.velocidade - (time.monotonic() - self.inicio_real)
+        if atraso > self.timeout:
+            time.sleep(self.timeout)
+            self.pendente = registo
+            return b""
+        if atraso > 0:
+            time.sleep(atraso)
+        self.pendente = None
+        return dados
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.registos = iter(())
+            self.captura.fechar()
+
 
 class BalancaReader(threading.Thread):
-    def __init__(self, port, baud_rate=9600):
+    # Tempo máximo que a leitura fica bloqueada na porta à espera de bytes
+    TIMEOUT_LEITURA = 0.05
+    # Espera entre tentativas de ligação: duplica a cada falha, volta ao mínimo quando a porta abre.
+    # Uma alteração na lista de portas (cabo religado) interrompe a espera
+    ESPERA_MINIMA = 0.25
+    ESPERA_MAXIMA = 5.0
+    TEMPO_SONDAGEM = 1.5
+
+    def __init__(self, port, baud_rate=9600, callback=None, parser=None):
         super().__init__()
+        self.localizador = LocalizadorPorta(port)
         self.port = port
         self.baud_rate = baud_rate
+        self.parser = parser or ParserGenerico()
         self.serial_connection = None
         self.peso_atual = "0.00"
+        self.leitura_atual = None
+        self.historico = HistoricoPeso()
+        self.frames_invalidos = 0
+        self.callback = callback
+        # GravadorSerial opcional para guardar os bytes brutos recebidos
+        self.gravador = None
+        # Portas já usadas por outras balanças, que a deteção automática não deve sondar
+        self.portas_ocupadas = lambda: ()
+        # Fila de tamanho 1: guarda apenas a leitura mais recente
+        self.fila_leituras = queue.Queue(maxsize=1)
+        self._buffer = b""
         self.running = True
         self.daemon = True
 
     def run(self):
-        while self.running:
-            if not self.serial_connection or not self.serial_connection.is_open:
+        espera = self.ESPERA_MINIMA
+        try:
+            while self.running:
+                if not self.serial_connection:
+                    versao = MONITOR_PORTAS.versao
+                    if not self._abrir():
+                        MONITOR_PORTAS.aguardar(versao, espera, lambda: not self.running)
+                        espera = min(espera * 2, self.ESPERA_MAXIMA)
+                        continue
+                    espera = self.ESPERA_MINIMA
+
                 try:
-                    self.serial_connection = serial.Serial(
-                        port=self.port,
-                        baudrate=self.baud_rate,
-                        timeout=1
-                    )
-                    time.sleep(2)
-                except serial.SerialException:
-                    self.serial_connection = None
-                    time.sleep(5)
-                    continue
+                    # Bloqueia até chegar pelo menos um byte (ou esgotar o timeout) e lê o resto já disponível
+                    dados = self.serial_connection.read(max(1, self.serial_connection.in_waiting))
+                    if dados:
+                        instante = time.time()
+                        if self.gravador:
+                            self.gravador.gravar(instante, dados)
+                        self._processar_dados(dados, instante)
+                    elif self.gravador:
+                        # Timeout sem dados: os últimos frames não ficam no buffer à espera de uma leitura que não vem
+                        self.gravador.descarregar(time.time())
+                except (serial.SerialException, OSError):
+                    METRICAS.contar("porta_erros_leitura_total", porta=self.port)
+                    self._fechar()
+        finally:
+            self._fechar()
+            if self.gravador:
+                self.gravador.fechar()
+
+    def _abrir(self):
+        porta = self.localizador.resolver(self.portas_ocupadas(), self._sondar)
+        if not porta:
+            METRICAS.contar("porta_falhas_abertura_total", porta=self.localizador.especificacao or "auto")
+            return False
+        try:
+            if porta.lower().startswith("replay:"):
+                self.serial_connection = ReproducaoSerial(porta[7:], timeout=self.TIMEOUT_LEITURA)
+            else:
+                # Abertura exclusiva (flock no POSIX, sempre assim no Windows): outro leitor, mesmo noutro
+                # processo, não consegue abrir nem sondar a mesma porta
+                self.serial_connection = serial.Serial(port=porta, baudrate=self.baud_rate,
+                                                       timeout=self.TIMEOUT_LEITURA, exclusive=True)
+            # Descarta o que o indicador acumulou antes de abrirmos a porta
+            self.serial_connection.reset_input_buffer()
+        except (serial.SerialException, OSError, ValueError):
+            self.serial_connection = None
+            METRICAS.contar("porta_falhas_abertura_total", porta=porta)
+            return False
+        self.port = porta
+        self._buffer = b""
+        self.localizador.memorizar(porta)
+        METRICAS.contar("porta_aberturas_total", porta=porta)
+        return True
+
+    def _sondar(self, porta):
+        # Aceita a porta se, dentro do tempo de sondagem, chegar pelo menos uma leitura válida para o nosso modelo.
+        # Desiste logo que a lista de portas mude: a balança pode ter acabado de ser religada noutra porta
+        parser = copy.copy(self.parser)
+        buffer = b""
+        versao = MONITOR_PORTAS.versao
+        try:
+            with serial.Serial(port=porta, baudrate=self.baud_rate, timeout=self.TIMEOUT_LEITURA,
+                               exclusive=True) as ligacao:
+                limite = time.monotonic() + self.TEMPO_SONDAGEM
+                while self.running and time.monotonic() < limite and MONITOR_PORTAS.versao == versao:
+                    frames, buffer = parser.extrair_frames(buffer + ligacao.read(max(1, ligacao.in_waiting)))
+                    for frame in frames:
+                        try:
+                            if parser.interpretar(frame, time.time()) is not None:
+                                return True
+                        except FrameInvalido:
+                            pass
+        except (serial.SerialException, OSError):
+            pass
+        return False
 
+    def _fechar(self):
+        if self.serial_connection:
+            try:
+                self.serial_connection.close()
+            except (serial.SerialException, OSError):
+                pass
+        self.serial_connection = None
+        if self.gravador:
+            self.gravador.descarregar()
+
+    def _processar_dados(self, dados, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        frames, self._buffer = self.parser.extrair_frames(self._buffer + dados)
+        if frames:
+            METRICAS.contar("frames_total", len(frames), porta=self.port)
+        # Só interessa o frame válido mais recente; os anteriores já estão desatualizados
+        for frame in reversed(frames):
             try:
-                if self.serial_connection.in_waiting > 0:
-                    resposta = self.serial_connection.read_until(b'\r\n')
-                    if resposta:
-                        resposta_decodificada = resposta.decode('utf-8').strip()
-                        match = re.search(r'[\d\.]+', resposta_decodificada)
-                        if match:
-                            self.peso_atual = f"{float(match.group()):.2f}"
-            except (serial.SerialException, Exception):
-                if self.serial_connection:
-                    self.serial_connection.close()
-                self.serial_connection = None
-            time.sleep(0.1)
+                leitura = self.parser.interpretar(frame, timestamp)
+            except FrameInvalido:
+                self.frames_invalidos += 1
+                METRICAS.contar("frames_invalidos_total", porta=self.port)
+                continue
+            if leitura is not None:
+                self._publicar(leitura)
+            break
+
+    def _publicar(self, leitura):
+        leitura = leitura_em_kg(leitura)
+        self.leitura_atual = leitura
+        if leitura.valor is not None:
+            self.historico.adicionar(leitura.valor, leitura.timestamp)
+            self.peso_atual = f"{leitura.valor:.2f}"
+        try:
+            self.fila_leituras.get_nowait()
+        except queue.Empty:
+            pass
+        self.fila_leituras.put_nowait(leitura)
+        if self.callback:
+            self.callback(leitura)
 
     def stop(self):
+        # A porta é fechada pela própria thread ao sair do ciclo (no máximo TIMEOUT_LEITURA depois):
+        # fechá-la daqui a meio de um read() rebentava a thread de leitura
         self.running = False
-        if self.serial_connection and self.serial_connection.is_open:
-            self.serial_connection.close()
+        MONITOR_PORTAS.acordar()
 
     def get_peso(self):
         return self.peso_atual
 
+    def get_leitura(self):
+        return self.leitura_atual
+
+    def conectada(self):
+        return bool(self.serial_connection and self.serial_connection.is_open)
+
+
+class BalancaRemota(BalancaReader):
+    # Recebe o peso publicado por outro posto em modo "servir" (fluxo de eventos HTTP) em vez da porta série
+    TIMEOUT_LIGACAO = 30
+
+    def __init__(self, url, nome, callback=None):
+        super().__init__(url, callback=callback)
+        partes = urllib.parse.urlsplit(url)
+        self.host = partes.hostname
+        self.porta_remota = partes.port or 80
+        # "http://posto:8765/Entrada" lê a balança "Entrada" do servidor; sem caminho usa o nome local
+        self.nome_remoto = urllib.parse.unquote(partes.path.strip('/')) or nome
+        self.ligacao = None
+        self._socket = None
+        # Estado da porta da balança no servidor, recebido em cada evento
+        self._balanca_conectada = False
+
+    def run(self):
+        self._espera = self.ESPERA_MINIMA
+        while self.running:
+            try:
+                self._receber_eventos()
+            except (OSError, ValueError, http.client.HTTPException):
+                METRICAS.contar("remoto_erros_total", origem=self.port)
+            self._fechar_ligacao()
+            if self.running:
+                time.sleep(self._espera)
+                self._espera = min(self._espera * 2, self.ESPERA_MAXIMA)
+
+    def _receber_eventos(self):
+        self.ligacao = http.client.HTTPConnection(self.host, self.porta_remota, timeout=self.TIMEOUT_LIGACAO)
+        self.ligacao.connect()
+        # A resposta fica com o socket depois de o HTTPConnection o largar; guardamo-lo para o stop()
+        self._socket = self.ligacao.sock
+        self.ligacao.request("GET", f"/balancas/{urllib.parse.quote(self.nome_remoto)}/eventos",
+                             headers={"Accept": "text/event-stream"})
+        resposta = self.ligacao.getresponse()
+        if resposta.status != 200:
+            raise ValueError(f"Servidor respondeu {resposta.status} {resposta.reason}")
+        METRICAS.contar("remoto_ligacoes_total", origem=self.port)
+        self._espera = self.ESPERA_MINIMA
+        while self.running:
+            linha = resposta.readline()
+            if not linha:
+                return
+            if not linha.startswith(b"data:"):
+                continue
+            estado = json.loads(linha[5:])
+            self._balanca_conectada = bool(estado.get('conectada'))
+            if not self._balanca_conectada or estado.get('unidade') is None:
+                continue
+            # Instante local: os relógios dos dois postos podem não coincidir e a janela de estabilidade usa o nosso
+            self._publicar(Leitura(estado['valor'], estado['unidade'], estado['estavel'], time.time()))
+
+    def _fechar_ligacao(self):
+        if self.ligacao:
+            self.ligacao.close()
+        self.ligacao = None
+        self._socket = None
+        self._balanca_conectada = False
+
+    def stop(self):
+        self.running = False
+        sock = self._socket
+        if sock:
+            try:
+                # Desbloqueia o readline() da thread de leitura
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def conectada(self):
+        return self._socket is not None and self._balanca_conectada
+
+
+class CanalPeso:
+    # Bloco de memória partilhada com a leitura mais recente e o histórico, escrito só pelo processo da balança.
+    # Seqlock: o contador fica ímpar durante a escrita e quem lê repete se o apanhou ímpar ou se ele mudou
+    SEQUENCIA = struct.Struct("=Q")
+    # valor, instante, estável (-1 = desconhecido), conectada, unidade, próximo, total, dispositivo aberto
+    DADOS = struct.Struct("=ddbB6sII64s")
+    TAMANHO_CABECALHO = SEQUENCIA.size + DADOS.size
+    TENTATIVAS_LEITURA = 1000
+
+    def __init__(self, nome=None, capacidade=256):
+        # O último byte é o pedido de paragem, escrito pela interface fora do seqlock
+        tamanho = self.TAMANHO_CABECALHO + 16 * capacidade + 1
+        self.dono = nome is None
+        self.memoria = shared_memory.SharedMemory(name=nome, create=self.dono, size=tamanho if self.dono else 0)
+        self.capacidade = capacidade
+        inicio = self.TAMANHO_CABECALHO
+        self.valores = self.memoria.buf[inicio:inicio + 8 * capacidade].cast('d')
+        self.instantes = self.memoria.buf[inicio + 8 * capacidade:inicio + 16 * capacidade].cast('d')
+        self._posicao_paragem = inicio + 16 * capacidade
+        # Estado do escritor (só usado no processo da balança)
+        self.lock = threading.Lock()
+        self._sequencia = 0
+        self._leitura = None
+        self._conectada = False
+        self._dispositivo = ""
+        self._proximo = 0
+        self._total = 0
+
+    @property
+    def nome(self):
+        return self.memoria.name
+
+    @contextlib.contextmanager
+    def _escrita(self):
+        with self.lock:
+            self._sequencia += 1
+            self.SEQUENCIA.pack_into(self.memoria.buf, 0, self._sequencia)
+            try:
+                yield
+            finally:
+                leitura = self._leitura or Leitura(0.0, "", None, 0.0)
+                estavel = -1 if leitura.estavel is None else int(leitura.estavel)
+                valor = math.nan if leitura.valor is None else leitura.valor
+                self.DADOS.pack_into(self.memoria.buf, self.SEQUENCIA.size, valor, leitura.timestamp,
+                                     estavel, self._conectada, leitura.unidade.encode('ascii', 'replace'),
+                                     self._proximo, self._total, self._dispositivo.encode('utf-8')[:64])
+                self._sequencia += 1
+                self.SEQUENCIA.pack_into(self.memoria.buf, 0, self._sequencia)
+
+    def publicar(self, leitura):
+        with self._escrita():
+            if leitura.valor is not None:
+                self.valores[self._proximo] = leitura.valor
+                self.instantes[self._proximo] = leitura.timestamp
+                self._proximo = (self._proximo + 1) % self.capacidade
+                self._total = min(self._total + 1, self.capacidade)
+            self._leitura = leitura
+
+    def definir_ligacao(self, conectada, dispositivo):
+        if (conectada, dispositivo) != (self._conectada, self._dispositivo):
+            with self._escrita():
+                self._conectada = conectada
+                self._dispositivo = dispositivo
+
+    def _ler_consistente(self, ler):
+        buf = self.memoria.buf
+        for _ in range(self.TENTATIVAS_LEITURA):
+            sequencia, = self.SEQUENCIA.unpack_from(buf, 0)
+            if sequencia & 1:
+                continue
+            resultado = ler(buf)
+            if self.SEQUENCIA.unpack_from(buf, 0)[0] == sequencia:
+                return sequencia, resultado
+        # Escritor morreu a meio de uma escrita: o supervisor vai substituir o processo
+        return 0, None
+
+    @classmethod
+    def _ler_cabecalho(cls, buf):
+        return cls.DADOS.unpack_from(buf, cls.SEQUENCIA.size)
+
+    def ler(self):
+        # Devolve (sequência, leitura, conectada); a sequência muda a cada escrita
+        try:
+            sequencia, cabecalho = self._ler_consistente(self._ler_cabecalho)
+        except (ValueError, TypeError):
+            return 0, None, False  # canal já fechado
+        if cabecalho is None or not cabecalho[4].rstrip(b"\0"):
+            return sequencia, None, bool(cabecalho and cabecalho[3])
+        valor, instante, estavel, conectada, unidade = cabecalho[:5]
+        leitura = Leitura(None if math.isnan(valor) else valor, unidade.rstrip(b"\0").decode('ascii'),
+                          None if estavel < 0 else bool(estavel), instante)
+        return sequencia, leitura, bool(conectada)
+
+    def dispositivo(self):
+        try:
+            _, cabecalho = self._ler_consistente(self._ler_cabecalho)
+        except (ValueError, TypeError):
+            return ""
+        return cabecalho[7].rstrip(b"\0").decode('utf-8', 'replace') if cabecalho else ""
+
+    def janela(self, segundos, agora=None):
+        # Mesma semântica de HistoricoPeso.janela, lida diretamente do bloco partilhado
+        agora = time.time() if agora is None else agora
+        limite = agora - segundos
+
+        def ler(buf):
+            proximo, total = self._ler_cabecalho(buf)[5:7]
+            amostras = []
+            indice = proximo
+            for _ in range(total):
+                indice = (indice - 1) % self.capacidade
+                if self.instantes[indice] < limite:
+                    return amostras, True
+                amostras.append(self.valores[indice])
+            return amostras, total == self.capacidade
+
+        try:
+            _, resultado = self._ler_consistente(ler)
+        except (ValueError, TypeError):
+            resultado = None
+        return resultado or ([], False)
+
+    def pedir_paragem(self):
+        self.memoria.buf[self._posicao_paragem] = 1
+
+    def paragem_pedida(self):
+        return self.memoria.buf[self._posicao_paragem] == 1
+
+    def fechar(self):
+        self.valores.release()
+        self.instantes.release()
+        self.memoria.close()
+        if self.dono:
+            self.memoria.unlink()
+
+
+class _NovasLeituras:
+    # Imita a fila de tamanho 1 do BalancaReader: get_nowait() só devolve uma leitura ainda não vista
+    def __init__(self, canal):
+        self.canal = canal
+        self.ultima_sequencia = 0
+
+    def get_nowait(self):
+        sequencia, leitura, _ = self.canal.ler()
+        if leitura is None or sequencia == self.ultima_sequencia:
+            raise queue.Empty
+        self.ultima_sequencia = sequencia
+        return leitura
+
+
+def _processo_balanca(nome_canal, capacidade, porta, modelo, nome, pasta_captura, portas_fixas):
+    canal = CanalPeso(nome_canal, capacidade)
+    leitor = BalancaReader(porta, callback=canal.publicar, parser=obter_parser(modelo))
+    # As portas abertas noutros processos ficam protegidas pela abertura exclusiva; as fixas nem se sondam
+    leitor.portas_ocupadas = lambda: portas_fixas
+    if pasta_captura and not porta.lower().startswith("replay:"):
+        leitor.gravador = GravadorSerial(pasta_captura, nome, modelo)
+    leitor.start()
+    pai = multiprocessing.parent_process()
+    try:
+        # Termina com o pedido de paragem ou se a interface morrer sem o enviar
+        while not canal.paragem_pedida() and leitor.is_alive() and (pai is None or pai.is_alive()):
+            canal.definir_ligacao(leitor.conectada(), leitor.port if leitor.conectada() else "")
+            time.sleep(0.5)
+    finally:
+        leitor.stop()
+        leitor.join(1)
+        canal.fechar()
+
+
+class BalancaProcesso:
+    # Corre o BalancaReader num processo próprio para que o trabalho da interface (PDF, BD) não atrase frames.
+    # A interface lê o peso e o histórico do CanalPeso, sem trancas nem mensagens entre processos
+    TIMEOUT_PARAGEM = 2
+
+    def __init__(self, porta, modelo, nome="", pasta_captura=None, portas_fixas=()):
+        self.especificacao = porta
+        self.canal = CanalPeso()
+        self.historico = self.canal
+        self.fila_leituras = _NovasLeituras(self.canal)
+        # Sem Event/Lock de multiprocessing: um processo morto a meio de um wait() deixá-los-ia bloqueados
+        self.processo = multiprocessing.get_context("spawn").Process(
+            target=_processo_balanca, name=f"balanca-{porta}", daemon=True,
+            args=(self.canal.nome, self.canal.capacidade, porta, modelo, nome, pasta_captura, set(portas_fixas)))
+
+    @property
+    def port(self):
+        # Dispositivo que o processo abriu (ex.: "auto" resolvido para COM4), para as outras balanças o evitarem
+        return self.canal.dispositivo() or self.especificacao
+
+    def start(self):
+        self.processo.start()
+
+    def is_alive(self):
+        return self.processo.is_alive()
+
+    def get_leitura(self):
+        return self.canal.ler()[1]
+
+    def get_peso(self):
+        leitura = self.get_leitura()
+        return f"{leitura.valor:.2f}" if leitura and leitura.valor is not None else "0.00"
+
+    def conectada(self):
+        return self.canal.ler()[2]
+
+    def stop(self):
+        self.canal.pedir_paragem()
+        self.processo.join(self.TIMEOUT_PARAGEM)
+        if self.processo.is_alive():
+            self.processo.terminate()
+        self.canal.fechar()
+
+
+class GerenciadorBalancas:
+    # Mantém um leitor por balança configurada e reinicia os que morrerem
+    INTERVALO_SUPERVISAO = 2.0
+
+    def __init__(self, definicoes, callback=None, em_processo=False, pasta_captura=None):
+        self.definicoes = definicoes
+        self.callback = callback
+        # Pasta onde guardar os bytes brutos de cada balança (None = sem captura)
+        self.pasta_captura = pasta_captura or None
+        # Leitores de porta série num processo próprio (o callback não atravessa processos)
+        self.em_processo = em_processo and callback is None
+        self.leitores = {}
+        self.portas = {}
+        self.modelos = {}
+        self.nao_encontradas = []
+        self.lock = threading.Lock()
+        self.running = False
+
     @staticmethod
-    def encontrar_porta_balanca():
-        portas_disponiveis = serial.tools.list_ports.comports()
-        for porta in portas_disponiveis:
-            if "USB" in porta.description.upper() or "SERIAL" in porta.description.upper():
-                return porta.device
+    def interpretar_config(texto, modelo_padrao=""):
+        # Formato: "Entrada=COM3|toledo; Saida=/dev/ttyUSB1|filizola" (porta vazia ou "auto" = deteção automática)
+        # A porta pode ser também "http://posto:8765/Entrada" para ler a balança servida por outro posto
+        definicoes = []
+        for item in (texto or "").split(';'):
+            if not item.strip():
+                continue
+            nome, _, resto = item.partition('=')
+            porta, _, modelo = resto.partition('|')
+            definicoes.append((nome.strip(), porta.strip(), modelo.strip() or modelo_padrao))
+        return definicoes or [("Principal", "", modelo_padrao)]
+
+    def nomes(self):
+        return [nome for nome, _, _ in self.definicoes]
+
+    def obter(self, nome):
+        return self.leitores.get(nome)
+
+    def iniciar(self):
+        # Cada leitor procura a sua porta e volta a ligar-se sozinho; aqui só se avisa do que ainda não está ligado
+        for nome, porta, modelo in self.definicoes:
+            if not porta.lower().startswith("http://"):
+                try:
+                    presente = LocalizadorPorta(porta).resolver(self._portas_ocupadas())
+                except ValueError:
+                    self.nao_encontradas.append(nome)
+                    continue
+                if not presente:
+                    self.nao_encontradas.append(nome)
+            self.portas[nome] = porta
+            self.modelos[nome] = modelo
+            self.leitores[nome] = self._criar_leitor(nome, porta, modelo)
+        self.running = True
+        threading.Thread(target=self._supervisionar, daemon=True).start()
+
+    def _portas_fixas(self):
+        return {porta for _, porta, _ in self.definicoes
+                if porta.lower() not in ("", "auto") and not porta.lower().startswith(("usb:", "http://", "replay:"))}
+
+    def _portas_ocupadas(self, excepto=None):
+        # Portas fixas de outras balanças e portas já abertas pelos outros leitores
+        ocupadas = self._portas_fixas()
+        for leitor in list(self.leitores.values()):
+            if leitor is not excepto and leitor.conectada():
+                ocupadas.add(leitor.port)
+        return ocupadas
+
+    def _criar_leitor(self, nome, porta, modelo):
+        callback = None
+        if self.callback:
+            callback = lambda leitura, nome=nome: self.callback(nome, leitura)
+        if porta.lower().startswith("http://"):
+            leitor = BalancaRemota(porta, nome, callback)
+        elif self.em_processo:
+            leitor = BalancaProcesso(porta, modelo, nome, self.pasta_captura, self._portas_fixas() - {porta})
+        else:
+            leitor = BalancaReader(porta, callback=callback, parser=obter_parser(modelo))
+            leitor.portas_ocupadas = lambda: self._portas_ocupadas(excepto=leitor)
+            leitor.gravador = self._criar_gravador(nome, porta, modelo)
+        leitor.start()
+        return leitor
+
+    def _criar_gravador(self, nome, porta, modelo):
+        if self.pasta_captura and not porta.lower().startswith("replay:"):
+            return GravadorSerial(self.pasta_captura, nome, modelo)
         return None
 
+    def _supervisionar(self):
+        while self.running:
+            time.sleep(self.INTERVALO_SUPERVISAO)
+            with self.lock:
+                for nome, leitor in list(self.leitores.items()):
+                    if self.running and not leitor.is_alive():
+                        leitor.stop()
+                        self.leitores[nome] = self._criar_leitor(nome, self.portas[nome], self.modelos[nome])
+
+    def parar(self):
+        self.running = False
+        with self.lock:
+            for leitor in self.leitores.values():
+                leitor.stop()
+
+
+class ServidorBalancas:
+    # Modo sem interface: um leitor por balança partilhado por vários postos/sistemas através de HTTP.
+    # GET /balancas, /balancas/<nome>, /balancas/<nome>/eventos (Server-Sent Events) e /metricas
+    INTERVALO_ESTADO = 1.0
+    INTERVALO_KEEPALIVE = 15
+    TIMEOUT_PEDIDO = 10
+
+    def __init__(self, definicoes, detector, host="127.0.0.1", porta=8765, pasta_captura=None):
+        self.balancas = GerenciadorBalancas(definicoes, callback=self.ao_ler, pasta_captura=pasta_captura)
+        self.detector = detector
+        self.host = host
+        self.porta = porta
+        self.subscritores = {nome: set() for nome in self.balancas.nomes()}
+        self._novas_leituras = {}
+        self._loop = None
+
+    def ao_ler(self, nome, leitura):
+        # Corre na thread do leitor: só acorda o distribuidor; leituras seguidas são agregadas num único envio
+        try:
+            self._loop.call_soon_threadsafe(self._novas_leituras[nome].set)
+        except RuntimeError:
+            pass  # ciclo já encerrado
+
+    def estado(self, nome):
+        leitor = self.balancas.obter(nome)
+        leitura = leitor.get_leitura() if leitor else None
+        estado = {'balanca': nome, 'conectada': bool(leitor and leitor.is_alive() and leitor.conectada()),
+                  'valor': None, 'unidade': None, 'estavel': None, 'estabilizada': False, 'timestamp': None}
+        if leitura:
+            estabilizada, _ = self.detector.avaliar(leitor.historico, leitura)
+            estado.update(valor=leitura.valor, unidade=leitura.unidade, estavel=leitura.estavel,
+                          estabilizada=estabilizada, timestamp=leitura.timestamp)
+        return estado
+
+    @staticmethod
+    def _evento(estado):
+        return f"data: {json.dumps(estado)}\n\n".encode('utf-8')
+
+    async def _distribuir(self, nome):
+        nova_leitura = self._novas_leituras[nome]
+        anterior = None
+        while True:
+            try:
+                await asyncio.wait_for(nova_leitura.wait(), self.INTERVALO_ESTADO)
+                nova_leitura.clear()
+            except asyncio.TimeoutError:
+                pass
+            estado = self.estado(nome)
+            # Sem leituras novas só se envia quando algo muda (ex.: porta desligada ou peso estabilizado)
+            if estado == anterior or not self.subscritores[nome]:
+                anterior = estado
+                continue
+            anterior = estado
+            # O evento é serializado uma vez para todos os subscritores
+            evento = self._evento(estado)
+            for fila in self.subscritores[nome]:
+                # Cada subscritor guarda apenas o evento mais recente: um cliente lento não atrasa os outros
+                if fila.full():
+                    fila.get_nowait()
+                fila.put_nowait(evento)
+
+    async def _atender(self, leitor, escritor):
+        try:
+            pedido = await asyncio.wait_for(leitor.readline(), self.TIMEOUT_PEDIDO)
+            metodo, caminho, _ = pedido.decode('latin-1').split(' ', 2)
+            while await asyncio.wait_for(leitor.readline(), self.TIMEOUT_PEDIDO) not in (b'\r\n', b'\n', b''):
+                pass
+            partes = [urllib.parse.unquote(parte)
+                      for parte in urllib.parse.urlsplit(caminho).path.strip('/').split('/')]
+            if metodo != 'GET':
+                await self._responder(escritor, "405 Method Not Allowed", {'erro': "Apenas GET"})
+            elif partes in (['balancas'], ['']):
+                await self._responder(escritor, "200 OK", [self.estado(nome) for nome in self.balancas.nomes()])
+            elif len(partes) in (2, 3) and partes[0] == 'balancas' and partes[1] in self.subscritores:
+                if len(partes) == 2:
+                    await self._responder(escritor, "200 OK", self.estado(partes[1]))
+                elif partes[2] == 'eventos':
+                    await self._transmitir(partes[1], escritor)
+                else:
+                    await self._responder(escritor, "404 Not Found", {'erro': "Recurso inexistente"})
+            elif partes == ['metricas']:
+                await self._responder(escritor, "200 OK", METRICAS.formato_prometheus(),
+                                      "text/plain; version=0.0.4; charset=utf-8")
+            else:
+                await self._responder(escritor, "404 Not Found", {'erro': "Recurso inexistente"})
+        except (asyncio.TimeoutError, ValueError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    @staticmethod
+    async def _responder(escritor, status, corpo, tipo="application/json; charset=utf-8"):
+        if not isinstance(corpo, str):
+            corpo = json.dumps(corpo)
+        corpo = corpo.encode('utf-8')
+        escritor.write(f"HTTP/1.1 {status}\r\nContent-Type: {tipo}\r\nContent-Length: {len(corpo)}\r\n"
+                       "Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n".encode('latin-1') + corpo)
+        await escritor.drain()
+
+    async def _transmitir(self, nome, escritor):
+        fila = asyncio.Queue(maxsize=1)
+        self.subscritores[nome].add(fila)
+        METRICAS.contar("servidor_subscricoes_total", balanca=nome)
+        try:
+            escritor.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                           b"Access-Control-Allow-Origin: *\r\nConnection: close\r\n\r\n")
+            # O estado atual vai logo na ligação, sem esperar pela próxima leitura
+            escritor.write(self._evento(self.estado(nome)))
+            await escritor.drain()
+            while True:
+                try:
+                    evento = await asyncio.wait_for(fila.get(), self.INTERVALO_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    evento = b": keepalive\n\n"
+                escritor.write(evento)
+                await escritor.drain()
+        finally:
+            self.subscritores[nome].discard(fila)
+
+    async def executar(self):
+        self._loop = asyncio.get_running_loop()
+        self._novas_leituras = {nome: asyncio.Event() for nome in self.balancas.nomes()}
+        self.balancas.iniciar()
+        if self.balancas.nao_encontradas:
+            print(f"Balança não encontrada: {', '.join(self.balancas.nao_encontradas)}", file=sys.stderr)
+        distribuidores = [asyncio.create_task(self._distribuir(nome)) for nome in self.balancas.nomes()]
+        try:
+            servidor = await asyncio.start_server(self._atender, self.host, self.porta)
+            print(f"A servir {len(self.balancas.leitores)} balança(s) em http://{self.host}:{self.porta}/balancas",
+                  file=sys.stderr)
+            async with servidor:
+                await servidor.serve_forever()
+        finally:
+            for tarefa in distribuidores:
+                tarefa.cancel()
+            self.balancas.parar()
+
+
+def ler_config(caminho):
+    config = configparser.ConfigParser()
+    if os.path.exists(caminho):
+        config.read(caminho, encoding='utf-8')
+        if 'Configuracoes' in config:
+            return dict(config['Configuracoes'])
+    return {}
+
+
+def config_float(config, chave, padrao):
+    try:
+        return float(str(config.get(chave) or padrao).replace(',', '.'))
+    except ValueError:
+        return padrao
+
+
+class PoolConexoes:
+    # Conexões MySQL reutilizáveis: evita o handshake TCP/autenticação a cada operação
+    BACKOFF_INICIAL = 1.0
+    BACKOFF_MAXIMO = 30.0
+
+    def __init__(self, parametros, tamanho_maximo=4, tempo_ocioso_maximo=300, intervalo_ping=5):
+        self.parametros = parametros
+        self.tamanho_maximo = tamanho_maximo
+        self.tempo_ocioso_maximo = tempo_ocioso_maximo
+        self.intervalo_ping = intervalo_ping
+        self.livres = collections.deque()
+        self.em_uso = 0
+        self.condicao = threading.Condition()
+        self.falhas_consecutivas = 0
+        self.proxima_tentativa = 0.0
+        self.saudavel = False
+
+    @classmethod
+    def a_partir_da_config(cls, app_config):
+        return cls({
+            'host': app_config.get('mysql_host'),
+            'user': app_config.get('mysql_user'),
+            'password': app_config.get('mysql_password'),
+            'database': app_config.get('mysql_database'),
+        })
+
+    def obter(self, timeout=5):
+        with self.condicao, METRICAS.cronometrar("bd_pool_espera_segundos"):
+            if not self.condicao.wait_for(lambda: self.livres or self.em_uso < self.tamanho_maximo, timeout):
+                METRICAS.contar("bd_pool_esgotado_total")
+                raise pymysql.err.OperationalError(2003, "Todas as conexões do pool estão ocupadas")
+            self.em_uso += 1
+            item = self.livres.pop() if self.livres else None
+        try:
+            conn = self._validar(item) if item else None
+            return conn or self._conectar()
+        except BaseException:
+            with self.condicao:
+                self.em_uso -= 1
+                self.condicao.notify()
+            raise
+
+    def _validar(self, item):
+        conn, devolvida_em = item
+        # Só faz ping em conexões paradas há algum tempo; as recém-devolvidas seguem direto
+        if time.monotonic() - devolvida_em < self.intervalo_ping:
+            return conn
+        try:
+            conn.ping(reconnect=False)
+            return conn
+        except pymysql.Error:
+            METRICAS.contar("bd_conexoes_descartadas_total")
+            self._fechar(conn)
+            return None
+
+    def _conectar(self):
+        agora = time.monotonic()
+        if agora < self.proxima_tentativa:
+            raise pymysql.err.OperationalError(
+                2003, f"MySQL indisponível; nova tentativa em {self.proxima_tentativa - agora:.0f}s")
+        try:
+            with METRICAS.cronometrar("bd_conexao_segundos"):
+                conn = pymysql.connect(**self.parametros, connect_timeout=5, autocommit=True,
+                                       cursorclass=pymysql.cursors.DictCursor)
+        except pymysql.Error:
+            METRICAS.contar("bd_conexao_falhas_total")
+            self.falhas_consecutivas += 1
+            atraso = min(self.BACKOFF_MAXIMO, self.BACKOFF_INICIAL * 2 ** (self.falhas_consecutivas - 1))
+            self.proxima_tentativa = time.monotonic() + atraso
+            self.saudavel = False
+            raise
+        METRICAS.contar("bd_conexoes_total")
+        self.falhas_consecutivas = 0
+        self.proxima_tentativa = 0.0
+        self.saudavel = True
+        return conn
+
+    def devolver(self, conn):
+        if conn is None:
+            return
+        if conn.open and conn.server_status & SERVER_STATUS.SERVER_STATUS_IN_TRANS:
+            # Transação interrompida por erro: não pode voltar para o pool a meio
+            try:
+                conn.rollback()
+            except pymysql.Error:
+                self._fechar(conn)
+        if not conn.open:
+            self.saudavel = False
+        ociosas = []
+        with self.condicao:
+            if conn.open:
+                self.livres.append((conn, time.monotonic()))
+            self.em_uso -= 1
+            limite = time.monotonic() - self.tempo_ocioso_maximo
+            while self.livres and self.livres[0][1] < limite:
+                ociosas.append(self.livres.popleft()[0])
+            self.condicao.notify()
+        for ociosa in ociosas:
+            self._fechar(ociosa)
+
+    def descartar(self, conn):
+        # Conexão que não pode voltar ao pool, mas sem indicar que o MySQL está em baixo
+        self._fechar(conn)
+        with self.condicao:
+            self.em_uso -= 1
+            self.condicao.notify()
+
+    def verificar_saude(self):
+        conn = None
+        try:
+            conn = self.obter()
+            self.saudavel = True
+        except pymysql.Error:
+            self.saudavel = False
+        finally:
+            self.devolver(conn)
+        return self.saudavel
+
+    @staticmethod
+    def _fechar(conn):
+        try:
+            conn.close()
+        except pymysql.Error:
+            pass
+
+    def fechar(self):
+        with self.condicao:
+            livres, self.livres = list(self.livres), collections.deque()
+        for conn, _ in livres:
+            self._fechar(conn)
+
+
+def _escapar_like(texto):
+    return texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def montar_filtro_tickets(filtro):
+    # Converte o filtro da interface em condições parametrizadas que aproveitam os índices de `tickets`
+    condicoes, params = [], []
+    filtro = filtro or {}
+    if filtro.get('placa'):
+        condicoes.append("placa LIKE %s")
+        params.append(_escapar_like(filtro['placa']) + '%')
+    if filtro.get('motorista'):
+        condicoes.append("motorista LIKE %s")
+        params.append(_escapar_like(filtro['motorista']) + '%')
+    if filtro.get('tipo_carga'):
+        condicoes.append("tipo_carga LIKE %s")
+        params.append(_escapar_like(filtro['tipo_carga']) + '%')
+    if filtro.get('data_inicio'):
+        condicoes.append("data_hora >= %s")
+        params.append(filtro['data_inicio'])
+    if filtro.get('data_fim'):
+        condicoes.append("data_hora < %s")
+        params.append(filtro['data_fim'] + datetime.timedelta(days=1))
+    return condicoes, params
+
+
+CASAS_PESO = decimal.Decimal("0.01")
+
+
+def converter_peso(valor):
+    # Pesos são sempre tratados como DECIMAL com 2 casas, nunca como float
+    try:
+        peso = decimal.Decimal(str(valor).strip().replace(',', '.'))
+    except decimal.InvalidOperation:
+        raise ValueError(f"Peso inválido: {valor!r}")
+    if not peso.is_finite():
+        raise ValueError(f"Peso inválido: {valor!r}")
+    return peso.quantize(CASAS_PESO, rounding=decimal.ROUND_HALF_UP)
+
+
+INDICES = {
+    "tickets": {
+        "idx_tickets_data_hora": "data_hora",
+        "idx_tickets_placa": "placa",
+        "idx_tickets_motorista": "motorista",
+        "idx_tickets_tipo_carga": "tipo_carga",
+    },
+    "pesagens_pendentes": {
+        "idx_pendentes_data_hora_bruto": "data_hora_bruto",
+        "idx_pendentes_placa": "placa",
+    },
+}
+
+
+def _criar_indices_em_falta(cursor):
+    cursor.execute("SELECT DISTINCT TABLE_NAME, INDEX_NAME FROM information_schema.STATISTICS "
+                   "WHERE TABLE_SCHEMA = DATABASE()")
+    existentes = {(row['TABLE_NAME'], row['INDEX_NAME']) for row in cursor.fetchall()}
+    for tabela, indices in INDICES.items():
+        for nome, coluna in indices.items():
+            if (tabela, nome) not in existentes:
+                cursor.execute(f"CREATE INDEX {nome} ON {tabela} ({coluna})")
+
+
+def _adicionar_em_falta(tabela, colunas=None, indices=None):
+    # O DDL do MySQL faz commit a cada instrução: um passo interrompido a meio (ou antes de registar a versão)
+    # tem de poder ser repetido, por isso só se acrescenta o que ainda não existe
+    colunas = colunas or {}
+    indices = indices or {}
+
+    def passo(cursor):
+        cursor.execute("SELECT COLUMN_NAME FROM information_schema.COLUMNS "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (tabela,))
+        colunas_existentes = {row['COLUMN_NAME'] for row in cursor.fetchall()}
+        cursor.execute("SELECT DISTINCT INDEX_NAME FROM information_schema.STATISTICS "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (tabela,))
+        indices_existentes = {row['INDEX_NAME'] for row in cursor.fetchall()}
+        alteracoes = [f"ADD COLUMN {nome} {definicao}" for nome, definicao in colunas.items()
+                      if nome not in colunas_existentes]
+        alteracoes += [f"ADD {definicao}" for nome, definicao in indices.items() if nome not in indices_existentes]
+        if alteracoes:
+            cursor.execute(f"ALTER TABLE {tabela} " + ", ".join(alteracoes))
+
+    return passo
+
+
+def _reconstruir_totais_diarios(cursor):
+    # Recalcula o resumo a partir de tickets; apagar antes torna o passo seguro de repetir
+    cursor.execute("DELETE FROM totais_diarios")
+    cursor.execute("""
+                   INSERT INTO totais_diarios (dia, hora, tipo_carga, origem, destino, motorista, tickets, peso_liquido)
+                   SELECT DATE(data_hora), HOUR(data_hora), IFNULL(tipo_carga, ''), IFNULL(origem, ''),
+                          IFNULL(destino, ''), motorista, COUNT(*), SUM(peso_liquido)
+                   FROM tickets
+                   GROUP BY DATE(data_hora), HOUR(data_hora), IFNULL(tipo_carga, ''), IFNULL(origem, ''),
+                            IFNULL(destino, ''), motorista
+                   """)
+
+
+# Cada migração é aplicada uma única vez e registada em schema_versao; os passos são SQL ou funções(cursor)
+# Tamanho das colunas de texto (migrações 1 e 2): validado nos formulários, antes de a pesagem entrar no diário
+TAMANHOS_CAMPOS = {
+    'placa': ("Placa Cavalo", 20),
+    'placa_carreta': ("Placa Carreta", 20),
+    'motorista': ("Motorista", 100),
+    'origem': ("Origem", 100),
+    'destino': ("Destino", 100),
+    'tipo_carga': ("Tipo de Carga", 100),
+}
+
+
+def validar_tamanhos(dados):
+    # Mensagem para o primeiro campo maior do que a coluna do MySQL, ou None se todos couberem
+    for campo, (rotulo, limite) in TAMANHOS_CAMPOS.items():
+        if len(dados.get(campo) or '') > limite:
+            return f"O campo {rotulo} aceita no máximo {limite} caracteres."
+    return None
+
+
+MIGRACOES = [
+    (1, "Tabelas base", [
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            data_hora DATETIME NOT NULL,
+            placa VARCHAR(20) NOT NULL,
+            placa_carreta VARCHAR(20) NULL,
+            motorista VARCHAR(100) NOT NULL,
+            origem VARCHAR(100) NULL,
+            destino VARCHAR(100) NULL,
+            tipo_carga VARCHAR(100) NULL,
+            peso_tara DECIMAL(12, 2) NOT NULL,
+            peso_bruto DECIMAL(12, 2) NOT NULL,
+            peso_liquido DECIMAL(12, 2) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS pesagens_pendentes (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            data_hora_bruto DATETIME NOT NULL,
+            placa VARCHAR(20) NOT NULL,
+            placa_carreta VARCHAR(20) NULL,
+            motorista VARCHAR(100) NOT NULL,
+            origem VARCHAR(100) NULL,
+            destino VARCHAR(100) NULL,
+            tipo_carga VARCHAR(100) NULL,
+            peso_bruto DECIMAL(12, 2) NOT NULL
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+    ]),
+    (2, "Pesos em DECIMAL e colunas pesquisáveis em VARCHAR", [
+        """
+        ALTER TABLE tickets
+            MODIFY placa VARCHAR(20) NOT NULL,
+            MODIFY motorista VARCHAR(100) NOT NULL,
+            MODIFY tipo_carga VARCHAR(100) NULL,
+            MODIFY peso_tara DECIMAL(12, 2) NOT NULL,
+            MODIFY peso_bruto DECIMAL(12, 2) NOT NULL,
+            MODIFY peso_liquido DECIMAL(12, 2) NOT NULL
+        """,
+        """
+        ALTER TABLE pesagens_pendentes
+            MODIFY placa VARCHAR(20) NOT NULL,
+            MODIFY peso_bruto DECIMAL(12, 2) NOT NULL
+        """,
+    ]),
+    (3, "Índices das consultas do histórico e das pendentes", [
+        _criar_indices_em_falta,
+    ]),
+    (4, "Chaves de idempotência para a sincronização do diário local", [
+        _adicionar_em_falta("pesagens_pendentes",
+                            colunas={"chave_idempotencia": "CHAR(32) NULL"},
+                            indices={"uq_pendentes_chave": "UNIQUE KEY uq_pendentes_chave (chave_idempotencia)"}),
+        _adicionar_em_falta("tickets",
+                            colunas={"chave_idempotencia": "CHAR(32) NULL", "chave_pendente": "CHAR(32) NULL"},
+                            indices={"uq_tickets_chave": "UNIQUE KEY uq_tickets_chave (chave_idempotencia)",
+                                     "idx_tickets_chave_pendente": "KEY idx_tickets_chave_pendente (chave_pendente)"}),
+    ]),
+    (5, "Totais diários mantidos na mesma transação que os tickets", [
+        """
+        CREATE TABLE IF NOT EXISTS totais_diarios (
+            dia DATE NOT NULL,
+            hora TINYINT NOT NULL,
+            tipo_carga VARCHAR(100) NOT NULL,
+            origem VARCHAR(100) NOT NULL,
+            destino VARCHAR(100) NOT NULL,
+            motorista VARCHAR(100) NOT NULL,
+            tickets INT NOT NULL,
+            peso_liquido DECIMAL(14, 2) NOT NULL,
+            PRIMARY KEY (dia, hora, tipo_carga, origem, destino, motorista)
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """,
+        _reconstruir_totais_diarios,
+    ]),
+    (6, "Horas de entrada e de início da saída guardadas no ticket", [
+        _adicionar_em_falta("tickets", colunas={"data_hora_entrada": "DATETIME NULL AFTER data_hora",
+                                                "inicio_saida": "DATETIME NULL AFTER data_hora_entrada"}),
+    ]),
+]
+
+
+class MigradorEsquema:
+    # Cria ou atualiza o esquema no arranque; um lock nomeado evita que dois terminais migrem ao mesmo tempo
+    NOME_LOCK = "balanca_migracao_esquema"
+
+    def __init__(self, pool, migracoes=None):
+        self.pool = pool
+        self.migracoes = MIGRACOES if migracoes is None else migracoes
+
+    def versao_atual(self, cursor):
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS schema_versao (
+                           versao INT PRIMARY KEY,
+                           descricao VARCHAR(255) NOT NULL,
+                           aplicada_em DATETIME NOT NULL
+                       ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+                       """)
+        cursor.execute("SELECT COALESCE(MAX(versao), 0) AS versao FROM schema_versao")
+        return cursor.fetchone()['versao']
+
+    def migrar(self):
+        conn = self.pool.obter()
+        aplicadas = []
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT GET_LOCK(%s, 30) AS obtido", (self.NOME_LOCK,))
+                if not cursor.fetchone()['obtido']:
+                    raise pymysql.err.OperationalError(2003, "Outro terminal está a atualizar o esquema")
+                try:
+                    versao = self.versao_atual(cursor)
+                    for numero, descricao, passos in self.migracoes:
+                        if numero <= versao:
+                            continue
+                        for passo in passos:
+                            if callable(passo):
+                                passo(cursor)
+                            else:
+                                cursor.execute(passo)
+                        cursor.execute("INSERT INTO schema_versao (versao, descricao, aplicada_em) VALUES (%s, %s, NOW())",
+                                       (numero, descricao))
+                        aplicadas.append(numero)
+                finally:
+                    cursor.execute("SELECT RELEASE_LOCK(%s)", (self.NOME_LOCK,))
+        finally:
+            self.pool.devolver(conn)
+        return aplicadas
+
+
+def percentil(valores_ordenados, p):
+    # Percentil pelo método do posto mais próximo
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[max(0, math.ceil(p / 100 * len(valores_ordenados)) - 1)]
+
+
+def tempos_ticket(row):
+    # Minutos no pátio (entrada -> saída) e na balança de saída (abertura da 2ª pesagem -> ticket)
+    def minutos(inicio, fim):
+        if not inicio or not fim:
+            return None
+        return decimal.Decimal((fim - inicio).total_seconds() / 60).quantize(CASAS_PESO)
+    return (minutos(row.get('data_hora_entrada'), row.get('data_hora')),
+            minutos(row.get('inicio_saida'), row.get('data_hora')))
+
+
+def calcular_metricas_patio(tempos, agora, fila=0, mais_antiga=None):
+    patio = sorted((saida - entrada).total_seconds() for entrada, _, saida in tempos if entrada)
+    balanca = sorted((saida - inicio).total_seconds() for _, inicio, saida in tempos if inicio)
+    return {
+        'tickets': len(tempos),
+        'ultima_hora': sum(1 for _, _, saida in tempos if agora - saida <= datetime.timedelta(hours=1)),
+        'patio': (percentil(patio, 50), percentil(patio, 95)),
+        'balanca': (percentil(balanca, 50), percentil(balanca, 95)),
+        'fila': fila,
+        'espera_maxima': (agora - mais_antiga).total_seconds() if mais_antiga else None,
+    }
+
+
+def formatar_duracao(segundos):
+    if segundos is None:
+        return "—"
+    minutos = int(round(segundos / 60))
+    return f"{minutos // 60}h{minutos % 60:02d}" if minutos >= 60 else f"{minutos} min"
+
+
+class RepositorioTickets:
+    # Todo o acesso a tickets e pesagens pendentes; corre nas threads de trabalho, nunca na thread do Tk
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _executar(self, operacao):
+        # Cada operação é uma função local de um método; o nome do método identifica a consulta nas métricas
+        nome = operacao.__qualname__.split('.')[-3]
+        conn = self.pool.obter()
+        try:
+            with conn.cursor() as cursor, METRICAS.cronometrar("bd_operacao_segundos", operacao=nome):
+                return operacao(conn, cursor)
+        except pymysql.Error:
+            METRICAS.contar("bd_operacao_erros_total", operacao=nome)
+            raise
+        finally:
+            self.pool.devolver(conn)
+
+    def alteracoes_pendentes(self, ultimo_id):
+        # Ids ainda pendentes (para detetar remoções) e só as linhas novas desde o último id conhecido
+        def operacao(conn, cursor):
+            cursor.execute("SELECT id FROM pesagens_pendentes")
+            ids = {row['id'] for row in cursor.fetchall()}
+            cursor.execute(
+                "SELECT id, DATE_FORMAT(data_hora_bruto, '%%d/%%m/%%Y %%H:%%i:%%s') as data_hora_fmt, data_hora_bruto, placa, placa_carreta, motorista, origem, destino, tipo_carga, peso_bruto, chave_idempotencia FROM pesagens_pendentes WHERE id > %s ORDER BY id DESC",
+                (ultimo_id,))
+            return ids, cursor.fetchall()
+        return self._executar(operacao)
+
+    def obter_pendente(self, pending_id):
+        def operacao(conn, cursor):
+            cursor.execute("SELECT * FROM pesagens_pendentes WHERE id = %s", (pending_id,))
+            return cursor.fetchone()
+        return self._executar(operacao)
+
+    def pagina_historico(self, limite, antes_de=None, depois_de=None, filtro=None):
+        # Paginação por chave (id): o custo de cada página não depende do tamanho da tabela
+        colunas = "id, DATE_FORMAT(data_hora, '%%d/%%m/%%Y %%H:%%i:%%s') as data_hora_fmt, placa, motorista, tipo_carga, peso_liquido"
+        condicoes, params = montar_filtro_tickets(filtro)
+        ordem = "DESC"
+        if depois_de is not None:
+            condicoes.append("id > %s")
+            params.append(depois_de)
+            ordem = "ASC"
+        elif antes_de is not None:
+            condicoes.append("id < %s")
+            params.append(antes_de)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        sql = f"SELECT {colunas} FROM tickets {where} ORDER BY id {ordem} LIMIT %s"
+        params.append(limite)
+
+        def operacao(conn, cursor):
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            # Devolve sempre do mais recente para o mais antigo
+            return list(reversed(rows)) if depois_de is not None else list(rows)
+        return self._executar(operacao)
+
+    def contar_tickets(self, filtro=None):
+        condicoes, params = montar_filtro_tickets(filtro)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+        def operacao(conn, cursor):
+            cursor.execute(f"SELECT COUNT(*) AS total FROM tickets {where}", params)
+            return cursor.fetchone()['total']
+        return self._executar(operacao)
+
+    def iterar_tickets(self, filtro=None, lote=500):
+        # Cursor do lado do servidor: as linhas chegam em lotes, sem carregar o período inteiro na memória
+        condicoes, params = montar_filtro_tickets(filtro)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        conn = self.pool.obter()
+        try:
+            cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+            cursor.execute(f"SELECT * FROM tickets {where} ORDER BY data_hora, id", params)
+            while True:
+                rows = cursor.fetchmany(lote)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+        except BaseException:
+            # Cancelado ou erro a meio: fechar o cursor obrigava a ler todas as linhas que faltam do servidor
+            self.pool.descartar(conn)
+            raise
+        self.pool.devolver(conn)
+
+    def totais_do_dia(self, dia):
+        # Lê só o resumo já agregado: o custo não depende do tamanho de `tickets`
+        agrupamentos = {
+            'por_carga': ("tipo_carga", "peso_liquido DESC"),
+            'por_rota': ("origem, destino", "peso_liquido DESC"),
+            'por_motorista': ("motorista", "peso_liquido DESC"),
+            'por_hora': ("hora", "hora"),
+        }
+
+        def operacao(conn, cursor):
+            totais = {}
+            for chave, (colunas, ordem) in agrupamentos.items():
+                cursor.execute(f"SELECT {colunas}, SUM(tickets) AS tickets, SUM(peso_liquido) AS peso_liquido "
+                               f"FROM totais_diarios WHERE dia = %s GROUP BY {colunas} ORDER BY {ordem}", (dia,))
+                totais[chave] = cursor.fetchall()
+            return totais
+        return self._executar(operacao)
+
+    def metricas_patio(self, dia):
+        inicio = datetime.datetime.combine(dia, datetime.time())
+
+        def operacao(conn, cursor):
+            cursor.execute("SELECT data_hora_entrada, inicio_saida, data_hora FROM tickets "
+                           "WHERE data_hora >= %s AND data_hora < %s", (inicio, inicio + datetime.timedelta(days=1)))
+            tempos = [(row['data_hora_entrada'], row['inicio_saida'], row['data_hora']) for row in cursor.fetchall()]
+            cursor.execute("SELECT COUNT(*) AS fila, MIN(data_hora_bruto) AS mais_antiga FROM pesagens_pendentes")
+            fila = cursor.fetchone()
+            return calcular_metricas_patio(tempos, datetime.datetime.now(), fila['fila'], fila['mais_antiga'])
+        return self._executar(operacao)
+
+    def obter_ticket(self, ticket_id):
+        def operacao(conn, cursor):
+            cursor.execute("SELECT * FROM tickets WHERE id = %s", (ticket_id,))
+            return cursor.fetchone()
+        return self._executar(operacao)
+
+    def aplicar_operacoes(self, operacoes):
+        # Aplica um lote do diário local numa única transação; operações já aplicadas são ignoradas
+        primeiras = [op for op in operacoes if op['tipo'] == 'primeira_pesagem']
+        finalizacoes = [op for op in operacoes if op['tipo'] == 'finalizacao']
+
+        def chaves_existentes(cursor, sql, chaves):
+            marcadores = ', '.join(['%s'] * len(chaves))
+            cursor.execute(sql.format(marcadores=marcadores), chaves * sql.count('{marcadores}'))
+            return {row['chave'] for row in cursor.fetchall()}
+
+        def operacao(conn, cursor):
+            conn.begin()
+            if primeiras:
+                # Uma entrada já finalizada (e por isso apagada das pendentes) também conta como aplicada
+                aplicadas = chaves_existentes(
+                    cursor,
+                    "SELECT chave_idempotencia AS chave FROM pesagens_pendentes WHERE chave_idempotencia IN ({marcadores}) "
+                    "UNION SELECT chave_pendente AS chave FROM tickets WHERE chave_pendente IN ({marcadores})",
+                    [op['chave'] for op in primeiras])
+                novas = [op for op in primeiras if op['chave'] not in aplicadas]
+                if novas:
+                    cursor.executemany(
+                        "INSERT INTO pesagens_pendentes (data_hora_bruto, placa, placa_carreta, motorista, origem, destino, "
+                        "tipo_carga, peso_bruto, chave_idempotencia) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                        [(d['data_hora_bruto'], d['placa'], d['placa_carreta'], d['motorista'], d['origem'],
+                          d['destino'], d['tipo_carga'], d['peso_bruto'], op['chave'])
+                         for op in novas for d in (op['dados'],)])
+            ticket_ids = {}
+            if finalizacoes:
+                chaves = [op['chave'] for op in finalizacoes]
+                aplicadas = chaves_existentes(
+                    cursor, "SELECT chave_idempotencia AS chave FROM tickets WHERE chave_idempotencia IN ({marcadores})",
+                    chaves)
+                novas = [op for op in finalizacoes if op['chave'] not in aplicadas]
+                if novas:
+                    cursor.executemany(
+                        "INSERT INTO tickets (data_hora, data_hora_entrada, inicio_saida, placa, placa_carreta, motorista, "
+                        "origem, destino, tipo_carga, peso_tara, peso_bruto, peso_liquido, chave_idempotencia, "
+                        "chave_pendente) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                        [(d['data_hora'], d.get('data_hora_entrada'), d.get('inicio_saida'), d['placa'],
+                          d['placa_carreta'], d['motorista'], d['origem'], d['destino'], d['tipo_carga'],
+                          d['peso_tara'], d['peso_bruto'], d['peso_liquido'], op['chave'], d['chave_pendente'])
+                         for op in novas for d in (op['dados'],)])
+                    # O resumo do painel é atualizado na mesma transação, só para os tickets realmente inseridos
+                    cursor.executemany(
+                        "INSERT INTO totais_diarios (dia, hora, tipo_carga, origem, destino, motorista, tickets, "
+                        "peso_liquido) VALUES (DATE(%s), HOUR(%s), %s, %s, %s, %s, 1, %s) "
+                        "ON DUPLICATE KEY UPDATE tickets = tickets + 1, "
+                        "peso_liquido = peso_liquido + VALUES(peso_liquido)",
+                        [(d['data_hora'], d['data_hora'], d['tipo_carga'] or '', d['origem'] or '',
+                          d['destino'] or '', d['motorista'], d['peso_liquido'])
+                         for op in novas for d in (op['dados'],)])
+                cursor.executemany("DELETE FROM pesagens_pendentes WHERE chave_idempotencia = %s OR id = %s",
+                                   [(op['dados']['chave_pendente'], op['dados']['pending_id']) for op in finalizacoes])
+                marcadores = ', '.join(['%s'] * len(chaves))
+                cursor.execute(f"SELECT id, chave_idempotencia FROM tickets WHERE chave_idempotencia IN ({marcadores})",
+                               chaves)
+                ticket_ids = {row['chave_idempotencia']: row['id'] for row in cursor.fetchall()}
+            conn.commit()
+            return ticket_ids
+        return self._executar(operacao)
+
+
+# O MySQL respondeu e recusou a operação: repeti-la nunca vai resultar
+ERROS_DE_DADOS = (pymysql.err.DataError, pymysql.err.IntegrityError)
+
+
+def erro_de_ligacao(erro):
+    # Códigos 2000+ são do cliente (sem ligação, tempo esgotado, pool esgotado): o servidor não chegou a responder
+    if isinstance(erro, pymysql.err.InterfaceError):
+        return True
+    return isinstance(erro, pymysql.err.OperationalError) and bool(erro.args) and erro.args[0] >= 2000
+
+
+class DiarioLocal:
+    # Diário SQLite local: cada pesagem é gravada aqui primeiro (fsync) e só depois replicada para o MySQL
+    def __init__(self, caminho="diario_local.db"):
+        self.caminho = caminho
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(caminho, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.execute("""
+                          CREATE TABLE IF NOT EXISTS operacoes (
+                              seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                              chave TEXT NOT NULL UNIQUE,
+                              tipo TEXT NOT NULL,
+                              dados TEXT NOT NULL,
+                              referencia_id INTEGER,
+                              referencia_chave TEXT,
+                              criado_em TEXT NOT NULL,
+                              sincronizado_em TEXT,
+                              ticket_id INTEGER,
+                              falhou_em TEXT,
+                              erro TEXT
+                          )
+                          """)
+        # Diários criados antes de existir o estado de falha
+        colunas = {row['name'] for row in self.conn.execute("PRAGMA table_info(operacoes)")}
+        for coluna in ('falhou_em', 'erro'):
+            if coluna not in colunas:
+                self.conn.execute(f"ALTER TABLE operacoes ADD COLUMN {coluna} TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_operacoes_por_sincronizar ON operacoes (sincronizado_em, seq)")
+
+    def registrar(self, tipo, dados, referencia_id=None, referencia_chave=None):
+        chave = uuid.uuid4().hex
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO operacoes (chave, tipo, dados, referencia_id, referencia_chave, criado_em) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (chave, tipo, json.dumps(dados, default=str), referencia_id, referencia_chave,
+                 datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        return chave
+
+    def por_sincronizar(self, limite):
+        with self.lock:
+            rows = self.conn.execute("SELECT chave, tipo, dados FROM operacoes "
+                                     "WHERE sincronizado_em IS NULL AND falhou_em IS NULL "
+                                     "ORDER BY seq LIMIT ?", (limite,)).fetchall()
+        return [{'chave': row['chave'], 'tipo': row['tipo'], 'dados': json.loads(row['dados'])} for row in rows]
+
+    def marcar_sincronizadas(self, chaves, ticket_ids):
+        agora = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.conn.execute("BEGIN")
+            self.conn.executemany("UPDATE operacoes SET sincronizado_em = ?, ticket_id = ? WHERE chave = ?",
+                                  [(agora, ticket_ids.get(chave), chave) for chave in chaves])
+            self.conn.execute("COMMIT")
+
+    def marcar_falhada(self, chave, erro):
+        # Recusada pelo MySQL (dados inválidos): sai da fila para não bloquear as operações seguintes
+        with self.lock:
+            self.conn.execute("UPDATE operacoes SET falhou_em = ?, erro = ? WHERE chave = ?",
+                              (datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"), erro, chave))
+
+    def total_por_sincronizar(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM operacoes "
+                                     "WHERE sincronizado_em IS NULL AND falhou_em IS NULL").fetchone()[0]
+
+    def total_falhadas(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM operacoes WHERE falhou_em IS NOT NULL").fetchone()[0]
+
+    def erro(self, chave):
+        with self.lock:
+            row = self.conn.execute("SELECT erro FROM operacoes WHERE chave = ?", (chave,)).fetchone()
+        return row['erro'] if row else None
+
+    def ticket_id(self, chave):
+        with self.lock:
+            row = self.conn.execute("SELECT ticket_id FROM operacoes WHERE chave = ?", (chave,)).fetchone()
+        return row['ticket_id'] if row else None
+
+    def dados_operacao(self, chave):
+        with self.lock:
+            row = self.conn.execute("SELECT dados FROM operacoes WHERE chave = ?", (chave,)).fetchone()
+        return json.loads(row['dados']) if row else None
+
+    def primeiras_pesagens_locais(self):
+        # Entradas ainda não enviadas ao MySQL e que também não foram finalizadas localmente
+        with self.lock:
+            rows = self.conn.execute("""
+                                     SELECT chave, dados FROM operacoes p
+                                     WHERE p.tipo = 'primeira_pesagem' AND p.sincronizado_em IS NULL
+                                       AND p.falhou_em IS NULL
+                                       AND NOT EXISTS (SELECT 1 FROM operacoes f
+                                                       WHERE f.tipo = 'finalizacao' AND f.referencia_chave = p.chave)
+                                     ORDER BY seq DESC
+                                     """).fetchall()
+        return [(row['chave'], json.loads(row['dados'])) for row in rows]
+
+    def pendentes_finalizados_localmente(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT referencia_id, referencia_chave FROM operacoes "
+                                     "WHERE tipo = 'finalizacao' AND sincronizado_em IS NULL "
+                                     "AND falhou_em IS NULL").fetchall()
+        return ({row['referencia_id'] for row in rows if row['referencia_id'] is not None},
+                {row['referencia_chave'] for row in rows if row['referencia_chave']})
+
+    def limpar_sincronizadas(self, dias=30):
+        limite = (datetime.datetime.now() - datetime.timedelta(days=dias)).strftime("%Y-%m-%d %H:%M:%S")
+        with self.lock:
+            self.conn.execute("DELETE FROM operacoes WHERE sincronizado_em IS NOT NULL AND sincronizado_em < ?",
+                              (limite,))
+
+
+class SincronizadorDiario:
+    # Reenvia o diário para o MySQL em lotes; a chave de idempotência garante que nada é inserido duas vezes
+    LOTE = 200
+
+    def __init__(self, diario):
+        self.diario = diario
+        self.lock = threading.Lock()
+
+    def sincronizar(self, repositorio):
+        # Devolve (operações sincronizadas, [(operação, erro)] das que o MySQL recusou nesta passagem)
+        with self.lock, METRICAS.cronometrar("sincronizacao_segundos"):
+            sincronizadas = 0
+            recusadas = []
+            while True:
+                operacoes = self.diario.por_sincronizar(self.LOTE)
+                if not operacoes:
+                    return sincronizadas, recusadas
+                try:
+                    ticket_ids = repositorio.aplicar_operacoes(operacoes)
+                    aplicadas = operacoes
+                except ERROS_DE_DADOS:
+                    aplicadas, ticket_ids = self._aplicar_uma_a_uma(repositorio, operacoes, recusadas)
+                self.diario.marcar_sincronizadas([op['chave'] for op in aplicadas], ticket_ids)
+                METRICAS.contar("sincronizacao_operacoes_total", len(aplicadas))
+                sincronizadas += len(aplicadas)
+                if len(operacoes) < self.LOTE:
+                    return sincronizadas, recusadas
+
+    def _aplicar_uma_a_uma(self, repositorio, operacoes, recusadas):
+        # O lote foi revertido por causa de uma operação com dados inválidos: isola-a e segue com as outras
+        aplicadas = []
+        ticket_ids = {}
+        try:
+            for op in operacoes:
+                try:
+                    ticket_ids.update(repositorio.aplicar_operacoes([op]))
+                except ERROS_DE_DADOS as erro:
+                    self.diario.marcar_falhada(op['chave'], str(erro))
+                    METRICAS.contar("sincronizacao_recusadas_total")
+                    recusadas.append((op, erro))
+                else:
+                    aplicadas.append(op)
+        except pymysql.Error:
+            # Ligação perdida a meio: as já aplicadas ficam marcadas, as restantes seguem na próxima passagem
+            self.diario.marcar_sincronizadas([op['chave'] for op in aplicadas], ticket_ids)
+            raise
+        return aplicadas, ticket_ids
+
+
+class ExecutorTarefas:
+    # Executa funções num pool de threads e entrega os resultados na thread do Tk via master.after
+    INTERVALO_ENTREGA = 30
+
+    def __init__(self, master, executor=None, criar_executor=None):
+        # Com criar_executor, um pool que deixou de funcionar (processo morto) é substituído por um novo
+        self.master = master
+        self.criar_executor = criar_executor
+        self.executor = executor or criar_executor()
+        self.resultados = queue.Queue()
+        self.master.after(self.INTERVALO_ENTREGA, self._entregar_resultados)
+
+    def submeter(self, funcao, *args, ao_concluir=None, ao_falhar=None):
+        executor = self.executor
+        try:
+            future = executor.submit(funcao, *args)
+        except concurrent.futures.BrokenExecutor as erro:
+            if not self._substituir_executor(executor):
+                future = concurrent.futures.Future()
+                future.set_exception(erro)
+            else:
+                executor = self.executor
+                future = executor.submit(funcao, *args)
+        # A falha chega sempre por ao_falhar, na próxima entrega, e não como exceção dentro do callback do Tk
+        future.add_done_callback(lambda f: self.resultados.put((f, executor, ao_concluir, ao_falhar)))
+        return future
+
+    def _substituir_executor(self, executor):
+        if not self.criar_executor:
+            return False
+        # Várias tarefas do mesmo pool falham ao mesmo tempo: só a primeira o substitui
+        if executor is self.executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = self.criar_executor()
+        return True
+
+    def _entregar_resultados(self):
+        try:
+            while True:
+                try:
+                    future, executor, ao_concluir, ao_falhar = self.resultados.get_nowait()
+                except queue.Empty:
+                    break
+                if future.cancelled():
+                    continue
+                erro = future.exception()
+                if isinstance(erro, concurrent.futures.BrokenExecutor):
+                    self._substituir_executor(executor)
+                if erro is None:
+                    if ao_concluir:
+                        ao_concluir(future.result())
+                elif ao_falhar:
+                    ao_falhar(erro)
+        finally:
+            self.master.after(self.INTERVALO_ENTREGA, self._entregar_resultados)
+
+    def encerrar(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+EstadoBalanca = collections.namedtuple("EstadoBalanca", "conectada valor unidade estabilizada peso_estavel")
+BALANCA_DESCONECTADA = EstadoBalanca(False, None, None, False, None)
+
+
+class DistribuidorPeso:
+    # Um único ciclo after() recolhe as leituras de todas as balanças e avisa os subscritores
+    # só quando o que mostram muda (peso, unidade, estabilidade ou ligação)
+    INTERVALO = 50
+
+    def __init__(self, master, balancas, avaliar):
+        self.master = master
+        self.balancas = balancas
+        self.avaliar = avaliar
+        self.estados = {}
+        self._leituras = {}
+        self._subscritores = {}
+        self._proxima_subscricao = 0
+        self._agendado = None
+
+    def subscrever(self, callback, widget=None):
+        # callback(nome, estado); com um widget, a subscrição termina quando ele é destruído
+        self._proxima_subscricao += 1
+        subscricao = self._proxima_subscricao
+        self._subscritores[subscricao] = callback
+        if widget is not None:
+            widget.bind("<Destroy>", lambda event: event.widget is widget and self.cancelar(subscricao), add="+")
+        return subscricao
+
+    def cancelar(self, subscricao):
+        self._subscritores.pop(subscricao, None)
+
+    def estado(self, nome):
+        return self.estados.get(nome)
+
+    def iniciar(self):
+        self._ciclo()
+
+    def parar(self):
+        if self._agendado:
+            self.master.after_cancel(self._agendado)
+            self._agendado = None
+
+    def _ciclo(self):
+        self._agendado = self.master.after(self.INTERVALO, self._ciclo)
+        for nome in self.balancas.nomes():
+            estado = self._avaliar(nome, self.balancas.obter(nome))
+            if estado == self.estados.get(nome):
+                continue
+            self.estados[nome] = estado
+            for callback in list(self._subscritores.values()):
+                callback(nome, estado)
+
+    def _avaliar(self, nome, leitor):
+        # Os leitores continuam vivos enquanto tentam voltar a ligar-se: o que conta é a porta estar aberta
+        if not leitor or not leitor.is_alive() or not leitor.conectada():
+            self._leituras.pop(nome, None)
+            return BALANCA_DESCONECTADA
+        try:
+            self._leituras[nome] = leitor.fila_leituras.get_nowait()
+        except queue.Empty:
+            pass
+        leitura = self._leituras.get(nome)
+        if leitura is None:
+            return EstadoBalanca(True, None, None, False, None)
+        # A estabilidade é avaliada uma vez por balança e ciclo, seja qual for o número de janelas abertas
+        estabilizada, peso = self.avaliar(leitor.historico, leitura)
+        return EstadoBalanca(True, leitura.valor, leitura.unidade, estabilizada, peso)
+
+
+def definir_botao_pendente(botao, pendente, texto="A processar..."):
+    if pendente:
+        botao.texto_original = botao.cget("text")
+        botao.config(state="disabled", text=texto)
+    else:
+        botao.config(state="normal", text=getattr(botao, "texto_original", botao.cget("text")))
+
+
+CAMPOS_CABECALHO = ('nome', 'cnpj', 'endereco', 'contato', 'logopath', 'modelo_balanca')
+LOGO_DPI = 300
+_LOGOS_PDF = {}
+
+
+def versao_cabecalho(config):
+    # Muda sempre que o save_config altera os dados da empresa ou o ficheiro do logo é trocado
+    logo_path = config.get('logopath')
+    try:
+        estado = os.stat(logo_path) if logo_path else None
+        estado_logo = (estado.st_mtime_ns, estado.st_size) if estado else None
+    except OSError:
+        estado_logo = None
+    return tuple(config.get(campo, '') for campo in CAMPOS_CABECALHO) + (estado_logo,)
+
+
+def obter_logo(config, versao):
+    # O logo é reduzido à resolução de impressão e guardado já em JPEG uma vez por versão da configuração:
+    # o reportlab embute um JPEG tal como está, enquanto uma imagem PIL voltaria a ser comprimida em cada PDF
+    if versao not in _LOGOS_PDF:
+        _LOGOS_PDF.clear()
+        logo = None
+        logo_path = config.get('logopath')
+        if logo_path and os.path.exists(logo_path):
+            try:
+                imagem = Image.open(logo_path)
+                imagem.load()
+                imagem.thumbnail((round(4 / 2.54 * LOGO_DPI), round(2 / 2.54 * LOGO_DPI)))
+                if imagem.mode not in ("RGB", "L"):
+                    # O JPEG não tem transparência: o logo é impresso sobre papel branco
+                    imagem = imagem.convert("RGBA")
+                    fundo = Image.new("RGB", imagem.size, "white")
+                    fundo.paste(imagem, mask=imagem)
+                    imagem = fundo
+                dados = io.BytesIO()
+                imagem.save(dados, "JPEG", quality=90)
+                logo = dados.getvalue()
+            except Exception:
+                logo = None
+        _LOGOS_PDF[versao] = logo
+    logo = _LOGOS_PDF[versao]
+    return ImageReader(io.BytesIO(logo)) if logo else None
+
+
+def desenhar_cabecalho_ticket(c, config, logo):
+    # Parte fixa de uma via (cabeçalho, rótulos, moldura e rodapé), desenhada a partir de y = 0
+    largura, _ = A4
+    x_margin = 1.5 * cm
+
+    # --- Cabeçalho ---
+    y_pos = -1.5 * cm
+    if logo is not None:
+        # Posiciona o logo no canto esquerdo
+        c.drawImage(logo, x_margin, y_pos - 1 * cm, width=4 * cm, height=2 * cm, preserveAspectRatio=True,
+                    anchor='nw')
+
+    # Informações da empresa alinhadas à direita
+    c.setFont("Helvetica-Bold", 14)
+    c.drawRightString(largura - x_margin, y_pos, config.get('nome', 'NOME DA EMPRESA'))
+    c.setFont("Helvetica", 9)
+    c.drawRightString(largura - x_margin, y_pos - 0.5 * cm, f"CNPJ: {config.get('cnpj', '')}")
+    c.drawRightString(largura - x_margin, y_pos - 1 * cm, config.get('endereco', ''))
+    c.drawRightString(largura - x_margin, y_pos - 1.5 * cm, f"Contato: {config.get('contato', '')}")
+
+    # --- Título ---
+    c.setFont("Helvetica-Bold", 18)
+    c.drawCentredString(largura / 2, -4 * cm, "TICKET DE PESAGEM")
+    c.line(x_margin, -5.5 * cm, largura - x_margin, -5.5 * cm)
+
+    # --- Rótulos do grid (2 colunas) ---
+    c.setFont("Helvetica-Bold", 9)
+    rotulos = (("Placa Cavalo:", "Placa Carreta:"), ("Motorista:", "Tipo de Carga:"), ("Origem:", "Destino:"))
+    for linha, (rotulo1, rotulo2) in enumerate(rotulos):
+        y = -6.2 * cm - linha * 0.6 * cm
+        c.drawString(x_margin, y, rotulo1)
+        c.drawString(x_margin + 9 * cm, y, rotulo2)
+
+    # --- Seção de Pesos ---
+    c.roundRect(x_margin, -11.9 * cm, largura - (2 * x_margin), 3.5 * cm, 5, stroke=1, fill=0)
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(x_margin + 0.5 * cm, -9.2 * cm, "Peso Bruto:")
+    c.drawString(x_margin + 0.5 * cm, -10 * cm, "Peso Tara:")
+    c.line(x_margin + 0.5 * cm, -10.2 * cm, largura - x_margin - 0.5 * cm, -10.2 * cm)
+    c.setFont("Helvetica-Bold", 16)
+    c.setFillColor(colors.red)
+    c.drawString(x_margin + 0.5 * cm, -11 * cm, "Peso Líquido:")
+    c.setFillColor(colors.black)
+
+    # --- Assinatura ---
+    y_assinatura = -(A4[1] / 2) + (2 * cm)
+    c.line(largura / 2 - 5 * cm, y_assinatura, largura / 2 + 5 * cm, y_assinatura)
+    c.setFont("Helvetica", 9)
+    c.drawCentredString(largura / 2, y_assinatura - 0.4 * cm, "Assinatura do Motorista")
+
+    # --- Modelo da Balança ---
+    modelo = config.get('modelo_balanca', '')
+    if modelo:
+        c.setFont("Helvetica", 8)
+        c.drawCentredString(largura / 2, -(A4[1] / 2) + (1 * cm), f"Equipamento de Pesagem: {modelo}")
+
+
+def desenhar_via_ticket(c, data, start_y, title):
+    # Esta função desenha o conteúdo variável de uma única via do ticket sobre o cabeçalho já reutilizado
+    largura, _ = A4
+    x_margin = 1.5 * cm
+
+    c.setFont("Helvetica-Oblique", 10)
+    c.drawCentredString(largura / 2, start_y - 4.5 * cm, title)
+
+    # --- Informações do Ticket (ID e Data) ---
+    y_pos = start_y - 5 * cm
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(x_margin, y_pos, f"Ticket ID: {data['id']}")
+    c.drawRightString(largura - x_margin, y_pos, f"Data/Hora: {data['data_hora'].strftime('%d/%m/%Y %H:%M:%S')}")
+
+    # --- Detalhes em Grid (2 colunas) ---
+    valores = ((data.get('placa', ''), data.get('placa_carreta', 'N/A')),
+               (data.get('motorista', ''), data.get('tipo_carga', '')),
+               (data.get('origem', ''), data.get('destino', '')))
+    c.setFont("Helvetica", 10)
+    for linha, (valor1, valor2) in enumerate(valores):
+        y = start_y - 6.2 * cm - linha * 0.6 * cm
+        c.drawString(x_margin + 2.5 * cm, y, str(valor1))
+        c.drawString(x_margin + 11.5 * cm, y, str(valor2))
+
+    # --- Pesos ---
+    x_pesos = largura - x_margin - 0.5 * cm
+    c.setFont("Helvetica-Bold", 12)
+    c.drawRightString(x_pesos, start_y - 9.2 * cm, f"{data.get('peso_bruto', 0):.2f} kg")
+    c.drawRightString(x_pesos, start_y - 10 * cm, f"{data.get('peso_tara', 0):.2f} kg")
+    c.setFont("Helvetica-Bold", 16)
+    c.setFillColor(colors.red)
+    c.drawRightString(x_pesos, start_y - 11 * cm, f"{data.get('peso_liquido', 0):.2f} kg")
+    c.setFillColor(colors.black)
+
+
+def desenhar_pagina_ticket(c, config, data):
+    largura, altura = A4
+
+    # O cabeçalho fixo é gravado uma única vez por documento como form XObject e reutilizado em todas as vias
+    if not c.hasForm("cabecalho_ticket"):
+        c.beginForm("cabecalho_ticket", lowerx=0, lowery=-altura / 2, upperx=largura, uppery=0)
+        desenhar_cabecalho_ticket(c, config, obter_logo(config, versao_cabecalho(config)))
+        c.endForm()
+
+    for start_y, title in ((altura, "VIA DA EMPRESA"), (altura / 2, "VIA DO CAMINHONEIRO")):
+        c.saveState()
+        c.translate(0, start_y)
+        c.doForm("cabecalho_ticket")
+        c.restoreState()
+        desenhar_via_ticket(c, data, start_y, title)
+
+    # Linha divisória
+    c.setDash(3, 3)  # Linha pontilhada
+    c.line(1 * cm, altura / 2, largura - 1 * cm, altura / 2)
+    c.setDash([], 0)  # Reseta para linha sólida
+
+
+def criar_pdf_ticket(filename, config, data):
+    c = canvas.Canvas(filename, pagesize=A4)
+    desenhar_pagina_ticket(c, config, data)
+    c.save()
+
+
+def nome_ficheiro_ticket(record):
+    # Sanitize driver's name for filename
+    motorista_nome = (record.get('motorista') or 'sem_nome').strip().replace(' ', '_')
+    # Remove any characters that are not alphanumeric or underscore
+    motorista_nome_safe = re.sub(r'[^\w_]', '', motorista_nome)
+    data_hora_str = record.get('data_hora').strftime("%Y%m%d_%H%M%S")
+    return f"{motorista_nome_safe}_{data_hora_str}.pdf"
+
+
+def gerar_pdf_ticket(pasta, config, record, nome=None):
+    # Corre num processo separado: o reportlab não segura o GIL da interface
+    os.makedirs(pasta, exist_ok=True)
+    filename = os.path.abspath(os.path.join(pasta, nome or nome_ficheiro_ticket(record)))
+    criar_pdf_ticket(filename, config, record)
+    return filename
+
+
+class CachePdf:
+    # PDFs guardados pelo id do ticket e pelo hash do registo e da versão do layout/cabeçalho;
+    # uma reimpressão serve o ficheiro existente e a pasta é limitada por tamanho (LRU pela data de modificação)
+    VERSAO_LAYOUT = 1
+
+    def __init__(self, pasta="tickets_pdf", tamanho_maximo=200 * 1024 * 1024):
+        self.pasta = pasta
+        self.tamanho_maximo = tamanho_maximo
+
+    def caminho(self, record, config):
+        conteudo = json.dumps(record, default=str, sort_keys=True) + repr(versao_cabecalho(config))
+        resumo = hashlib.sha256(f"{self.VERSAO_LAYOUT}|{conteudo}".encode('utf-8')).hexdigest()[:16]
+        nome = f"{record['id']:06d}_{nome_ficheiro_ticket(record)[:-len('.pdf')]}_{resumo}.pdf"
+        return os.path.abspath(os.path.join(self.pasta, nome))
+
+    def obter(self, record, config):
+        caminho = self.caminho(record, config)
+        try:
+            # Marca o ficheiro como usado recentemente
+            os.utime(caminho)
+        except FileNotFoundError:
+            return None
+        return caminho
+
+    def gerar(self, record, config):
+        # Corre no processo de PDFs; o ficheiro só aparece com o nome final depois de completo
+        caminho = self.caminho(record, config)
+        os.makedirs(self.pasta, exist_ok=True)
+        temporario = f"{caminho}.{os.getpid()}.tmp"
+        try:
+            criar_pdf_ticket(temporario, config, record)
+            os.replace(temporario, caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+        self._remover_versoes_antigas(record['id'], caminho)
+        self.limitar_tamanho(manter=caminho)
+        return caminho
+
+    def _remover_versoes_antigas(self, ticket_id, atual):
+        prefixo = f"{ticket_id:06d}_"
+        for entrada in os.scandir(self.pasta):
+            if entrada.name.startswith(prefixo) and entrada.name.endswith(".pdf") and entrada.path != atual:
+                try:
+                    os.remove(entrada.path)
+                except OSError:
+                    pass
+
+    def limitar_tamanho(self, manter=None):
+        ficheiros = []
+        for entrada in os.scandir(self.pasta):
+            if entrada.is_file() and entrada.name.endswith(".pdf"):
+                estado = entrada.stat()
+                ficheiros.append((estado.st_mtime, estado.st_size, entrada.path))
+        total = sum(tamanho for _, tamanho, _ in ficheiros)
+        for _, tamanho, caminho in sorted(ficheiros):
+            if total <= self.tamanho_maximo:
+                break
+            if caminho == manter:
+                continue
+            try:
+                os.remove(caminho)
+                total -= tamanho
+            except OSError:
+                pass
+
+
+def abrir_ficheiro(caminho):
+    # Abre o visualizador sem esperar que ele termine
+    if sys.platform == "win32":
+        os.startfile(caminho)
+    elif sys.platform == "darwin":
+        subprocess.Popen(["open", caminho], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    else:
+        subprocess.Popen(["xdg-open", caminho], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                         start_new_session=True)
+
+
+def acumular_resumo(resumo, record):
+    resumo['total'] += 1
+    peso = converter_peso(record.get('peso_liquido') or 0)
+    resumo['peso_liquido'] += peso
+    carga = resumo['por_carga'].setdefault(record.get('tipo_carga') or "Sem carga", [0, decimal.Decimal(0)])
+    carga[0] += 1
+    carga[1] += peso
+
+
+def desenhar_resumo_exportacao(c, config, resumo, filtro):
+    largura, altura = A4
+    x_margin = 1.5 * cm
+    inicio, fim = filtro.get('data_inicio'), filtro.get('data_fim')
+    periodo = (f"{inicio.strftime('%d/%m/%Y') if inicio else 'início'} até "
+               f"{fim.strftime('%d/%m/%Y') if fim else 'hoje'}")
+
+    y_pos = altura - 2 * cm
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(x_margin, y_pos, config.get('nome', 'NOME DA EMPRESA'))
+    y_pos -= 1 * cm
+    c.setFont("Helvetica-Bold", 18)
+    c.drawCentredString(largura / 2, y_pos, "RESUMO DA EXPORTAÇÃO")
+    y_pos -= 1 * cm
+    c.setFont("Helvetica", 10)
+    c.drawString(x_margin, y_pos, f"Período: {periodo}")
+    c.drawRightString(largura - x_margin, y_pos,
+                      f"Gerado em: {datetime.datetime.now().strftime('%d/%m/%Y %H:%M:%S')}")
+    y_pos -= 0.7 * cm
+    c.setFont("Helvetica-Bold", 11)
+    c.drawString(x_margin, y_pos, f"Tickets: {resumo['total']}")
+    c.drawRightString(largura - x_margin, y_pos, f"Peso Líquido Total: {resumo['peso_liquido']:.2f} kg")
+    y_pos -= 0.5 * cm
+    c.line(x_margin, y_pos, largura - x_margin, y_pos)
+
+    def cabecalho_tabela(y):
+        c.setFont("Helvetica-Bold", 10)
+        c.drawString(x_margin, y, "Tipo de Carga")
+        c.drawRightString(largura - x_margin - 5 * cm, y, "Tickets")
+        c.drawRightString(largura - x_margin, y, "Peso Líquido (kg)")
+        c.setFont("Helvetica", 10)
+        return y - 0.6 * cm
+
+    y_pos = cabecalho_tabela(y_pos - 0.8 * cm)
+    for tipo_carga, (quantidade, peso) in sorted(resumo['por_carga'].items()):
+        if y_pos < 2 * cm:
+            c.showPage()
+            y_pos = cabecalho_tabela(altura - 2 * cm)
+        c.drawString(x_margin, y_pos, str(tipo_carga))
+        c.drawRightString(largura - x_margin - 5 * cm, y_pos, str(quantidade))
+        c.drawRightString(largura - x_margin, y_pos, f"{peso:.2f}")
+        y_pos -= 0.5 * cm
+    c.showPage()
+
+
+def _processo_pdf_unico(caminho, config, filtro, entrada, saida):
+    # Processo dedicado ao documento único: desenha cada lote à medida que chega e o resumo no fim
+    try:
+        c = canvas.Canvas(caminho, pagesize=A4)
+        while True:
+            tipo, conteudo = entrada.get()
+            if tipo == 'lote':
+                for record in conteudo:
+                    desenhar_pagina_ticket(c, config, record)
+                    c.showPage()
+                saida.put(('progresso', len(conteudo)))
+            elif tipo == 'fim':
+                desenhar_resumo_exportacao(c, config, conteudo, filtro)
+                c.save()
+                saida.put(('fim', None))
+                return
+            else:
+                saida.put(('fim', None))
+                return
+    except Exception as e:
+        saida.put(('erro', str(e)))
+
+
+class ExportadorPdf:
+    # Exporta os tickets de um período: um PDF por ticket num pool de processos, ou um documento único com resumo
+    LOTE = 100
+
+    def __init__(self, repositorio, config, processos=None):
+        self.repositorio = repositorio
+        self.config = dict(config)
+        self.processos = processos or os.cpu_count() or 2
+        self.contexto = multiprocessing.get_context("spawn")
+
+    def exportar(self, filtro, destino, unico=False, progresso=None, cancelar=None):
+        cancelar = cancelar or threading.Event()
+        progresso = progresso or (lambda feitos, total: None)
+        resumo = {'total': 0, 'peso_liquido': decimal.Decimal(0), 'por_carga': {}, 'cancelado': False}
+        total = self.repositorio.contar_tickets(filtro)
+        progresso(0, total)
+        if unico:
+            self._exportar_unico(filtro, destino, resumo, total, progresso, cancelar)
+        else:
+            self._exportar_individual(filtro, destino, resumo, total, progresso, cancelar)
+        resumo['cancelado'] = cancelar.is_set()
+        return resumo
+
+    def _exportar_individual(self, filtro, pasta, resumo, total, progresso, cancelar):
+        feitos = 0
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.processos, mp_context=self.contexto) as executor:
+            em_curso = set()
+            for record in self.repositorio.iterar_tickets(filtro):
+                if cancelar.is_set():
+                    break
+                acumular_resumo(resumo, record)
+                nome = f"{record['id']:06d}_{nome_ficheiro_ticket(record)}"
+                em_curso.add(executor.submit(gerar_pdf_ticket, pasta, self.config, record, nome))
+                # Limita os tickets em memória: a leitura do cursor acompanha o ritmo dos processos
+                if len(em_curso) >= self.processos * 4:
+                    prontos, em_curso = concurrent.futures.wait(
+                        em_curso, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in prontos:
+                        future.result()
+                    feitos += len(prontos)
+                    progresso(feitos, total)
+            if cancelar.is_set():
+                for future in em_curso:
+                    future.cancel()
+            for future in concurrent.futures.as_completed(em_curso):
+                if not future.cancelled():
+                    future.result()
+                    feitos += 1
+                    progresso(feitos, total)
+
+    def _exportar_unico(self, filtro, caminho, resumo, total, progresso, cancelar):
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(pasta, exist_ok=True)
+        entrada = self.contexto.Queue(maxsize=4)
+        saida = self.contexto.Queue()
+        processo = self.contexto.Process(target=_processo_pdf_unico,
+                                         args=(caminho, self.config, filtro, entrada, saida), daemon=True)
+        processo.start()
+        feitos = 0
+
+        def receber(bloquear):
+            nonlocal feitos
+            while True:
+                try:
+                    tipo, valor = saida.get(timeout=0.5) if bloquear else saida.get_nowait()
+                except queue.Empty:
+                    if bloquear and processo.is_alive():
+                        continue
+                    if bloquear:
+                        raise RuntimeError("O processo de geração do PDF terminou inesperadamente")
+                    return False
+                if tipo == 'erro':
+                    raise RuntimeError(valor)
+                if tipo == 'fim':
+                    return True
+                feitos += valor
+                progresso(feitos, total)
+
+        def enviar(mensagem):
+            while True:
+                receber(False)
+                try:
+                    entrada.put(mensagem, timeout=0.5)
+                    return
+                except queue.Full:
+                    if not processo.is_alive():
+                        raise RuntimeError("O processo de geração do PDF terminou inesperadamente")
+
+        try:
+            lote = []
+            for record in self.repositorio.iterar_tickets(filtro):
+                if cancelar.is_set():
+                    break
+                acumular_resumo(resumo, record)
+                lote.append(record)
+                if len(lote) >= self.LOTE:
+                    enviar(('lote', lote))
+                    lote = []
+            if cancelar.is_set():
+                enviar(('cancelar', None))
+            else:
+                if lote:
+                    enviar(('lote', lote))
+                enviar(('fim', {chave: valor for chave, valor in resumo.items() if chave != 'cancelado'}))
+            receber(True)
+        finally:
+            processo.join(timeout=5)
+            if processo.is_alive():
+                processo.terminate()
+
+
+COLUNAS_EXPORTACAO = [
+    ("id", "ID Ticket"), ("data_hora_entrada", "Entrada"), ("data_hora", "Data/Hora"), ("placa", "Placa Cavalo"),
+    ("placa_carreta", "Placa Carreta"),
+    ("motorista", "Motorista"), ("origem", "Origem"), ("destino", "Destino"), ("tipo_carga", "Tipo de Carga"),
+    ("peso_bruto", "Peso Bruto (kg)"), ("peso_tara", "Peso Tara (kg)"), ("peso_liquido", "Peso Líquido (kg)"),
+    ("tempo_patio_min", "Tempo no Pátio (min)"), ("tempo_saida_min", "Tempo na Balança de Saída (min)"),
+]
+
+
+def _linhas_csv(rows):
+    # Formato do Excel em português: datas DD/MM/AAAA e vírgula decimal
+    for row in rows:
+        linha = []
+        for coluna, _ in COLUNAS_EXPORTACAO:
+            valor = row.get(coluna)
+            if isinstance(valor, datetime.datetime):
+                valor = valor.strftime("%d/%m/%Y %H:%M:%S")
+            elif isinstance(valor, decimal.Decimal):
+                valor = f"{valor:.2f}".replace('.', ',')
+            linha.append("" if valor is None else valor)
+        yield linha
+
+
+def exportar_tickets_dados(repositorio, filtro, caminho, progresso=None, cancelar=None):
+    # Escreve as linhas à medida que chegam do cursor do servidor: a memória não cresce com o período
+    formato = os.path.splitext(caminho)[1].lower()
+    if formato not in (".csv", ".xlsx"):
+        raise ValueError("Formato não suportado: use um ficheiro .csv ou .xlsx")
+    if formato == ".xlsx" and openpyxl is None:
+        raise RuntimeError("A biblioteca 'openpyxl' é necessária para exportar em XLSX.\n"
+                           "Por favor, instale-a executando:\npip install openpyxl")
+    cancelar = cancelar or threading.Event()
+    progresso = progresso or (lambda feitos: None)
+    total = 0
+
+    def contar(rows):
+        nonlocal total
+        for row in rows:
+            if cancelar.is_set():
+                return
+            row['tempo_patio_min'], row['tempo_saida_min'] = tempos_ticket(row)
+            yield row
+            total += 1
+            if total % 1000 == 0:
+                progresso(total)
+
+    rows = contar(repositorio.iterar_tickets(filtro))
+    cabecalho = [titulo for _, titulo in COLUNAS_EXPORTACAO]
+    try:
+        if formato == ".csv":
+            with open(caminho, "w", newline="", encoding="utf-8-sig") as ficheiro:
+                escritor = csv.writer(ficheiro, delimiter=";")
+                escritor.writerow(cabecalho)
+                escritor.writerows(_linhas_csv(rows))
+        else:
+            # write_only: cada linha vai directamente para o ficheiro, sem manter a folha em memória
+            livro = openpyxl.Workbook(write_only=True)
+            folha = livro.create_sheet("Tickets")
+            folha.append(cabecalho)
+            for row in rows:
+                folha.append([row.get(coluna) for coluna, _ in COLUNAS_EXPORTACAO])
+            livro.save(caminho)
+    except BaseException:
+        rows.close()
+        if os.path.exists(caminho):
+            os.remove(caminho)
+        raise
+    if cancelar.is_set():
+        os.remove(caminho)
+    progresso(total)
+    return total
+
 
 class SegundaPesagemWindow(tk.Toplevel):
     def __init__(self, parent_app, pending_id, pending_data):
@@ -99,6 +2818,9 @@ class SegundaPesagemWindow(tk.Toplevel):
         self.parent_app = parent_app
         self.pending_id = pending_id
         self.pending_data = pending_data
+        self.aberto_em = datetime.datetime.now()
+        self.balanca = tk.StringVar(value=parent_app.balanca_selecionada.get())
+        self._captura_armada = True
         self.is_tara_first_flow = float(self.pending_data.get('peso_bruto', 0)) < 0
         self.title("Registar 2ª Pesagem")
         self.geometry("450x500" if self.is_tara_first_flow else "450x420")
@@ -107,7 +2829,9 @@ class SegundaPesagemWindow(tk.Toplevel):
         self.grab_set()
         self.create_widgets()
         self.second_weight_entry.focus()
-        self.update_live_weight()
+        parent_app.distribuidor_peso.subscrever(self._peso_atualizado, widget=self)
+        self.balanca.trace_add("write", self._balanca_alterada)
+        self._balanca_alterada()
 
     def create_widgets(self):
         main_frame = ttk.Frame(self, padding="15")
@@ -121,7 +2845,7 @@ class SegundaPesagemWindow(tk.Toplevel):
             ttk.Label(info_frame, text=f"Placa Carreta: {self.pending_data.get('placa_carreta', '')}").pack(anchor="w")
 
         if self.is_tara_first_flow:
-            stored_tara = abs(float(self.pending_data.get('peso_bruto', 0)))
+            stored_tara = abs(converter_peso(self.pending_data.get('peso_bruto', 0)))
             ttk.Label(info_frame, text=f"Peso Tara (1ª Pesagem): {stored_tara:.2f} kg").pack(anchor="w", pady=(5, 0))
         else:
             if self.pending_data.get('tipo_carga'):
@@ -137,6 +2861,9 @@ class SegundaPesagemWindow(tk.Toplevel):
 
         live_weight_frame = ttk.LabelFrame(main_frame, text="Leitura da Balança", padding="10")
         live_weight_frame.pack(fill="x", pady=10)
+        if len(self.parent_app.balancas.nomes()) > 1:
+            ttk.Combobox(live_weight_frame, textvariable=self.balanca, values=self.parent_app.balancas.nomes(),
+                         state="readonly", width=20).pack(anchor="w")
         self.live_weight_label = ttk.Label(live_weight_frame, text="Conectando...", font=("Arial", 18, "bold"))
         self.live_weight_label.pack(fill="x", pady=5, padx=5)
 
@@ -161,21 +2888,42 @@ class SegundaPesagemWindow(tk.Toplevel):
             self.second_weight_entry = ttk.Entry(second_weighing_frame, width=20, font=("Arial", 10))
             self.second_weight_entry.grid(row=0, column=1)
 
+        ttk.Checkbutton(main_frame, text="Captura automática ao estabilizar",
+                        variable=self.parent_app.captura_automatica).pack(anchor="w")
+
         self.finalize_button = ttk.Button(main_frame, text="Finalizar e Gerar Ticket", command=self.finalizar_pesagem,
                                           style="Success.TButton")
         self.finalize_button.pack(pady=10)
 
-    def update_live_weight(self):
-        if self.parent_app.balanca_reader and self.parent_app.balanca_reader.is_alive():
-            peso = self.parent_app.balanca_reader.get_peso()
-            self.live_weight_label.config(text=f"{peso} kg")
-            self.after(500, self.update_live_weight)
-        else:
+    def _balanca_alterada(self, *args):
+        nome = self.balanca.get()
+        estado = self.parent_app.distribuidor_peso.estado(nome)
+        if estado:
+            self._peso_atualizado(nome, estado)
+
+    def _peso_atualizado(self, nome, estado):
+        if nome != self.balanca.get():
+            return
+        if not estado.conectada:
             self.live_weight_label.config(text="Balança Desconectada")
+        elif estado.valor is not None:
+            self.live_weight_label.config(text=f"{estado.valor:.2f} {estado.unidade}")
+        elif estado.unidade:
+            # Indicador em movimento ou com peso negativo: não há valor para mostrar
+            self.live_weight_label.config(text=f"--- {estado.unidade}")
+        self._verificar_captura_automatica(estado)
+
+    def _verificar_captura_automatica(self, estado):
+        if not self._captura_armada or not self.parent_app.captura_automatica.get():
+            return
+        if (estado.estabilizada and abs(estado.peso_estavel) >= self.parent_app.peso_minimo_captura
+                and not self.second_weight_entry.get().strip()):
+            self.second_weight_entry.insert(0, f"{estado.peso_estavel:.2f}")
+            self._captura_armada = False
 
     def finalizar_pesagem(self):
         self.finalize_button.config(state="disabled")
-        second_weight_str = self.second_weight_entry.get().strip().replace(',', '.')
+        second_weight_str = self.second_weight_entry.get().strip()
 
         try:
             if self.is_tara_first_flow:
@@ -185,8 +2933,8 @@ class SegundaPesagemWindow(tk.Toplevel):
                                            parent=self)
                     self.finalize_button.config(state="normal")
                     return
-                peso_bruto = float(second_weight_str)
-                peso_tara = abs(float(self.pending_data.get('peso_bruto', 0)))
+                peso_bruto = converter_peso(second_weight_str)
+                peso_tara = abs(converter_peso(self.pending_data.get('peso_bruto', 0)))
                 if peso_bruto <= 0 or peso_bruto <= peso_tara:
                     messagebox.showerror("Erro de Validação", "Peso Bruto inválido ou menor/igual à Tara.", parent=self)
                     self.finalize_button.config(state="normal")
@@ -196,8 +2944,8 @@ class SegundaPesagemWindow(tk.Toplevel):
                     messagebox.showwarning("Campo Vazio", "Por favor, insira o Peso Tara.", parent=self)
                     self.finalize_button.config(state="normal")
                     return
-                peso_tara = float(second_weight_str)
-                peso_bruto = float(self.pending_data.get('peso_bruto', 0))
+                peso_tara = converter_peso(second_weight_str)
+                peso_bruto = converter_peso(self.pending_data.get('peso_bruto', 0))
                 tipo_carga = self.pending_data.get('tipo_carga')
                 if peso_tara <= 0 or peso_bruto <= peso_tara:
                     messagebox.showerror("Erro de Validação", "Valores de peso inválidos.", parent=self)
@@ -210,45 +2958,153 @@ class SegundaPesagemWindow(tk.Toplevel):
 
         peso_liquido = peso_bruto - peso_tara
         data_hora_final = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        conn = None
+        chave_pendente = self.pending_data.get('chave_idempotencia')
+        data_hora_entrada = self.pending_data.get('data_hora_bruto')
+        if isinstance(data_hora_entrada, datetime.datetime):
+            data_hora_entrada = data_hora_entrada.strftime("%Y-%m-%d %H:%M:%S")
+        ticket_data = {
+            'pending_id': self.pending_id, 'chave_pendente': chave_pendente, 'data_hora': data_hora_final,
+            'data_hora_entrada': data_hora_entrada, 'inicio_saida': self.aberto_em.strftime("%Y-%m-%d %H:%M:%S"),
+            'placa': self.pending_data['placa'], 'placa_carreta': self.pending_data.get('placa_carreta'),
+            'motorista': self.pending_data['motorista'], 'origem': self.pending_data['origem'],
+            'destino': self.pending_data['destino'], 'tipo_carga': tipo_carga,
+            'peso_tara': peso_tara, 'peso_bruto': peso_bruto, 'peso_liquido': peso_liquido,
+        }
+        erro_tamanho = validar_tamanhos(ticket_data)
+        if erro_tamanho:
+            messagebox.showwarning("Campo Muito Longo", erro_tamanho, parent=self)
+            self.finalize_button.config(state="normal")
+            return
         try:
-            conn = self.parent_app.get_db_connection(show_error=True)
-            if conn is None:
-                self.finalize_button.config(state="normal")
-                return
+            chave = self.parent_app.diario.registrar("finalizacao", ticket_data, referencia_id=self.pending_id,
+                                                     referencia_chave=chave_pendente)
+        except sqlite3.Error as err:
+            messagebox.showerror("Erro no Diário Local", f"Não foi possível finalizar o ticket: {err}", parent=self)
+            self.finalize_button.config(state="normal")
+            return
+        self.destroy()
+        self.parent_app.finalizacao_registada(chave)
 
-            with conn.cursor() as cursor:
-                sql_insert_ticket = """
-                                    INSERT INTO tickets (data_hora, placa, placa_carreta, motorista, origem, destino,
-                                                         tipo_carga, peso_tara, peso_bruto, peso_liquido)
-                                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                                    """
-                ticket_data = (
-                    data_hora_final, self.pending_data['placa'], self.pending_data.get('placa_carreta'),
-                    self.pending_data['motorista'], self.pending_data['origem'], self.pending_data['destino'],
-                    tipo_carga, peso_tara, peso_bruto, peso_liquido
-                )
-                cursor.execute(sql_insert_ticket, ticket_data)
-                ticket_id = cursor.lastrowid
-                sql_delete_pending = "DELETE FROM pesagens_pendentes WHERE id = %s"
-                cursor.execute(sql_delete_pending, (self.pending_id,))
-            conn.commit()
 
-            messagebox.showinfo("Sucesso", f"Ticket ID {ticket_id} finalizado com sucesso!")
+class ExportacaoPdfWindow(tk.Toplevel):
+    def __init__(self, parent_app):
+        super().__init__(parent_app.master)
+        self.parent_app = parent_app
+        self.cancelar = threading.Event()
+        self.em_curso = False
+        self.progresso_atual = (0, 0)
+        self.modo = tk.StringVar(value="individual")
+        self.title("Exportar Tickets em PDF")
+        self.geometry("460x320")
+        self.resizable(False, False)
+        self.transient(parent_app.master)
+        self.grab_set()
+        self.protocol("WM_DELETE_WINDOW", self.fechar)
+        self.create_widgets()
+
+    def create_widgets(self):
+        main_frame = ttk.Frame(self, padding="15")
+        main_frame.pack(fill="both", expand=True)
+        ttk.Label(main_frame, text="Exportar Tickets por Período", font=("Arial", 14, "bold")).pack(pady=(0, 10))
+
+        periodo_frame = ttk.LabelFrame(main_frame, text="Período", padding="10")
+        periodo_frame.pack(fill="x", pady=5)
+        hoje = datetime.date.today()
+        ttk.Label(periodo_frame, text="De:").grid(row=0, column=0, padx=(0, 5))
+        self.data_inicio_entry = ttk.Entry(periodo_frame, width=12)
+        self.data_inicio_entry.insert(0, hoje.replace(day=1).strftime("%d/%m/%Y"))
+        self.data_inicio_entry.grid(row=0, column=1, padx=(0, 15))
+        ttk.Label(periodo_frame, text="Até:").grid(row=0, column=2, padx=(0, 5))
+        self.data_fim_entry = ttk.Entry(periodo_frame, width=12)
+        self.data_fim_entry.insert(0, hoje.strftime("%d/%m/%Y"))
+        self.data_fim_entry.grid(row=0, column=3)
+
+        modo_frame = ttk.LabelFrame(main_frame, text="Formato", padding="10")
+        modo_frame.pack(fill="x", pady=5)
+        ttk.Radiobutton(modo_frame, text="Um PDF por ticket (pasta)", variable=self.modo,
+                        value="individual").pack(anchor="w")
+        ttk.Radiobutton(modo_frame, text="Documento único com página de resumo", variable=self.modo,
+                        value="unico").pack(anchor="w")
+
+        self.progresso_label = ttk.Label(main_frame, text="")
+        self.progresso_label.pack(fill="x", pady=5)
+
+        button_frame = ttk.Frame(main_frame)
+        button_frame.pack(pady=5)
+        self.exportar_button = ttk.Button(button_frame, text="Exportar", command=self.exportar,
+                                          style="Success.TButton")
+        self.exportar_button.grid(row=0, column=0, padx=10)
+        ttk.Button(button_frame, text="Cancelar", command=self.fechar, style="Danger.TButton").grid(row=0, column=1)
+
+    def exportar(self):
+        try:
+            filtro = {
+                'data_inicio': datetime.datetime.strptime(self.data_inicio_entry.get().strip(), "%d/%m/%Y"),
+                'data_fim': datetime.datetime.strptime(self.data_fim_entry.get().strip(), "%d/%m/%Y"),
+            }
+        except ValueError:
+            messagebox.showerror("Erro de Validação", "Use datas no formato DD/MM/AAAA.", parent=self)
+            return
+        unico = self.modo.get() == "unico"
+        if unico:
+            destino = filedialog.asksaveasfilename(
+                parent=self, title="Guardar documento", defaultextension=".pdf", filetypes=[("PDF", "*.pdf")],
+                initialfile=f"tickets_{filtro['data_inicio']:%Y%m%d}_{filtro['data_fim']:%Y%m%d}.pdf")
+        else:
+            destino = filedialog.askdirectory(parent=self, title="Pasta de destino dos PDFs")
+        if not destino:
+            return
+
+        self.em_curso = True
+        self.exportar_button.config(state="disabled")
+        exportador = ExportadorPdf(self.parent_app.repositorio, self.parent_app.app_config)
+        self.parent_app.tarefas_exportacao.submeter(
+            exportador.exportar, filtro, destino, unico, self._registar_progresso, self.cancelar,
+            ao_concluir=lambda resumo: self._exportacao_concluida(destino, resumo),
+            ao_falhar=self._falha_exportacao)
+        self._mostrar_progresso()
+
+    def _registar_progresso(self, feitos, total):
+        # Chamado na thread de exportação; a janela só lê o último valor
+        self.progresso_atual = (feitos, total)
+
+    def _mostrar_progresso(self):
+        if not self.em_curso or not self.winfo_exists():
+            return
+        feitos, total = self.progresso_atual
+        texto = "A cancelar..." if self.cancelar.is_set() else f"A exportar: {feitos} de {total} tickets"
+        self.progresso_label.config(text=texto)
+        self.after(200, self._mostrar_progresso)
+
+    def _exportacao_concluida(self, destino, resumo):
+        self.em_curso = False
+        if resumo['cancelado']:
+            self.destroy()
+            return
+        messagebox.showinfo("Exportação Concluída",
+                            f"{resumo['total']} tickets exportados ({resumo['peso_liquido']:.2f} kg líquidos) "
+                            f"para:\n{os.path.abspath(destino)}", parent=self)
+        self.destroy()
+
+    def _falha_exportacao(self, err):
+        self.em_curso = False
+        messagebox.showerror("Erro na Exportação", f"Não foi possível exportar os tickets: {err}", parent=self)
+        self.exportar_button.config(state="normal")
+        self.progresso_label.config(text="")
+
+    def fechar(self):
+        if self.em_curso:
+            self.cancelar.set()
+        else:
             self.destroy()
-            self.parent_app.load_pending_weighings()
-            self.parent_app.load_history()
-            if messagebox.askyesno("Gerar PDF", "Deseja gerar o PDF do ticket agora?"):
-                self.parent_app.gerar_e_abrir_pdf(ticket_id)
-        except pymysql.Error as err:
-            messagebox.showerror("Erro de Banco de Dados", f"Não foi possível finalizar o ticket: {err}", parent=self)
-            self.finalize_button.config(state="normal")
-        finally:
-            if conn:
-                conn.close()
 
 
 class BalancaApp:
+    HISTORICO_TAMANHO_PAGINA = 200
+    HISTORICO_MAXIMO_LINHAS = 1000
+    INTERVALO_ATUALIZACAO_AUTOMATICA = 5000
+    INTERVALO_EXPORTACAO_METRICAS = 15000
+
     def __init__(self, master):
         self.master = master
         master.title("Gerador de Tickets de Balança v9.9 (Personalizado)")
@@ -261,10 +3117,53 @@ class BalancaApp:
             "Nome da Empresa:": "nome", "CNPJ:": "cnpj", "Endereço Completo:": "endereco",
             "Telefone/Contato:": "contato", "Caminho do Logo (opcional):": "logopath",
             "Modelo da Balança:": "modelo_balanca",
+            "Balanças (nome=porta|modelo; ...):": "balancas",
+            "Leitura em Processo Separado (sim/não):": "balanca_processo",
+            "Gravar Dados Brutos da Balança (pasta):": "captura_pasta",
+            "Janela de Estabilidade (s):": "estabilidade_janela",
+            "Tolerância de Estabilidade (kg):": "estabilidade_tolerancia",
+            "Peso Mínimo p/ Captura (kg):": "captura_peso_minimo",
+            "Limite da Cache de PDFs (MB):": "cache_pdf_mb",
+            "Exportar Métricas (.prom ou .jsonl):": "metricas_ficheiro",
             "MySQL Host:": "mysql_host", "MySQL Utilizador:": "mysql_user",
             "MySQL Palavra-passe:": "mysql_password", "MySQL Base de Dados:": "mysql_database"
         }
         self.load_config()
+        self.configurar_estabilidade()
+        self.configurar_cache_pdf()
+        self.db_pool = PoolConexoes.a_partir_da_config(self.app_config)
+        self.repositorio = RepositorioTickets(self.db_pool)
+        self.diario = DiarioLocal()
+        self.sincronizador = SincronizadorDiario(self.diario)
+        self._sincronizacoes_em_curso = 0
+        self._erro_sincronizacao = None
+        self._pendentes_cache = {}
+        self.tarefas_bd = ExecutorTarefas(master, concurrent.futures.ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="bd"))
+        self.tarefas_pdf = ExecutorTarefas(master, criar_executor=lambda: concurrent.futures.ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")))
+        self._pdfs_em_curso = set()
+        self._exportacao_dados = None
+        self._progresso_exportacao_dados = 0
+        self._painel_carregando = False
+        self.tarefas_exportacao = ExecutorTarefas(master, concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="exportacao"))
+        self._geracao_pendentes = 0
+        self._pendentes_em_curso = False
+        self._geracao_historico = 0
+        self._historico_carregando = False
+        self._historico_fim = False
+        self._historico_inicio = True
+        self.filtro_historico = {}
+        self.captura_automatica = tk.BooleanVar(value=True)
+        self._captura_armada = True
+        self.balancas = GerenciadorBalancas(GerenciadorBalancas.interpretar_config(
+            self.app_config.get('balancas'), self.app_config.get('modelo_balanca', '')),
+            em_processo=self.app_config.get('balanca_processo', '').strip().lower() in ('sim', 's', '1'),
+            pasta_captura=self.app_config.get('captura_pasta', '').strip())
+        self.balanca_selecionada = tk.StringVar(value=self.balancas.nomes()[0])
+        self.distribuidor_peso = DistribuidorPeso(
+            master, self.balancas, lambda historico, leitura: self.detector_estabilidade.avaliar(historico, leitura))
 
         self.style = ttk.Style(master)
         self.style.theme_use("clam")
@@ -283,6 +3182,17 @@ class BalancaApp:
         self.status_canvas.pack(side="left", padx=(0, 5), pady=2)
         self.status_circle = self.status_canvas.create_oval(2, 2, 14, 14, fill="red", outline="")
         ttk.Label(status_bar_frame, text="Status da Conexão").pack(side="left")
+        self.sync_label = ttk.Label(status_bar_frame, text="", foreground="#E65100")
+        self.sync_label.pack(side="left", padx=(15, 0))
+        self.pdf_label = ttk.Label(status_bar_frame, text="")
+        self.pdf_label.pack(side="left", padx=(15, 0))
+        self.exportacao_label = ttk.Label(status_bar_frame, text="")
+        self.exportacao_label.pack(side="left", padx=(15, 0))
+        # Painel de depuração com as métricas mais recentes (F12 mostra/esconde)
+        self.metricas_label = ttk.Label(status_bar_frame, text="", foreground="#555555")
+        self._metricas_visiveis = False
+        self._frames_anteriores = (0, time.monotonic())
+        self.master.bind("<F12>", self.alternar_metricas)
 
         exit_button = ttk.Button(status_bar_frame, text="Sair", command=master.quit, style="Danger.TButton", width=15)
         exit_button.pack(side="right")
@@ -293,15 +3203,19 @@ class BalancaApp:
         self.notebook.add(self.pending_frame, text="Pesagens em Andamento")
         self.history_frame = ttk.Frame(self.notebook, padding="10")
         self.notebook.add(self.history_frame, text="Histórico de Tickets")
+        self.dashboard_frame = ttk.Frame(self.notebook, padding="10")
+        self.notebook.add(self.dashboard_frame, text="Painel")
         self.settings_frame = ttk.Frame(self.notebook, padding="10")
         self.notebook.add(self.settings_frame, text="Configurações")
 
         self.create_first_weighing_widgets()
         self.create_pending_widgets()
         self.create_history_widgets()
+        self.create_dashboard_widgets()
         self.create_settings_widgets()
+        self.notebook.bind("<<NotebookTabChanged>>", self._aba_alterada)
+        self.distribuidor_peso.subscrever(self._peso_atualizado)
 
-        self.balanca_reader = None
         self.master.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.master.after(100, self.initial_load)
 
@@ -320,51 +3234,120 @@ class BalancaApp:
         self.style.configure("Treeview.Heading", font=('Arial', 10, 'bold'))
 
     def on_closing(self):
-        if self.balanca_reader:
-            self.balanca_reader.stop()
+        self.distribuidor_peso.parar()
+        self.balancas.parar()
+        self.tarefas_bd.encerrar()
+        self.tarefas_pdf.encerrar()
+        self.tarefas_exportacao.encerrar()
+        self.db_pool.fechar()
         self.master.destroy()
 
+    def alternar_metricas(self, event=None):
+        self._metricas_visiveis = not self._metricas_visiveis
+        if self._metricas_visiveis:
+            self.metricas_label.pack(side="left", padx=(15, 0))
+            self._frames_anteriores = (METRICAS.total("frames_total"), time.monotonic())
+            self.atualizar_painel_metricas()
+        else:
+            self.metricas_label.pack_forget()
+
+    def atualizar_painel_metricas(self):
+        if not self._metricas_visiveis:
+            return
+        frames, agora = METRICAS.total("frames_total"), time.monotonic()
+        frames_anteriores, instante_anterior = self._frames_anteriores
+        taxa = (frames - frames_anteriores) / max(agora - instante_anterior, 1e-6)
+        self._frames_anteriores = (frames, agora)
+
+        def ms(valor):
+            return "—" if valor is None else f"{valor * 1000:.0f}"
+
+        bd_p50, bd_p95 = METRICAS.percentis("bd_operacao_segundos", 50, 95)
+        conexao_p95, = METRICAS.percentis("bd_conexao_segundos", 95)
+        pdf_p50, = METRICAS.percentis("pdf_geracao_segundos", 50)
+        self.metricas_label.config(text=(
+            f"BD p50/p95 {ms(bd_p50)}/{ms(bd_p95)} ms | "
+            f"ligações {METRICAS.total('bd_conexoes_total')} (p95 {ms(conexao_p95)} ms, "
+            f"{METRICAS.total('bd_conexao_falhas_total')} falhas) | "
+            f"balança {taxa:.1f} frames/s, {METRICAS.total('frames_invalidos_total')} inválidos | "
+            f"PDF p50 {ms(pdf_p50)} ms"))
+        self.master.after(1000, self.atualizar_painel_metricas)
+
+    def exportar_metricas(self):
+        caminho = self.app_config.get('metricas_ficheiro')
+        if caminho:
+            try:
+                METRICAS.exportar(caminho)
+            except OSError:
+                pass
+        self.master.after(self.INTERVALO_EXPORTACAO_METRICAS, self.exportar_metricas)
+
     def initial_load(self):
-        self.load_pending_weighings()
-        self.load_history()
+        self.executar_bd(MigradorEsquema(self.db_pool).migrar, ao_concluir=self._esquema_pronto,
+                         ao_falhar=self._falha_migracao)
         self.periodic_connection_check()
+        self.exportar_metricas()
         self.iniciar_leitor_balanca()
-        self.update_live_weight_display()
+        self.distribuidor_peso.iniciar()
+
+    def _esquema_pronto(self, _aplicadas=None):
+        self.diario.limpar_sincronizadas()
+        self.sincronizar_diario()
+        self.load_pending_weighings()
+        self.load_history()
+        self.master.after(self.INTERVALO_ATUALIZACAO_AUTOMATICA, self.atualizacao_automatica)
+
+    def _falha_migracao(self, err):
+        # Sem ligação a migração fica para o próximo arranque; com ligação, o erro é real e deve ser visto
+        if self.db_pool.saudavel:
+            messagebox.showwarning("Esquema da Base de Dados", f"Não foi possível atualizar o esquema: {err}")
+        self._esquema_pronto()
 
     def iniciar_leitor_balanca(self):
-        porta = BalancaReader.encontrar_porta_balanca()
-        if porta:
-            self.balanca_reader = BalancaReader(porta)
-            self.balanca_reader.start()
-        else:
-            messagebox.showwarning("Balança", "Não foi possível encontrar a balança.\nVerifique a conexão.")
+        self.balancas.iniciar()
+        if self.balancas.nao_encontradas:
+            messagebox.showwarning("Balança", "Não foi possível encontrar a balança: "
+                                   f"{', '.join(self.balancas.nao_encontradas)}.\nVerifique a conexão.")
+
+    def leitor(self, nome=None):
+        return self.balancas.obter(nome or self.balanca_selecionada.get())
+
+    @property
+    def balanca_reader(self):
+        return self.leitor()
+
+    def _config_float(self, chave, padrao):
+        return config_float(self.app_config, chave, padrao)
+
+    def configurar_cache_pdf(self):
+        self.cache_pdf = CachePdf("tickets_pdf", int(self._config_float('cache_pdf_mb', 200) * 1024 * 1024))
+
+    def configurar_estabilidade(self):
+        self.detector_estabilidade = DetectorEstabilidade(
+            janela=self._config_float('estabilidade_janela', 1.5),
+            tolerancia=self._config_float('estabilidade_tolerancia', 10.0)
+        )
+        self.peso_minimo_captura = self._config_float('captura_peso_minimo', 100.0)
 
     def update_status_indicator(self, is_connected):
         color = "green" if is_connected else "red"
         self.status_canvas.itemconfig(self.status_circle, fill=color)
 
-    def get_db_connection(self, show_error=False):
-        try:
-            conn = pymysql.connect(
-                host=self.app_config.get('mysql_host'),
-                user=self.app_config.get('mysql_user'),
-                password=self.app_config.get('mysql_password'),
-                database=self.app_config.get('mysql_database'),
-                connect_timeout=5,
-                cursorclass=pymysql.cursors.DictCursor
-            )
-            self.update_status_indicator(True)
-            return conn
-        except pymysql.Error as err:
-            self.update_status_indicator(False)
-            if show_error:
-                messagebox.showerror("Erro de Conexão", f"Não foi possível conectar ao MySQL: {err}")
-        return None
+    def executar_bd(self, funcao, *args, ao_concluir=None, ao_falhar=None):
+        def concluido(resultado):
+            self.update_status_indicator(self.db_pool.saudavel)
+            if ao_concluir:
+                ao_concluir(resultado)
+
+        def falhou(erro):
+            self.update_status_indicator(self.db_pool.saudavel)
+            if ao_falhar:
+                ao_falhar(erro)
+
+        return self.tarefas_bd.submeter(funcao, *args, ao_concluir=concluido, ao_falhar=falhou)
 
     def periodic_connection_check(self):
-        conn = self.get_db_connection(show_error=False)
-        if conn:
-            conn.close()
+        self.executar_bd(self.db_pool.verificar_saude)
         self.master.after(60000, self.periodic_connection_check)
 
     def format_license_plate(self, plate_str):
@@ -383,11 +3366,7 @@ class BalancaApp:
             widget.insert(0, formatted_text)
 
     def load_config(self):
-        config = configparser.ConfigParser()
-        if os.path.exists(self.config_file):
-            config.read(self.config_file, encoding='utf-8')
-            if 'Configuracoes' in config:
-                self.app_config = dict(config['Configuracoes'])
+        self.app_config = ler_config(self.config_file) or self.app_config
 
     def save_config(self):
         config = configparser.ConfigParser()
@@ -397,6 +3376,11 @@ class BalancaApp:
             with open(self.config_file, 'w', encoding='utf-8') as configfile:
                 config.write(configfile)
             self.load_config()
+            self.configurar_estabilidade()
+            self.configurar_cache_pdf()
+            self.db_pool.fechar()
+            self.db_pool = PoolConexoes.a_partir_da_config(self.app_config)
+            self.repositorio = RepositorioTickets(self.db_pool)
             messagebox.showinfo("Sucesso", "Configurações salvas com sucesso!")
         except Exception as e:
             messagebox.showerror("Erro ao Salvar", f"Não foi possível salvar as configurações: {e}")
@@ -422,7 +3406,7 @@ class BalancaApp:
                                        "Para pesagem de Peso Bruto, Tipo de Carga e Peso são obrigatórios.")
                 return
             try:
-                peso_bruto = float(peso_bruto_str.replace(',', '.'))
+                peso_bruto = converter_peso(peso_bruto_str)
                 if peso_bruto <= 0:
                     messagebox.showerror("Erro de Validação", "O Peso Bruto deve ser um valor positivo.")
                     return
@@ -436,7 +3420,7 @@ class BalancaApp:
                 messagebox.showwarning("Campos Faltando", "Para pesagem de Tara, o Peso é obrigatório.")
                 return
             try:
-                peso_tara = float(peso_tara_str.replace(',', '.'))
+                peso_tara = converter_peso(peso_tara_str)
                 if peso_tara <= 0:
                     messagebox.showerror("Erro de Validação", "O Peso Tara deve ser um valor positivo.")
                     return
@@ -447,146 +3431,386 @@ class BalancaApp:
                 return
 
         data_hora_bruto = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        sql = """
-              INSERT INTO pesagens_pendentes (data_hora_bruto, placa, placa_carreta, motorista, origem, destino,
-                                              tipo_carga, peso_bruto)
-              VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-              """
-        data = (data_hora_bruto, placa_cavalo, placa_carreta, motorista, origem, destino, tipo_carga, peso_bruto)
-
-        conn = None
+        dados = {
+            'data_hora_bruto': data_hora_bruto, 'placa': placa_cavalo, 'placa_carreta': placa_carreta,
+            'motorista': motorista, 'origem': origem, 'destino': destino, 'tipo_carga': tipo_carga,
+            'peso_bruto': peso_bruto,
+        }
+        erro_tamanho = validar_tamanhos(dados)
+        if erro_tamanho:
+            messagebox.showwarning("Campo Muito Longo", erro_tamanho)
+            return
         try:
-            conn = self.get_db_connection(show_error=True)
-            if conn is None: return
-            with conn.cursor() as cursor:
-                cursor.execute(sql, data)
-            conn.commit()
+            self.diario.registrar("primeira_pesagem", dados)
+        except sqlite3.Error as err:
+            messagebox.showerror("Erro no Diário Local", f"Não foi possível registar a entrada: {err}")
+            return
 
-            messagebox.showinfo("Sucesso", "1ª Pesagem registada! O veículo está aguardando a saída.")
-            self.limpar_campos()
-            self.load_pending_weighings()
-            self.notebook.select(self.pending_frame)
-        except pymysql.Error as err:
-            messagebox.showerror("Erro de MySQL", f"Não foi possível registar a entrada: {err}")
-        finally:
-            if conn:
-                conn.close()
+        messagebox.showinfo("Sucesso", "1ª Pesagem registada! O veículo está aguardando a saída.")
+        self.limpar_campos()
+        self._mostrar_pendentes_locais()
+        self.notebook.select(self.pending_frame)
+        self.sincronizar_diario(ao_concluir=self._avisar_erro_sincronizacao)
+
+    def _avisar_erro_sincronizacao(self, erro):
+        # Sem ligação a pesagem fica no diário; outro erro do MySQL o operador precisa de ver já
+        if erro is not None and not erro_de_ligacao(erro):
+            messagebox.showerror("Erro de MySQL", f"Não foi possível enviar a pesagem: {erro}\n\n"
+                                                  "A pesagem ficou guardada localmente.")
+
+    def finalizacao_registada(self, chave):
+        self._mostrar_pendentes_locais()
+
+        def sincronizado(erro):
+            ticket_id = self.diario.ticket_id(chave)
+            if ticket_id is None:
+                if self.diario.erro(chave):
+                    return  # recusa já mostrada por sincronizar_diario
+                if erro is not None and not erro_de_ligacao(erro):
+                    messagebox.showerror("Erro de MySQL", f"Não foi possível criar o ticket: {erro}\n\n"
+                                                          "A pesagem ficou guardada localmente.")
+                    return
+                messagebox.showinfo("Pesagem Guardada", "Sem ligação ao MySQL: a pesagem foi guardada localmente e "
+                                                        "o ticket será criado assim que a ligação voltar.")
+                return
+            messagebox.showinfo("Sucesso", f"Ticket ID {ticket_id} finalizado com sucesso!")
+            if messagebox.askyesno("Gerar PDF", "Deseja gerar o PDF do ticket agora?"):
+                self.gerar_e_abrir_pdf(ticket_id)
+
+        self.sincronizar_diario(ao_concluir=sincronizado)
+
+    def sincronizar_diario(self, ao_concluir=None):
+        self._sincronizacoes_em_curso += 1
+
+        def concluido(resultado):
+            sincronizadas, recusadas = resultado
+            self._sincronizacoes_em_curso -= 1
+            self._erro_sincronizacao = None
+            self._atualizar_estado_sincronizacao()
+            if sincronizadas or recusadas:
+                self.load_pending_weighings()
+                self.atualizar_historico()
+                if self._painel_visivel():
+                    self.carregar_painel()
+            for op, erro in recusadas:
+                descricao = "a 1ª pesagem" if op['tipo'] == 'primeira_pesagem' else "a finalização"
+                messagebox.showerror("Erro de MySQL", f"O MySQL recusou {descricao} da placa "
+                                                      f"{op['dados'].get('placa', '')}: {erro}\n\n"
+                                                      "O registo ficou no diário local como falhado e não será "
+                                                      "reenviado. Corrija os dados e registe a pesagem de novo.")
+            if ao_concluir:
+                ao_concluir(None)
+
+        def falhou(err):
+            self._sincronizacoes_em_curso -= 1
+            self._erro_sincronizacao = err
+            self._atualizar_estado_sincronizacao()
+            if ao_concluir:
+                ao_concluir(err)
+
+        self.executar_bd(self.sincronizador.sincronizar, self.repositorio, ao_concluir=concluido, ao_falhar=falhou)
+
+    def _atualizar_estado_sincronizacao(self):
+        partes = []
+        total = self.diario.total_por_sincronizar()
+        if total:
+            texto = f"{total} registo(s) por sincronizar"
+            erro = self._erro_sincronizacao
+            if erro is not None:
+                # Parados: a última tentativa falhou, por falta de ligação ou por outro erro do MySQL
+                texto += " (sem ligação ao MySQL)" if erro_de_ligacao(erro) else f" (erro: {erro})"
+            partes.append(texto)
+        falhadas = self.diario.total_falhadas()
+        if falhadas:
+            partes.append(f"{falhadas} recusado(s) pelo MySQL")
+        self.sync_label.config(text=" | ".join(partes))
 
     def load_pending_weighings(self):
-        for item in self.pending_tree.get_children():
-            self.pending_tree.delete(item)
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            if conn is None: return
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT id, DATE_FORMAT(data_hora_bruto, '%d/%m/%Y %H:%i:%s') as data_hora_fmt, placa, motorista, tipo_carga, peso_bruto FROM pesagens_pendentes ORDER BY id DESC")
-                for row in cursor.fetchall():
-                    peso_entrada = abs(row['peso_bruto'])
-                    self.pending_tree.insert("", "end", values=(
-                        row['id'], row['data_hora_fmt'], row['placa'], row['motorista'],
-                        row['tipo_carga'], f"{peso_entrada:.2f}"
-                    ))
-        except pymysql.Error:
-            pass
-        finally:
-            if conn:
-                conn.close()
+        # Resultados de pedidos antigos que cheguem depois de um mais recente são ignorados
+        self._geracao_pendentes += 1
+        geracao = self._geracao_pendentes
+        itens = self.pending_tree.get_children()
+        ultimo_id = max((int(iid) for iid in itens if not iid.startswith("local:")), default=0)
+        self._pendentes_em_curso = True
+
+        def falhou(_err):
+            if geracao == self._geracao_pendentes:
+                self._pendentes_em_curso = False
+
+        self.executar_bd(self.repositorio.alteracoes_pendentes, ultimo_id,
+                         ao_concluir=lambda resultado: self._aplicar_diff_pendentes(resultado, geracao),
+                         ao_falhar=falhou)
+
+    def _aplicar_diff_pendentes(self, resultado, geracao):
+        if geracao != self._geracao_pendentes:
+            return
+        self._pendentes_em_curso = False
+        ids, novas = resultado
+        tree = self.pending_tree
+        removidos = [iid for iid in tree.get_children() if not iid.startswith("local:") and int(iid) not in ids]
+        if removidos:
+            tree.delete(*removidos)
+        for iid in removidos:
+            self._pendentes_cache.pop(int(iid), None)
+        for posicao, row in enumerate(novas):
+            self._pendentes_cache[row['id']] = row
+            if tree.exists(str(row['id'])):
+                continue
+            peso_entrada = abs(row['peso_bruto'])
+            tree.insert("", posicao, iid=str(row['id']), values=(
+                row['id'], row['data_hora_fmt'], row['placa'], row['motorista'],
+                row['tipo_carga'], f"{peso_entrada:.2f}"
+            ))
+        self._mostrar_pendentes_locais()
+
+    def _mostrar_pendentes_locais(self):
+        # Junta à lista as entradas que só existem no diário e esconde as que já foram finalizadas localmente
+        tree = self.pending_tree
+        locais = self.diario.primeiras_pesagens_locais()
+        ids_finalizados, chaves_finalizadas = self.diario.pendentes_finalizados_localmente()
+        iids_locais = {f"local:{chave}" for chave, _ in locais}
+        for iid in tree.get_children():
+            if iid.startswith("local:"):
+                remover = iid not in iids_locais
+            else:
+                chave = self._pendentes_cache.get(int(iid), {}).get('chave_idempotencia')
+                remover = int(iid) in ids_finalizados or (chave and chave in chaves_finalizadas)
+            if remover:
+                tree.delete(iid)
+        for chave, dados in reversed(locais):
+            iid = f"local:{chave}"
+            if tree.exists(iid):
+                continue
+            data_hora = datetime.datetime.strptime(dados['data_hora_bruto'], "%Y-%m-%d %H:%M:%S")
+            tree.insert("", 0, iid=iid, values=(
+                "Local", data_hora.strftime("%d/%m/%Y %H:%M:%S"), dados['placa'], dados['motorista'],
+                dados['tipo_carga'], f"{abs(converter_peso(dados['peso_bruto'])):.2f}"
+            ))
 
     def iniciar_segunda_pesagem(self):
+        if self.segunda_pesagem_button.instate(["disabled"]):
+            return
         selected_item = self.pending_tree.focus()
         if not selected_item:
             messagebox.showwarning("Nenhuma Seleção", "Por favor, selecione um veículo da lista para registar a saída.")
             return
-        pending_id = self.pending_tree.item(selected_item)['values'][0]
-        conn = None
-        try:
-            conn = self.get_db_connection(show_error=True)
-            if conn is None: return
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM pesagens_pendentes WHERE id = %s", (pending_id,))
-                pending_data = cursor.fetchone()
-
-            if pending_data:
-                SegundaPesagemWindow(self, pending_id, pending_data)
-            else:
+        if selected_item.startswith("local:"):
+            chave = selected_item[len("local:"):]
+            pending_data = self.diario.dados_operacao(chave)
+            if pending_data is None:
                 messagebox.showerror("Erro", "Este registo não foi encontrado. Pode já ter sido finalizado.")
                 self.load_pending_weighings()
-        except pymysql.Error as err:
-            messagebox.showerror("Erro de MySQL", f"Não foi possível buscar o registo: {err}")
-        finally:
-            if conn:
-                conn.close()
+                return
+            pending_data['chave_idempotencia'] = chave
+            pending_data['peso_bruto'] = converter_peso(pending_data['peso_bruto'])
+            SegundaPesagemWindow(self, None, pending_data)
+            return
+        pending_id = int(selected_item)
+        definir_botao_pendente(self.segunda_pesagem_button, True)
+        self.executar_bd(self.repositorio.obter_pendente, pending_id,
+                         ao_concluir=lambda pending_data: self._abrir_segunda_pesagem(pending_id, pending_data),
+                         ao_falhar=lambda err: self._falha_buscar_pendente(pending_id, err))
+
+    def _abrir_segunda_pesagem(self, pending_id, pending_data):
+        definir_botao_pendente(self.segunda_pesagem_button, False)
+        if pending_data:
+            SegundaPesagemWindow(self, pending_id, pending_data)
+        else:
+            messagebox.showerror("Erro", "Este registo não foi encontrado. Pode já ter sido finalizado.")
+            self.load_pending_weighings()
+
+    def _falha_buscar_pendente(self, pending_id, err):
+        definir_botao_pendente(self.segunda_pesagem_button, False)
+        # Sem ligação usa os dados já carregados na lista, para o veículo não ficar retido na balança
+        if pending_id in self._pendentes_cache:
+            SegundaPesagemWindow(self, pending_id, dict(self._pendentes_cache[pending_id]))
+            return
+        messagebox.showerror("Erro de MySQL", f"Não foi possível buscar o registo: {err}")
 
     def load_history(self):
+        self._geracao_historico += 1
+        self._historico_carregando = False
+        self._historico_fim = False
+        self._historico_inicio = True
         for item in self.history_tree.get_children():
             self.history_tree.delete(item)
-        conn = None
-        try:
-            conn = self.get_db_connection()
-            if conn is None: return
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "SELECT id, DATE_FORMAT(data_hora, '%d/%m/%Y %H:%i:%s') as data_hora_fmt, placa, motorista, tipo_carga, peso_liquido FROM tickets ORDER BY id DESC")
-                for row in cursor.fetchall():
-                    self.history_tree.insert("", "end", values=(
-                        row['id'], row['data_hora_fmt'], row['placa'], row['motorista'],
-                        row['tipo_carga'], f"{row['peso_liquido']:.2f}"
-                    ))
-        except pymysql.Error:
-            pass
-        finally:
-            if conn:
-                conn.close()
+        self._carregar_pagina_historico("abaixo")
+
+    def atualizar_historico(self):
+        # Atualização incremental: só busca os tickets mais recentes do que o primeiro já mostrado
+        if not self.history_tree.get_children():
+            self.load_history()
+        elif self._historico_inicio:
+            # A flag só muda quando a página chega: se o pedido falhar, a próxima atualização tenta de novo
+            self._carregar_pagina_historico("acima", atualizacao=True)
+
+    def atualizacao_automatica(self):
+        if not self._sincronizacoes_em_curso and self.diario.total_por_sincronizar():
+            self.sincronizar_diario()
+        if not self._pendentes_em_curso:
+            self.load_pending_weighings()
+        if not self._historico_carregando:
+            self.atualizar_historico()
+        if self._painel_visivel() and not self._painel_carregando:
+            self.carregar_painel()
+        self.master.after(self.INTERVALO_ATUALIZACAO_AUTOMATICA, self.atualizacao_automatica)
+
+    def aplicar_filtro_historico(self):
+        filtro = {}
+        placa = self.format_license_plate(self.filtro_entries["placa"].get())
+        if placa:
+            # Placas parciais seguem o mesmo formato gravado ("ABC-1...") para a pesquisa usar o índice
+            if '-' not in placa and len(placa) > 3:
+                placa = f"{placa[:3]}-{placa[3:]}"
+            filtro['placa'] = placa
+        for chave in ("motorista", "tipo_carga"):
+            valor = self.filtro_entries[chave].get().strip()
+            if valor:
+                filtro[chave] = valor
+        for chave in ("data_inicio", "data_fim"):
+            valor = self.filtro_entries[chave].get().strip()
+            if not valor:
+                continue
+            try:
+                filtro[chave] = datetime.datetime.strptime(valor, "%d/%m/%Y")
+            except ValueError:
+                messagebox.showerror("Erro de Validação", "Use datas no formato DD/MM/AAAA.")
+                return
+        self.filtro_historico = filtro
+        self.load_history()
 
-    def gerar_e_abrir_pdf(self, ticket_id):
-        conn = None
-        try:
-            conn = self.get_db_connection(show_error=True)
-            if conn is None: return
-            with conn.cursor() as cursor:
-                cursor.execute("SELECT * FROM tickets WHERE id = %s", (ticket_id,))
-                record = cursor.fetchone()
+    def limpar_filtro_historico(self):
+        for entry in self.filtro_entries.values():
+            entry.delete(0, tk.END)
+        self.filtro_historico = {}
+        self.load_history()
 
-            if record is None:
-                messagebox.showerror("Erro", "Ticket não encontrado no banco de dados.")
+    def _carregar_pagina_historico(self, direcao, atualizacao=False):
+        if self._historico_carregando:
+            return
+        itens = self.history_tree.get_children()
+        if direcao == "abaixo":
+            if self._historico_fim:
                 return
+            antes_de = int(itens[-1]) if itens else None
+            args = (self.HISTORICO_TAMANHO_PAGINA, antes_de, None, self.filtro_historico)
+        else:
+            if (self._historico_inicio and not atualizacao) or not itens:
+                return
+            args = (self.HISTORICO_TAMANHO_PAGINA, None, int(itens[0]), self.filtro_historico)
+        self._historico_carregando = True
+        geracao = self._geracao_historico
 
-            # Sanitize driver's name for filename
-            motorista_nome = record.get('motorista', 'sem_nome').strip().replace(' ', '_')
-            # Remove any characters that are not alphanumeric or underscore
-            motorista_nome_safe = re.sub(r'[^\w_]', '', motorista_nome)
+        def falhou(_err):
+            if geracao == self._geracao_historico:
+                self._historico_carregando = False
 
-            # Format date and time for filename
-            data_hora_str = record.get('data_hora').strftime("%Y%m%d_%H%M%S")
+        self.executar_bd(self.repositorio.pagina_historico, *args,
+                         ao_concluir=lambda rows: self._mostrar_pagina_historico(rows, direcao, geracao),
+                         ao_falhar=falhou)
 
-            # Create the new filename
-            new_filename_base = f"{motorista_nome_safe}_{data_hora_str}.pdf"
+    def _mostrar_pagina_historico(self, rows, direcao, geracao):
+        if geracao != self._geracao_historico:
+            return
+        self._historico_carregando = False
+        tree = self.history_tree
+        total_antes = len(tree.get_children())
+        primeiro_visivel = round(tree.yview()[0] * total_antes) if total_antes else 0
+
+        if direcao == "abaixo":
+            self._historico_fim = len(rows) < self.HISTORICO_TAMANHO_PAGINA
+            for row in rows:
+                self._inserir_linha_historico(row, "end")
+        else:
+            self._historico_inicio = len(rows) < self.HISTORICO_TAMANHO_PAGINA
+            for posicao, row in enumerate(rows):
+                self._inserir_linha_historico(row, posicao)
+            # Quem está no topo vê as linhas novas; quem rolou para baixo não perde a posição
+            if primeiro_visivel:
+                primeiro_visivel += len(rows)
+
+        # Mantém só uma janela limitada de linhas, descartando o lado oposto ao da rolagem
+        itens = tree.get_children()
+        excesso = len(itens) - self.HISTORICO_MAXIMO_LINHAS
+        if excesso > 0:
+            if direcao == "abaixo":
+                tree.delete(*itens[:excesso])
+                self._historico_inicio = False
+                primeiro_visivel -= excesso
+            else:
+                tree.delete(*itens[-excesso:])
+                self._historico_fim = False
+        total = len(tree.get_children())
+        if total and primeiro_visivel:
+            tree.yview_moveto(max(0, primeiro_visivel) / total)
+
+    def _inserir_linha_historico(self, row, posicao):
+        self.history_tree.insert("", posicao, iid=str(row['id']), values=(
+            row['id'], row['data_hora_fmt'], row['placa'], row['motorista'],
+            row['tipo_carga'], f"{row['peso_liquido']:.2f}"
+        ))
+
+    def _rolagem_historico(self, primeiro, ultimo):
+        self.history_scrollbar.set(primeiro, ultimo)
+        if float(ultimo) >= 0.9:
+            self._carregar_pagina_historico("abaixo")
+        elif float(primeiro) <= 0.1:
+            self._carregar_pagina_historico("acima")
 
-            folder = "tickets_pdf"
-            os.makedirs(folder, exist_ok=True)
-            filename = os.path.join(folder, new_filename_base)
-            self.criar_pdf(filename, record)
-            messagebox.showinfo("Sucesso", f"PDF do ticket salvo em:\n{os.path.abspath(filename)}")
+    def gerar_e_abrir_pdf(self, ticket_id):
+        if ticket_id in self._pdfs_em_curso:
+            return
+        self._pdfs_em_curso.add(ticket_id)
+        self._atualizar_estado_pdf()
+        self.executar_bd(self.repositorio.obter_ticket, ticket_id,
+                         ao_concluir=lambda record: self._gerar_pdf_do_registo(ticket_id, record),
+                         ao_falhar=lambda err: self._falha_pdf(ticket_id, "Erro de MySQL",
+                                                               f"Não foi possível buscar o ticket: {err}"))
+
+    def _gerar_pdf_do_registo(self, ticket_id, record):
+        if record is None:
+            self._falha_pdf(ticket_id, "Erro", "Ticket não encontrado no banco de dados.")
+            return
+        config = dict(self.app_config)
+        filename = self.cache_pdf.obter(record, config)
+        METRICAS.contar("pdf_cache_total", resultado="acerto" if filename else "falha")
+        if filename:
+            self._pdf_gerado(ticket_id, filename)
+            return
+        inicio = time.perf_counter()
+        self.tarefas_pdf.submeter(self.cache_pdf.gerar, record, config,
+                                  ao_concluir=lambda filename: self._pdf_gerado(ticket_id, filename, inicio),
+                                  ao_falhar=lambda err: self._falha_pdf(ticket_id, "Erro ao Gerar/Abrir PDF",
+                                                                        f"Ocorreu um erro: {err}"))
+
+    def _pdf_gerado(self, ticket_id, filename, inicio=None):
+        if inicio is not None:
+            METRICAS.observar("pdf_geracao_segundos", time.perf_counter() - inicio)
+        self._pdfs_em_curso.discard(ticket_id)
+        self._atualizar_estado_pdf(f"PDF do ticket {ticket_id} salvo em {filename}")
+        try:
+            abrir_ficheiro(filename)
+        except OSError as e:
+            messagebox.showerror("Erro ao Gerar/Abrir PDF", f"PDF salvo em:\n{filename}\n\nMas não foi possível abri-lo: {e}")
 
-            if sys.platform == "win32":
-                os.startfile(os.path.abspath(filename))
-            elif sys.platform == "darwin":
-                os.system(f'open "{os.path.abspath(filename)}"')
-            else:
-                os.system(f'xdg-open "{os.path.abspath(filename)}"')
-        except pymysql.Error as err:
-            messagebox.showerror("Erro de MySQL", f"Não foi possível buscar o ticket: {err}")
-        except Exception as e:
-            messagebox.showerror("Erro ao Gerar/Abrir PDF", f"Ocorreu um erro: {e}")
-        finally:
-            if conn:
-                conn.close()
+    def _falha_pdf(self, ticket_id, titulo, mensagem):
+        self._pdfs_em_curso.discard(ticket_id)
+        self._atualizar_estado_pdf()
+        messagebox.showerror(titulo, mensagem)
+
+    def _atualizar_estado_pdf(self, texto=""):
+        if self._pdfs_em_curso:
+            texto = f"A gerar {len(self._pdfs_em_curso)} PDF(s)..."
+        self.pdf_label.config(text=texto)
 
     def create_first_weighing_widgets(self):
         live_weight_frame = ttk.LabelFrame(self.main_frame, text="PESO ATUAL", padding=(10, 5))
         live_weight_frame.pack(fill="x", padx=5, pady=(5, 10))
+        if len(self.balancas.nomes()) > 1:
+            seletor = ttk.Combobox(live_weight_frame, textvariable=self.balanca_selecionada,
+                                   values=self.balancas.nomes(), state="readonly", width=20)
+            seletor.pack(anchor="w")
+            seletor.bind("<<ComboboxSelected>>", self._balanca_alterada)
         self.live_weight_label = ttk.Label(live_weight_frame, text="0.00 kg", font=("Arial", 36, "bold"),
                                            foreground="green", anchor="center")
         self.live_weight_label.pack(expand=True, fill="x", pady=5)
@@ -598,6 +3822,8 @@ class BalancaApp:
                         value="bruto").pack(side="left", padx=10)
         ttk.Radiobutton(weighing_type_frame, text="Tara Primeiro (Entrada Vazio)", variable=self.weighing_type,
                         value="tara").pack(side="left", padx=10)
+        ttk.Checkbutton(weighing_type_frame, text="Captura automática", variable=self.captura_automatica).pack(
+            side="right", padx=10)
 
         self.input_frame = ttk.LabelFrame(self.main_frame, text="Registo de Entrada", padding=(10, 5))
         self.input_frame.pack(fill="x", expand=True, padx=5, pady=5)
@@ -634,8 +3860,9 @@ class BalancaApp:
 
         button_frame = ttk.Frame(self.main_frame)
         button_frame.pack(pady=15)
-        ttk.Button(button_frame, text="Registar Entrada", command=self.registrar_primeira_pesagem,
-                   style="Success.TButton", width=20).grid(row=0, column=0, padx=10)
+        self.registrar_button = ttk.Button(button_frame, text="Registar Entrada",
+                                           command=self.registrar_primeira_pesagem, style="Success.TButton", width=20)
+        self.registrar_button.grid(row=0, column=0, padx=10)
         ttk.Button(button_frame, text="Limpar Campos", command=self.limpar_campos, style="Warning.TButton",
                    width=20).grid(row=0, column=1, padx=10)
         self.entries["Placa Cavalo:"].focus()
@@ -664,33 +3891,68 @@ class BalancaApp:
         self.capturar_peso_button.grid(row=grid_row_for_weight, column=2, padx=5, sticky="w")
 
     def capturar_peso(self):
-        if self.balanca_reader and self.balanca_reader.is_alive():
-            peso = self.balanca_reader.get_peso()
-            if self.weighing_type.get() == "bruto":
-                self.entries["Peso Bruto (kg):"].delete(0, tk.END)
-                self.entries["Peso Bruto (kg):"].insert(0, peso)
-            else:
-                self.entries["Peso Tara (kg):"].delete(0, tk.END)
-                self.entries["Peso Tara (kg):"].insert(0, peso)
-        else:
+        leitor = self.balanca_reader
+        # Com a porta fechada, get_peso() devolve o último peso lido antes de a balança se desligar
+        leitura = leitor.get_leitura() if leitor and leitor.is_alive() and leitor.conectada() else None
+        if not leitura:
             messagebox.showwarning("Balança", "Não foi possível ler o peso. Verifique a conexão.")
-
-    def update_live_weight_display(self):
-        if self.balanca_reader and self.balanca_reader.is_alive():
-            peso = self.balanca_reader.get_peso()
-            self.live_weight_label.config(text=f"{peso} kg")
-            self.master.after(500, self.update_live_weight_display)
+        elif leitura.valor is None:
+            messagebox.showwarning("Balança", "O indicador está em movimento ou com peso negativo. Aguarde e tente novamente.")
         else:
+            self._preencher_peso_capturado(f"{leitura.valor:.2f}")
+
+    def _entrada_peso_ativa(self):
+        if self.weighing_type.get() == "bruto":
+            return self.entries["Peso Bruto (kg):"]
+        return self.entries["Peso Tara (kg):"]
+
+    def _preencher_peso_capturado(self, peso):
+        entry = self._entrada_peso_ativa()
+        entry.delete(0, tk.END)
+        entry.insert(0, peso)
+
+    def _verificar_captura_automatica(self, estado):
+        self.live_weight_label.config(foreground="green" if estado.estabilizada else "orange")
+        if not estado.estabilizada:
+            return
+        peso = estado.peso_estavel
+        if abs(peso) < self.peso_minimo_captura:
+            # Balança vazia: pronta para capturar o próximo veículo
+            self._captura_armada = True
+            return
+        if (self._captura_armada and self.captura_automatica.get()
+                and self.notebook.select() == str(self.main_frame)
+                and not self._entrada_peso_ativa().get().strip()):
+            self._preencher_peso_capturado(f"{peso:.2f}")
+            self._captura_armada = False
+
+    def _balanca_alterada(self, event=None):
+        self._captura_armada = True
+        nome = self.balanca_selecionada.get()
+        estado = self.distribuidor_peso.estado(nome)
+        if estado:
+            self._peso_atualizado(nome, estado)
+
+    def _peso_atualizado(self, nome, estado):
+        if nome != self.balanca_selecionada.get():
+            return
+        if not estado.conectada:
             self.live_weight_label.config(text="Balança Desconectada")
-            self.master.after(2000, self.update_live_weight_display)
+        elif estado.valor is not None:
+            self.live_weight_label.config(text=f"{estado.valor:.2f} {estado.unidade}")
+        elif estado.unidade:
+            # Indicador em movimento ou com peso negativo: não há valor para mostrar
+            self.live_weight_label.config(text=f"--- {estado.unidade}")
+        self._verificar_captura_automatica(estado)
 
     def create_pending_widgets(self):
         controls_frame = ttk.Frame(self.pending_frame)
         controls_frame.pack(fill='x', pady=5)
         ttk.Button(controls_frame, text="Atualizar Lista", command=self.load_pending_weighings).pack(side="left",
                                                                                                      padx=(0, 10))
-        ttk.Button(controls_frame, text="Registar Saída (2ª Pesagem)", command=self.iniciar_segunda_pesagem,
-                   style="Success.TButton").pack(side="left")
+        self.segunda_pesagem_button = ttk.Button(controls_frame, text="Registar Saída (2ª Pesagem)",
+                                                 command=self.iniciar_segunda_pesagem, style="Success.TButton")
+        self.segunda_pesagem_button.pack(side="left")
 
         tree_frame = ttk.Frame(self.pending_frame)
         tree_frame.pack(fill="both", expand=True, pady=10)
@@ -717,6 +3979,27 @@ class BalancaApp:
                                                                                                padx=(0, 10))
         ttk.Button(controls_frame, text="Gerar PDF do Ticket Selecionado", command=self.gerar_pdf_selecionado,
                    style="Info.TButton").pack(side="left")
+        ttk.Button(controls_frame, text="Exportar Período...", command=lambda: ExportacaoPdfWindow(self)).pack(
+            side="left", padx=(10, 0))
+        self.exportar_dados_button = ttk.Button(controls_frame, text="Exportar Dados (CSV/XLSX)...",
+                                                command=self.exportar_dados_historico)
+        self.exportar_dados_button.pack(side="left", padx=(10, 0))
+
+        filter_frame = ttk.LabelFrame(self.history_frame, text="Pesquisa", padding=(10, 5))
+        filter_frame.pack(fill='x', pady=5)
+        self.filtro_entries = {}
+        campos_filtro = [("Placa:", "placa", 10), ("Motorista:", "motorista", 18), ("Carga:", "tipo_carga", 12),
+                         ("De:", "data_inicio", 11), ("Até:", "data_fim", 11)]
+        for coluna, (texto, chave, largura) in enumerate(campos_filtro):
+            ttk.Label(filter_frame, text=texto).grid(row=0, column=coluna * 2, sticky="w", padx=(5, 2))
+            entry = ttk.Entry(filter_frame, width=largura)
+            entry.grid(row=0, column=coluna * 2 + 1, padx=(0, 5))
+            entry.bind("<Return>", lambda e: self.aplicar_filtro_historico())
+            self.filtro_entries[chave] = entry
+        self.filtro_entries["placa"].bind("<FocusOut>", self._format_plate_entry)
+        ttk.Button(filter_frame, text="Filtrar", command=self.aplicar_filtro_historico).grid(row=0, column=10,
+                                                                                           padx=5)
+        ttk.Button(filter_frame, text="Limpar", command=self.limpar_filtro_historico).grid(row=0, column=11)
 
         tree_frame = ttk.Frame(self.history_frame)
         tree_frame.pack(fill="both", expand=True, pady=10)
@@ -730,11 +4013,54 @@ class BalancaApp:
         self.history_tree.column("Data/Hora Final", width=150)
         self.history_tree.column("Peso Líquido (kg)", width=120, anchor="e")
 
-        vsb = ttk.Scrollbar(tree_frame, orient="vertical", command=self.history_tree.yview)
-        vsb.pack(side='right', fill='y')
-        self.history_tree.configure(yscrollcommand=vsb.set)
+        self.history_scrollbar = ttk.Scrollbar(tree_frame, orient="vertical", command=self.history_tree.yview)
+        self.history_scrollbar.pack(side='right', fill='y')
+        self.history_tree.configure(yscrollcommand=self._rolagem_historico)
         self.history_tree.pack(fill="both", expand=True)
 
+    def exportar_dados_historico(self):
+        if self._exportacao_dados is not None:
+            # O mesmo botão cancela a exportação em curso
+            self._exportacao_dados.set()
+            return
+        tipos = [("CSV", "*.csv")]
+        if openpyxl is not None:
+            tipos.insert(0, ("Excel", "*.xlsx"))
+        caminho = filedialog.asksaveasfilename(
+            title="Exportar tickets do histórico", filetypes=tipos, defaultextension=tipos[0][1][1:],
+            initialfile=f"tickets_{datetime.datetime.now():%Y%m%d_%H%M%S}{tipos[0][1][1:]}")
+        if not caminho:
+            return
+        self._exportacao_dados = threading.Event()
+        self._progresso_exportacao_dados = 0
+        self.exportar_dados_button.config(text="Cancelar Exportação")
+        self.tarefas_exportacao.submeter(
+            exportar_tickets_dados, self.repositorio, dict(self.filtro_historico), caminho,
+            self._registar_progresso_dados, self._exportacao_dados,
+            ao_concluir=lambda total: self._exportacao_dados_terminada(caminho, total),
+            ao_falhar=lambda err: self._exportacao_dados_terminada(caminho, None, err))
+        self._mostrar_progresso_dados()
+
+    def _registar_progresso_dados(self, feitos):
+        self._progresso_exportacao_dados = feitos
+
+    def _mostrar_progresso_dados(self):
+        if self._exportacao_dados is None:
+            return
+        self.exportacao_label.config(text=f"A exportar: {self._progresso_exportacao_dados} tickets...")
+        self.master.after(200, self._mostrar_progresso_dados)
+
+    def _exportacao_dados_terminada(self, caminho, total, err=None):
+        cancelada = self._exportacao_dados.is_set()
+        self._exportacao_dados = None
+        self.exportacao_label.config(text="")
+        self.exportar_dados_button.config(text="Exportar Dados (CSV/XLSX)...")
+        if err is not None:
+            messagebox.showerror("Erro na Exportação", f"Não foi possível exportar os tickets: {err}")
+        elif not cancelada:
+            messagebox.showinfo("Exportação Concluída",
+                                f"{total} tickets exportados para:\n{os.path.abspath(caminho)}")
+
     def gerar_pdf_selecionado(self):
         selected_item = self.history_tree.focus()
         if not selected_item:
@@ -743,6 +4069,124 @@ class BalancaApp:
         ticket_id = self.history_tree.item(selected_item)['values'][0]
         self.gerar_e_abrir_pdf(ticket_id)
 
+    def create_dashboard_widgets(self):
+        controls_frame = ttk.Frame(self.dashboard_frame)
+        controls_frame.pack(fill='x', pady=5)
+        ttk.Label(controls_frame, text="Dia:").pack(side="left")
+        self.painel_dia_entry = ttk.Entry(controls_frame, width=12)
+        self.painel_dia_entry.insert(0, datetime.date.today().strftime("%d/%m/%Y"))
+        self.painel_dia_entry.pack(side="left", padx=5)
+        self.painel_dia_entry.bind("<Return>", lambda e: self.carregar_painel())
+        ttk.Button(controls_frame, text="◀", width=3, command=lambda: self._mudar_dia_painel(-1)).pack(side="left")
+        ttk.Button(controls_frame, text="Hoje", command=lambda: self._mudar_dia_painel(None)).pack(side="left",
+                                                                                                  padx=5)
+        ttk.Button(controls_frame, text="▶", width=3, command=lambda: self._mudar_dia_painel(1)).pack(side="left")
+        self.painel_total_label = ttk.Label(controls_frame, text="", font=("Arial", 14, "bold"))
+        self.painel_total_label.pack(side="right")
+
+        fluxo_frame = ttk.LabelFrame(self.dashboard_frame, text="Fluxo do Pátio", padding=(10, 5))
+        fluxo_frame.pack(fill="x", pady=5)
+        self.fluxo_labels = {}
+        indicadores = [("fila", "Na fila"), ("ultima_hora", "Saídas na última hora"),
+                       ("patio", "Tempo no pátio (p50 / p95)"), ("balanca", "Balança de saída (p50 / p95)")]
+        for coluna, (chave, texto) in enumerate(indicadores):
+            fluxo_frame.columnconfigure(coluna, weight=1)
+            ttk.Label(fluxo_frame, text=texto).grid(row=0, column=coluna, sticky="w")
+            self.fluxo_labels[chave] = ttk.Label(fluxo_frame, text="—", font=("Arial", 12, "bold"))
+            self.fluxo_labels[chave].grid(row=1, column=coluna, sticky="w")
+
+        grid_frame = ttk.Frame(self.dashboard_frame)
+        grid_frame.pack(fill="both", expand=True, pady=5)
+        grid_frame.columnconfigure((0, 1), weight=1)
+        grid_frame.rowconfigure((0, 1), weight=1)
+        self.painel_trees = {}
+        quadros = [
+            ('por_carga', "Toneladas por Tipo de Carga", ("Tipo de Carga", "Tickets", "Toneladas")),
+            ('por_rota', "Toneladas por Origem/Destino", ("Origem", "Destino", "Tickets", "Toneladas")),
+            ('por_motorista', "Toneladas por Motorista", ("Motorista", "Tickets", "Toneladas")),
+            ('por_hora', "Camiões por Hora", ("Hora", "Camiões", "Toneladas")),
+        ]
+        for posicao, (chave, titulo, cols) in enumerate(quadros):
+            frame = ttk.LabelFrame(grid_frame, text=titulo, padding=5)
+            frame.grid(row=posicao // 2, column=posicao % 2, sticky="nsew", padx=5, pady=5)
+            tree = ttk.Treeview(frame, columns=cols, show="headings", height=6, style="Treeview")
+            for col in cols:
+                tree.heading(col, text=col)
+                tree.column(col, width=90, anchor="e" if col in ("Tickets", "Camiões", "Toneladas") else "w")
+            vsb = ttk.Scrollbar(frame, orient="vertical", command=tree.yview)
+            vsb.pack(side='right', fill='y')
+            tree.configure(yscrollcommand=vsb.set)
+            tree.pack(fill="both", expand=True)
+            self.painel_trees[chave] = tree
+
+    def _painel_visivel(self):
+        return self.notebook.select() == str(self.dashboard_frame)
+
+    def _aba_alterada(self, event=None):
+        if self._painel_visivel():
+            self.carregar_painel()
+        # A captura automática só atua na aba da 1ª pesagem; o peso pode já ter estabilizado noutra aba
+        estado = self.distribuidor_peso.estado(self.balanca_selecionada.get())
+        if estado:
+            self._verificar_captura_automatica(estado)
+
+    def _mudar_dia_painel(self, dias):
+        try:
+            dia = datetime.datetime.strptime(self.painel_dia_entry.get().strip(), "%d/%m/%Y").date()
+        except ValueError:
+            dia = datetime.date.today()
+        dia = datetime.date.today() if dias is None else dia + datetime.timedelta(days=dias)
+        self.painel_dia_entry.delete(0, tk.END)
+        self.painel_dia_entry.insert(0, dia.strftime("%d/%m/%Y"))
+        self.carregar_painel()
+
+    def carregar_painel(self):
+        try:
+            dia = datetime.datetime.strptime(self.painel_dia_entry.get().strip(), "%d/%m/%Y").date()
+        except ValueError:
+            messagebox.showerror("Erro de Validação", "Use datas no formato DD/MM/AAAA.")
+            return
+        self._painel_carregando = True
+        repositorio = self.repositorio
+        self.executar_bd(lambda: (repositorio.totais_do_dia(dia), repositorio.metricas_patio(dia)),
+                         ao_concluir=lambda dados: self._mostrar_painel(dia, *dados),
+                         ao_falhar=self._falha_painel)
+
+    def _mostrar_painel(self, dia, totais, metricas):
+        self._painel_carregando = False
+        if self.painel_dia_entry.get().strip() != dia.strftime("%d/%m/%Y"):
+            return
+        fila = metricas['fila'] + len(self.diario.primeiras_pesagens_locais())
+        self.fluxo_labels['fila'].config(
+            text=f"{fila} veículo(s), há {formatar_duracao(metricas['espera_maxima'])}" if fila else "0 veículos")
+        self.fluxo_labels['ultima_hora'].config(text=str(metricas['ultima_hora']))
+        for chave in ('patio', 'balanca'):
+            p50, p95 = metricas[chave]
+            self.fluxo_labels[chave].config(text=f"{formatar_duracao(p50)} / {formatar_duracao(p95)}")
+
+        def toneladas(row):
+            return f"{row['peso_liquido'] / 1000:,.2f}"
+
+        linhas = {
+            'por_carga': [(row['tipo_carga'] or "—", row['tickets'], toneladas(row)) for row in totais['por_carga']],
+            'por_rota': [(row['origem'] or "—", row['destino'] or "—", row['tickets'], toneladas(row))
+                         for row in totais['por_rota']],
+            'por_motorista': [(row['motorista'], row['tickets'], toneladas(row)) for row in totais['por_motorista']],
+            'por_hora': [(f"{row['hora']:02d}:00", row['tickets'], toneladas(row)) for row in totais['por_hora']],
+        }
+        for chave, valores in linhas.items():
+            tree = self.painel_trees[chave]
+            tree.delete(*tree.get_children())
+            for linha in valores:
+                tree.insert("", "end", values=linha)
+        total_tickets = sum(row['tickets'] for row in totais['por_hora'])
+        total_peso = sum((row['peso_liquido'] for row in totais['por_hora']), decimal.Decimal(0))
+        self.painel_total_label.config(text=f"{total_tickets} tickets  |  {total_peso / 1000:,.2f} t")
+
+    def _falha_painel(self, err):
+        self._painel_carregando = False
+        self.painel_total_label.config(text="Painel indisponível")
+
     def create_settings_widgets(self):
         container = ttk.Frame(self.settings_frame, padding=20)
         container.pack(fill='both', expand=True)
@@ -784,133 +4228,156 @@ class BalancaApp:
             entry.delete(0, tk.END)
         self.entries["Placa Cavalo:"].focus()
 
-    def _draw_ticket_content(self, c, data, start_y, title):
-        # Esta função desenha o conteúdo de uma única via do ticket
-        largura, _ = A4
-        x_margin = 1.5 * cm
-        y_pos = start_y
 
-        # --- Cabeçalho ---
-        y_pos -= 1.5 * cm
-        logo_path = self.app_config.get('logopath')
-        if logo_path and os.path.exists(logo_path):
-            try:
-                logo = ImageReader(logo_path)
-                # Posiciona o logo no canto esquerdo
-                c.drawImage(logo, x_margin, y_pos - 1 * cm, width=4 * cm, height=2 * cm, preserveAspectRatio=True,
-                            anchor='nw')
-            except Exception:
-                pass
-
-        # Informações da empresa alinhadas à direita
-        c.setFont("Helvetica-Bold", 14)
-        c.drawRightString(largura - x_margin, y_pos, self.app_config.get('nome', 'NOME DA EMPRESA'))
-        c.setFont("Helvetica", 9)
-        y_pos -= 0.5 * cm
-        c.drawRightString(largura - x_margin, y_pos, f"CNPJ: {self.app_config.get('cnpj', '')}")
-        y_pos -= 0.5 * cm
-        c.drawRightString(largura - x_margin, y_pos, self.app_config.get('endereco', ''))
-        y_pos -= 0.5 * cm
-        c.drawRightString(largura - x_margin, y_pos, f"Contato: {self.app_config.get('contato', '')}")
-
-        # --- Título ---
-        y_pos -= 1 * cm
-        c.setFont("Helvetica-Bold", 18)
-        c.drawCentredString(largura / 2, y_pos, "TICKET DE PESAGEM")
-        c.setFont("Helvetica-Oblique", 10)
-        c.drawCentredString(largura / 2, y_pos - 0.5 * cm, title)
-        y_pos -= 1 * cm
-
-        # --- Informações do Ticket (ID e Data) ---
-        c.setFont("Helvetica-Bold", 10)
-        c.drawString(x_margin, y_pos, f"Ticket ID: {data['id']}")
-        c.drawRightString(largura - x_margin, y_pos, f"Data/Hora: {data['data_hora'].strftime('%d/%m/%Y %H:%M:%S')}")
-        y_pos -= 0.5 * cm
-        c.line(x_margin, y_pos, largura - x_margin, y_pos)
-        y_pos -= 0.7 * cm
-
-        # --- Detalhes em Grid (2 colunas) ---
-        line_height = 0.6 * cm
-        col1_x = x_margin
-        col2_x = x_margin + 9 * cm
-
-        def draw_field(x, y, label, value):
-            c.setFont("Helvetica-Bold", 9)
-            c.drawString(x, y, label)
-            c.setFont("Helvetica", 10)
-            c.drawString(x + 2.5 * cm, y, str(value))
-
-        draw_field(col1_x, y_pos, "Placa Cavalo:", data.get('placa', ''))
-        draw_field(col2_x, y_pos, "Placa Carreta:", data.get('placa_carreta', 'N/A'))
-        y_pos -= line_height
-
-        draw_field(col1_x, y_pos, "Motorista:", data.get('motorista', ''))
-        draw_field(col2_x, y_pos, "Tipo de Carga:", data.get('tipo_carga', ''))
-        y_pos -= line_height
-
-        draw_field(col1_x, y_pos, "Origem:", data.get('origem', ''))
-        draw_field(col2_x, y_pos, "Destino:", data.get('destino', ''))
-
-        # --- Seção de Pesos ---
-        y_pos -= 1 * cm
-        box_height = 3.5 * cm
-        box_width = largura - (2 * x_margin)
-        box_bottom_y = y_pos - box_height
-
-        c.roundRect(x_margin, box_bottom_y, box_width, box_height, 5, stroke=1, fill=0)
-
-        text_y = y_pos - 0.8 * cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(x_margin + 0.5 * cm, text_y, "Peso Bruto:")
-        c.drawRightString(largura - x_margin - 0.5 * cm, text_y, f"{data.get('peso_bruto', 0):.2f} kg")
-        text_y -= 0.8 * cm
-
-        c.setFont("Helvetica-Bold", 12)
-        c.drawString(x_margin + 0.5 * cm, text_y, "Peso Tara:")
-        c.drawRightString(largura - x_margin - 0.5 * cm, text_y, f"{data.get('peso_tara', 0):.2f} kg")
-        text_y -= 0.2 * cm
-        c.line(x_margin + 0.5 * cm, text_y, largura - x_margin - 0.5 * cm, text_y)
-        text_y -= 0.8 * cm
-
-        c.setFont("Helvetica-Bold", 16)
-        c.setFillColor(colors.red)
-        c.drawString(x_margin + 0.5 * cm, text_y, "Peso Líquido:")
-        c.drawRightString(largura - x_margin - 0.5 * cm, text_y, f"{data.get('peso_liquido', 0):.2f} kg")
-        c.setFillColor(colors.black)
-
-        # --- Assinatura ---
-        y_assinatura = start_y - (A4[1] / 2) + (2 * cm)
-        c.line(largura / 2 - 5 * cm, y_assinatura, largura / 2 + 5 * cm, y_assinatura)
-        c.setFont("Helvetica", 9)
-        c.drawCentredString(largura / 2, y_assinatura - 0.4 * cm, "Assinatura do Motorista")
-
-        # --- Modelo da Balança ---
-        modelo = self.app_config.get('modelo_balanca', '')
-        if modelo:
-            y_modelo = start_y - (A4[1] / 2) + (1 * cm)
-            c.setFont("Helvetica", 8)
-            c.drawCentredString(largura / 2, y_modelo, f"Equipamento de Pesagem: {modelo}")
-
-    def criar_pdf(self, filename, data):
-        c = canvas.Canvas(filename, pagesize=A4)
-        largura, altura = A4
-
-        # Desenha a primeira via (Via da Empresa) na metade superior da página
-        self._draw_ticket_content(c, data, altura, "VIA DA EMPRESA")
-
-        # Linha divisória
-        c.setDash(3, 3)  # Linha pontilhada
-        c.line(1 * cm, altura / 2, largura - 1 * cm, altura / 2)
-        c.setDash([], 0)  # Reseta para linha sólida
-
-        # Desenha a segunda via (Via do Caminhoneiro) na metade inferior da página
-        self._draw_ticket_content(c, data, altura / 2, "VIA DO CAMINHONEIRO")
-
-        c.save()
+def _data_argumento(valor):
+    try:
+        return datetime.datetime.strptime(valor, "%d/%m/%Y")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"data inválida: {valor!r} (use DD/MM/AAAA)")
+
+
+def _mostrar_progresso_terminal(feitos, total):
+    print(f"\r{feitos} de {total} tickets", end="", file=sys.stderr, flush=True)
+
+
+def servir_balancas(config, host, porta):
+    detector = DetectorEstabilidade(janela=config_float(config, 'estabilidade_janela', 1.5),
+                                    tolerancia=config_float(config, 'estabilidade_tolerancia', 10.0))
+    servidor = ServidorBalancas(GerenciadorBalancas.interpretar_config(
+        config.get('balancas'), config.get('modelo_balanca', '')), detector, host, porta,
+        config.get('captura_pasta', '').strip())
+    try:
+        asyncio.run(servidor.executar())
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def reproduzir_captura(caminho, modelo=None, callback=None, velocidade=None):
+    # Passa uma captura pelo mesmo caminho do BalancaReader (delimitação de frames, validação e publicação),
+    # com os instantes originais; velocidade=None reproduz o mais depressa possível
+    captura = LeitorCaptura(caminho)
+    leitor = BalancaReader(caminho, callback=callback,
+                           parser=obter_parser(modelo or captura.metadados.get('modelo')))
+    inicio_real = time.monotonic()
+    inicio_gravado = None
+    try:
+        for instante, dados in captura:
+            if velocidade:
+                if inicio_gravado is None:
+                    inicio_gravado = instante
+                atraso = (instante - inicio_gravado) / velocidade - (time.monotonic() - inicio_real)
+                if atraso > 0:
+                    time.sleep(atraso)
+            leitor._processar_dados(dados, instante)
+    finally:
+        captura.fechar()
+    return leitor
+
+
+def _reproduzir_capturas(args):
+    leituras = 0
+    frames_invalidos = 0
+
+    def mostrar(leitura):
+        nonlocal leituras
+        leituras += 1
+        if not args.resumo:
+            instante = datetime.datetime.fromtimestamp(leitura.timestamp).strftime("%d/%m/%Y %H:%M:%S.%f")[:-3]
+            estado = {True: "estável", False: "instável", None: ""}[leitura.estavel]
+            valor = "---" if leitura.valor is None else f"{leitura.valor:.2f}"
+            print(f"{instante}  {valor:>12} {leitura.unidade:<3} {estado}")
+
+    inicio = time.perf_counter()
+    for caminho in args.ficheiros:
+        leitor = reproduzir_captura(caminho, args.modelo, mostrar, args.velocidade or None)
+        frames_invalidos += leitor.frames_invalidos
+    duracao = time.perf_counter() - inicio
+    print(f"{leituras} leituras, {frames_invalidos} frames inválidos em {duracao:.3f} s "
+          f"({leituras / max(duracao, 1e-9):.0f} leituras/s)", file=sys.stderr)
+    return 0
+
+
+def executar_linha_comandos(argv):
+    # Modo sem interface gráfica, para tarefas agendadas (ex.: exportação do fecho do mês)
+    parser = argparse.ArgumentParser(prog="Balança_V2", description="Operações sem interface gráfica.")
+    parser.add_argument("--config", default="config.ini", help="ficheiro de configuração (padrão: config.ini)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    exportar_pdf = comandos.add_parser("exportar-pdf", help="exporta os tickets de um período em PDF")
+    exportar_pdf.add_argument("--de", required=True, type=_data_argumento, help="data inicial (DD/MM/AAAA)")
+    exportar_pdf.add_argument("--ate", required=True, type=_data_argumento, help="data final (DD/MM/AAAA)")
+    exportar_pdf.add_argument("--destino", required=True,
+                              help="pasta de destino, ou ficheiro .pdf quando usado com --unico")
+    exportar_pdf.add_argument("--unico", action="store_true", help="gera um único documento com página de resumo")
+    exportar_pdf.add_argument("--processos", type=int, help="número de processos de renderização")
+
+    exportar_dados = comandos.add_parser("exportar-dados", help="exporta os tickets em CSV ou XLSX")
+    exportar_dados.add_argument("--destino", required=True, help="ficheiro .csv ou .xlsx de destino")
+    exportar_dados.add_argument("--de", type=_data_argumento, help="data inicial (DD/MM/AAAA)")
+    exportar_dados.add_argument("--ate", type=_data_argumento, help="data final (DD/MM/AAAA)")
+    exportar_dados.add_argument("--placa", help="início da placa")
+    exportar_dados.add_argument("--motorista", help="início do nome do motorista")
+    exportar_dados.add_argument("--carga", help="início do tipo de carga")
+
+    servir = comandos.add_parser("servir", help="lê as balanças e publica o peso por HTTP para outros postos")
+    servir.add_argument("--host", default="127.0.0.1",
+                        help="endereço de escuta (padrão: 127.0.0.1; 0.0.0.0 para toda a rede local)")
+    servir.add_argument("--porta", type=int, default=8765, help="porta HTTP (padrão: 8765)")
+
+    reproduzir = comandos.add_parser("reproduzir", help="reproduz capturas de dados brutos da balança")
+    reproduzir.add_argument("ficheiros", nargs="+", help="ficheiros .bin gravados (por ordem)")
+    reproduzir.add_argument("--modelo", help="modelo do indicador (padrão: o registado na captura)")
+    reproduzir.add_argument("--velocidade", type=float, default=0,
+                            help="1 = ritmo original, 2 = o dobro... (padrão: 0, o mais depressa possível)")
+    reproduzir.add_argument("--resumo", action="store_true", help="mostra só o total de leituras e o débito")
+
+    args = parser.parse_args(argv)
+    if args.comando == "reproduzir":
+        try:
+            return _reproduzir_capturas(args)
+        except (OSError, ValueError) as e:
+            print(f"Erro: {e}", file=sys.stderr)
+            return 1
+    config = ler_config(args.config)
+    if args.comando == "servir":
+        return servir_balancas(config, args.host, args.porta)
+    pool = PoolConexoes.a_partir_da_config(config)
+    try:
+        repositorio = RepositorioTickets(pool)
+        if args.comando == "exportar-pdf":
+            filtro = {'data_inicio': args.de, 'data_fim': args.ate}
+            resumo = ExportadorPdf(repositorio, config, args.processos).exportar(
+                filtro, args.destino, args.unico, _mostrar_progresso_terminal)
+            print(file=sys.stderr)
+            print(f"{resumo['total']} tickets exportados ({resumo['peso_liquido']:.2f} kg líquidos) "
+                  f"para {os.path.abspath(args.destino)}")
+        elif args.comando == "exportar-dados":
+            filtro = {'data_inicio': args.de, 'data_fim': args.ate, 'placa': args.placa,
+                      'motorista': args.motorista, 'tipo_carga': args.carga}
+            total = exportar_tickets_dados(
+                repositorio, filtro, args.destino,
+                lambda feitos: print(f"\r{feitos} tickets", end="", file=sys.stderr, flush=True))
+            print(file=sys.stderr)
+            print(f"{total} tickets exportados para {os.path.abspath(args.destino)}")
+    except (ValueError, RuntimeError) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    except pymysql.MySQLError as e:
+        print(f"Erro de MySQL: {e}", file=sys.stderr)
+        return 1
+    finally:
+        pool.fechar()
+    return 0
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        sys.exit(executar_linha_comandos(sys.argv[1:]))
     root = tk.Tk()
     app = BalancaApp(root)
     root.mainloop()
\ No newline at end of file
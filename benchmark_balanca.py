@@ -0,0 +1,394 @@
+import argparse
+import datetime
+import decimal
+import importlib.util
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# O módulo principal tem um "ç" no nome e não pode ser importado com um import normal
+CAMINHO_APP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Balança_V2.py")
+_spec = importlib.util.spec_from_file_location("balanca_app", CAMINHO_APP)
+app = importlib.util.module_from_spec(_spec)
+sys.modules["balanca_app"] = app
+_spec.loader.exec_module(app)
+
+VERSAO_FORMATO = 1
+
+
+def resumo_tempos(amostras):
+    # Resume uma lista de durações (segundos) em milissegundos
+    if not amostras:
+        return {'n': 0}
+    ordenadas = sorted(amostras)
+    return {
+        'n': len(ordenadas),
+        'media_ms': round(statistics.fmean(ordenadas) * 1000, 3),
+        'p50_ms': round(app.percentil(ordenadas, 50) * 1000, 3),
+        'p95_ms': round(app.percentil(ordenadas, 95) * 1000, 3),
+        'p99_ms': round(app.percentil(ordenadas, 99) * 1000, 3),
+    }
+
+
+def cronometrar(funcao, repeticoes):
+    amostras = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        amostras.append(time.perf_counter() - inicio)
+    return resumo_tempos(amostras)
+
+
+# --- Balança simulada ---
+
+def frame_toledo(valor):
+    # P03 com ponto decimal na posição 2 (sem casas), kg, estável e checksum
+    frame = bytes([0x02, 0x22, 0x30, 0x20]) + f"{int(valor) % 1000000:06d}".encode() + b"000000" + b"\r"
+    return frame + bytes([-sum(frame) & 0x7F])
+
+
+def frame_filizola(valor):
+    return b"\x02" + f"{int(valor) % 1000000:06d}".encode() + b"\x03"
+
+
+def frame_generico(valor):
+    return f"ST,GS,+{int(valor):8d}kg\r\n".encode()
+
+
+FRAMES = {
+    "toledo": frame_toledo,
+    "filizola": frame_filizola,
+    "generico": frame_generico,
+}
+
+
+def medir_parsers(quantidade=50000, tamanho_leitura=64):
+    # Throughput do parser sozinho: frames entregues em pedaços como chegariam da porta
+    resultados = {}
+    for modelo, gerar_frame in FRAMES.items():
+        fluxo = b"".join(gerar_frame(i) for i in range(quantidade))
+        parser = app.PARSERS_INDICADOR[modelo]()
+        inicio = time.perf_counter()
+        buffer, interpretados = b"", 0
+        for posicao in range(0, len(fluxo), tamanho_leitura):
+            frames, buffer = parser.extrair_frames(buffer + fluxo[posicao:posicao + tamanho_leitura])
+            for frame in frames:
+                if parser.interpretar(frame, 0.0) is not None:
+                    interpretados += 1
+        duracao = time.perf_counter() - inicio
+        resultados[modelo] = {'frames': interpretados, 'frames_por_segundo': round(interpretados / duracao)}
+    return resultados
+
+
+def medir_latencia_serial(modelo, taxa, duracao):
+    # Indicador simulado num pseudo-terminal: o peso de cada frame é o seu número de sequência,
+    # o que permite medir o tempo entre a escrita e a entrega da leitura pelo BalancaReader
+    import pty
+    import tty
+
+    mestre, escravo = pty.openpty()
+    tty.setraw(escravo)
+    enviados, recebidos = {}, {}
+
+    def ao_receber(leitura):
+        recebidos.setdefault(int(round(leitura.valor)), time.perf_counter())
+
+    leitor = app.BalancaReader(os.ttyname(escravo), callback=ao_receber, parser=app.PARSERS_INDICADOR[modelo]())
+    leitor.start()
+    try:
+        # Espera a porta abrir antes de começar a contar
+        limite = time.monotonic() + 5
+        while not (leitor.serial_connection and leitor.serial_connection.is_open) and time.monotonic() < limite:
+            time.sleep(0.01)
+        intervalo = 1.0 / taxa
+        total = int(taxa * duracao)
+        proximo = time.perf_counter()
+        for sequencia in range(1, total + 1):
+            enviados[sequencia] = time.perf_counter()
+            os.write(mestre, FRAMES[modelo](sequencia))
+            proximo += intervalo
+            espera = proximo - time.perf_counter()
+            if espera > 0:
+                time.sleep(espera)
+        time.sleep(0.3)
+    finally:
+        # Deixa a thread sair do read() antes de fechar a porta
+        leitor.running = False
+        leitor.join(timeout=1)
+        leitor.stop()
+        os.close(mestre)
+        os.close(escravo)
+
+    latencias = [recebidos[seq] - enviados[seq] for seq in recebidos if seq in enviados]
+    resultado = resumo_tempos(latencias)
+    resultado['taxa_hz'] = taxa
+    resultado['enviados'] = len(enviados)
+    # O leitor só publica o frame mais recente de cada leitura; a taxas altas é normal não entregar todos
+    resultado['entregues'] = len(latencias)
+    return resultado
+
+
+def secao_serial(args):
+    resultados = {'parser': medir_parsers()}
+    if not hasattr(os, "openpty"):
+        resultados['latencia'] = {'ignorado': "pseudo-terminais indisponíveis neste sistema"}
+        return resultados
+    resultados['latencia'] = {
+        modelo: {str(taxa): medir_latencia_serial(modelo, taxa, args.duracao) for taxa in args.taxas}
+        for modelo in FRAMES
+    }
+    return resultados
+
+
+# --- Base de dados ---
+
+PLACAS = [f"{chr(65 + i % 26)}{chr(65 + i // 26 % 26)}C-{i % 10}{chr(65 + i % 26)}{i % 97:02d}" for i in range(2000)]
+MOTORISTAS = [f"Motorista {i}" for i in range(300)]
+CARGAS = ["Soja", "Milho", "Trigo", "Adubo", "Calcário", "Farelo"]
+LOCAIS = ["Rio Verde", "Jataí", "Cristalina", "Uberlândia", "Sorriso", "Porto de Santos"]
+
+
+def semear_tickets(conn, quantidade, lote=5000):
+    agora = datetime.datetime.now()
+    aleatorio = random.Random(42)
+    with conn.cursor() as cursor:
+        for inicio in range(0, quantidade, lote):
+            linhas = []
+            for _ in range(min(lote, quantidade - inicio)):
+                saida = agora - datetime.timedelta(seconds=aleatorio.randint(0, 365 * 86400))
+                entrada = saida - datetime.timedelta(minutes=aleatorio.randint(10, 240))
+                tara = decimal.Decimal(aleatorio.randint(12000, 18000))
+                liquido = decimal.Decimal(aleatorio.randint(5000, 40000))
+                linhas.append((saida, entrada, saida - datetime.timedelta(minutes=3), aleatorio.choice(PLACAS),
+                               aleatorio.choice(MOTORISTAS), aleatorio.choice(LOCAIS), aleatorio.choice(LOCAIS),
+                               aleatorio.choice(CARGAS), tara, tara + liquido, liquido))
+            cursor.executemany(
+                "INSERT INTO tickets (data_hora, data_hora_entrada, inicio_saida, placa, motorista, origem, destino, "
+                "tipo_carga, peso_tara, peso_bruto, peso_liquido) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+                linhas)
+        cursor.executemany(
+            "INSERT INTO pesagens_pendentes (data_hora_bruto, placa, motorista, origem, destino, tipo_carga, "
+            "peso_bruto) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+            [(agora, aleatorio.choice(PLACAS), aleatorio.choice(MOTORISTAS), "Rio Verde", "Porto de Santos",
+              "Soja", decimal.Decimal("45000.00")) for _ in range(200)])
+        app._reconstruir_totais_diarios(cursor)
+
+
+def preparar_base(parametros, quantidade):
+    import pymysql
+
+    base = parametros['database']
+    conn = pymysql.connect(**{**parametros, 'database': None}, autocommit=True)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS `{base}`")
+            cursor.execute(f"CREATE DATABASE `{base}` DEFAULT CHARSET utf8mb4")
+    finally:
+        conn.close()
+    pool = app.PoolConexoes(parametros)
+    app.MigradorEsquema(pool).migrar()
+    conn = pool.obter()
+    try:
+        inicio = time.perf_counter()
+        semear_tickets(conn, quantidade)
+        duracao = time.perf_counter() - inicio
+    finally:
+        pool.devolver(conn)
+    return pool, duracao
+
+
+def medir_base(parametros, quantidade, repeticoes):
+    pool, duracao_semente = preparar_base(parametros, quantidade)
+    repositorio = app.RepositorioTickets(pool)
+    pasta = tempfile.mkdtemp(prefix="bench_diario_")
+    try:
+        diario = app.DiarioLocal(os.path.join(pasta, "diario.db"))
+        sincronizador = app.SincronizadorDiario(diario)
+        agora = datetime.datetime.now()
+        resultados = {'tickets': quantidade, 'semente_segundos': round(duracao_semente, 2)}
+
+        def primeira_pesagem():
+            diario.registrar("primeira_pesagem", {
+                'data_hora_bruto': agora.strftime("%Y-%m-%d %H:%M:%S"), 'placa': "BEN-0A00",
+                'placa_carreta': "", 'motorista': "Benchmark", 'origem': "Rio Verde", 'destino': "Santos",
+                'tipo_carga': "Soja", 'peso_bruto': decimal.Decimal("45000.00")})
+            sincronizador.sincronizar(repositorio)
+
+        def finalizar():
+            chave_pendente = diario.registrar("primeira_pesagem", {
+                'data_hora_bruto': agora.strftime("%Y-%m-%d %H:%M:%S"), 'placa': "BEN-0A01",
+                'placa_carreta': "", 'motorista': "Benchmark", 'origem': "Rio Verde", 'destino': "Santos",
+                'tipo_carga': "Soja", 'peso_bruto': decimal.Decimal("45000.00")})
+            diario.registrar("finalizacao", {
+                'pending_id': None, 'chave_pendente': chave_pendente,
+                'data_hora': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                'data_hora_entrada': agora.strftime("%Y-%m-%d %H:%M:%S"), 'inicio_saida': None,
+                'placa': "BEN-0A01", 'placa_carreta': "", 'motorista': "Benchmark", 'origem': "Rio Verde",
+                'destino': "Santos", 'tipo_carga': "Soja", 'peso_tara': decimal.Decimal("15000.00"),
+                'peso_bruto': decimal.Decimal("45000.00"), 'peso_liquido': decimal.Decimal("30000.00")},
+                referencia_chave=chave_pendente)
+            sincronizador.sincronizar(repositorio)
+
+        id_meio = quantidade // 2
+        mes = {'data_inicio': datetime.datetime.combine(agora.date().replace(day=1), datetime.time()),
+               'data_fim': datetime.datetime.combine(agora.date(), datetime.time())}
+        medicoes = {
+            'primeira_pesagem': primeira_pesagem,
+            'finalizar_pesagem': finalizar,
+            'historico_primeira_pagina': lambda: repositorio.pagina_historico(200),
+            'historico_pagina_profunda': lambda: repositorio.pagina_historico(200, antes_de=id_meio),
+            'historico_filtro_placa': lambda: repositorio.pagina_historico(200, filtro={'placa': "AAC"}),
+            'historico_filtro_mes': lambda: repositorio.pagina_historico(200, filtro=mes),
+            'pendentes_carga_completa': lambda: repositorio.alteracoes_pendentes(0),
+            'contar_mes': lambda: repositorio.contar_tickets(mes),
+            'painel_totais_do_dia': lambda: repositorio.totais_do_dia(agora.date()),
+            'painel_metricas_patio': lambda: repositorio.metricas_patio(agora.date()),
+        }
+        for nome, funcao in medicoes.items():
+            funcao()
+            resultados[nome] = cronometrar(funcao, repeticoes)
+        return resultados
+    finally:
+        pool.fechar()
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+def secao_bd(args):
+    if not args.mysql_host:
+        return {'ignorado': "indique --mysql-host (MySQL/MariaDB local) para medir a base de dados"}
+    if "bench" not in args.mysql_database:
+        # A base indicada é apagada e recriada: nunca aceitar a base de produção por engano
+        raise SystemExit("--mysql-database tem de conter 'bench' no nome, pois é apagada e recriada")
+    parametros = {'host': args.mysql_host, 'port': args.mysql_port, 'user': args.mysql_user,
+                  'password': args.mysql_password, 'database': args.mysql_database}
+    return {str(quantidade): medir_base(parametros, quantidade, args.repeticoes) for quantidade in args.tamanhos}
+
+
+# --- PDF ---
+
+def secao_pdf(args):
+    from PIL import Image
+
+    pasta = tempfile.mkdtemp(prefix="bench_pdf_")
+    try:
+        logo = os.path.join(pasta, "logo.png")
+        Image.effect_noise((1600, 800), 80).convert("RGB").save(logo)
+        record = {'id': 1, 'data_hora': datetime.datetime(2026, 1, 1, 10, 0), 'motorista': "Benchmark",
+                  'placa': "BEN-0A00", 'placa_carreta': "BEN-0A01", 'tipo_carga': "Soja", 'origem': "Rio Verde",
+                  'destino': "Santos", 'peso_bruto': decimal.Decimal("45000.00"),
+                  'peso_tara': decimal.Decimal("15000.00"), 'peso_liquido': decimal.Decimal("30000.00")}
+        resultados = {}
+        for nome, config in (("sem_logo", {'nome': "Empresa"}), ("com_logo", {'nome': "Empresa", 'logopath': logo})):
+            destino = os.path.join(pasta, f"{nome}.pdf")
+
+            def frio():
+                app._LOGOS_PDF.clear()
+                app.criar_pdf_ticket(destino, config, record)
+
+            resultados[f"{nome}_frio"] = cronometrar(frio, max(3, args.repeticoes // 4))
+            resultados[f"{nome}_quente"] = cronometrar(lambda: app.criar_pdf_ticket(destino, config, record),
+                                                       args.repeticoes)
+            resultados[f"{nome}_tamanho_bytes"] = os.path.getsize(destino)
+        cache = app.CachePdf(os.path.join(pasta, "cache"))
+        config = {'nome': "Empresa", 'logopath': logo}
+        cache.gerar(record, config)
+        resultados['cache_acerto'] = cronometrar(lambda: cache.obter(record, config), args.repeticoes)
+        return resultados
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+
+# --- Baselines ---
+
+def ambiente():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(CAMINHO_APP)).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'python': platform.python_version(), 'plataforma': platform.platform(), 'cpus': os.cpu_count(),
+            'commit': commit, 'data': datetime.datetime.now().isoformat(timespec="seconds")}
+
+
+def achatar(resultados, prefixo=""):
+    for chave, valor in resultados.items():
+        caminho = f"{prefixo}.{chave}" if prefixo else chave
+        if isinstance(valor, dict):
+            yield from achatar(valor, caminho)
+        elif isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            yield caminho, valor
+
+
+def comparar(atual, baseline, tolerancia):
+    # Só compara tempos (maior é pior) e throughput (menor é pior); o resto é contexto
+    referencia = dict(achatar(baseline['resultados']))
+    regressoes = []
+    for caminho, valor in achatar(atual['resultados']):
+        anterior = referencia.get(caminho)
+        if not anterior:
+            continue
+        if caminho.endswith(("p50_ms", "p95_ms")) and valor > anterior * (1 + tolerancia):
+            regressoes.append((caminho, anterior, valor))
+        elif caminho.endswith("por_segundo") and valor < anterior * (1 - tolerancia):
+            regressoes.append((caminho, anterior, valor))
+    return regressoes
+
+
+def lista_inteiros(texto):
+    return [int(parte) for parte in texto.split(",") if parte.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks reprodutíveis da aplicação da balança.")
+    parser.add_argument("--secoes", default="serial,bd,pdf", help="secções a executar (padrão: serial,bd,pdf)")
+    parser.add_argument("--taxas", type=lista_inteiros, default=[10, 50, 200],
+                        help="frames por segundo do indicador simulado (padrão: 10,50,200)")
+    parser.add_argument("--duracao", type=float, default=3.0, help="segundos por taxa simulada (padrão: 3)")
+    parser.add_argument("--tamanhos", type=lista_inteiros, default=[10000, 100000],
+                        help="número de tickets semeados, ex.: 10000,100000,1000000")
+    parser.add_argument("--repeticoes", type=int, default=20, help="repetições por medição (padrão: 20)")
+    parser.add_argument("--mysql-host")
+    parser.add_argument("--mysql-port", type=int, default=3306)
+    parser.add_argument("--mysql-user", default="root")
+    parser.add_argument("--mysql-password", default="")
+    parser.add_argument("--mysql-database", default="balanca_benchmark")
+    parser.add_argument("--saida", help="ficheiro JSON onde gravar os resultados")
+    parser.add_argument("--comparar", help="baseline JSON anterior; termina com erro se houver regressões")
+    parser.add_argument("--tolerancia", type=float, default=0.25,
+                        help="variação aceite face à baseline (padrão: 0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    secoes = {'serial': secao_serial, 'bd': secao_bd, 'pdf': secao_pdf}
+    resultado = {'versao': VERSAO_FORMATO, 'ambiente': ambiente(), 'resultados': {}}
+    for nome in args.secoes.split(","):
+        nome = nome.strip()
+        if nome not in secoes:
+            parser.error(f"secção desconhecida: {nome}")
+        print(f"A medir {nome}...", file=sys.stderr)
+        resultado['resultados'][nome] = secoes[nome](args)
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as ficheiro:
+            ficheiro.write(texto + "\n")
+    else:
+        print(texto)
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as ficheiro:
+            regressoes = comparar(resultado, json.load(ficheiro), args.tolerancia)
+        for caminho, anterior, valor in regressoes:
+            print(f"REGRESSÃO {caminho}: {anterior} -> {valor}", file=sys.stderr)
+        return 1 if regressoes else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())